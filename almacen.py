@@ -0,0 +1,367 @@
+"""
+Almacén de estado de la API ligera (main.py), sin base de datos.
+
+Sustituye a la lectura y reescritura de mediciones.json y config.json en cada
+petición:
+
+- AlmacenEstado: fichero de tamaño fijo proyectado en memoria con el paso
+  pendiente del sensor 1 y la configuración. Las lecturas se hacen sobre la
+  memoria sin locks (seqlock) y las escrituras se serializan con un lock de
+  fichero (flock, o msvcrt.locking en Windows), de modo que varios workers o
+  hilos no pisan el paso pendiente de otro.
+- RegistroMediciones: fichero de solo añadir con las mediciones completas,
+  en registros binarios de tamaño fijo. Al ser de tamaño fijo, la medición
+  i-ésima está en el byte i * tamaño: un rango de fechas se localiza con
+  búsqueda binaria (O(log n) lecturas) y las páginas se leen en bloques sin
+  cargar el fichero entero.
+
+Ambos ficheros persisten en disco: la configuración y el paso pendiente
+sobreviven a un reinicio como antes con los JSON.
+"""
+import bisect
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Callable, Iterator, NamedTuple, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+CLAVES_CONFIG = ("distancia_sensores", "limite_velocidad")
+
+
+class _Cerrojo:
+    """
+    Lock exclusivo entre hilos y procesos sobre un fichero auxiliar.
+
+    flock y msvcrt.locking no excluyen a los hilos del mismo proceso que
+    comparten el descriptor, así que se combinan con un threading.Lock.
+    """
+
+    def __init__(self, ruta: str):
+        self._hilos = threading.Lock()
+        self._fd = os.open(ruta, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+
+    def __enter__(self):
+        self._hilos.acquire()
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                while True:
+                    try:
+                        # LK_LOCK reintenta durante unos 10 s antes de fallar
+                        msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+        except BaseException:
+            self._hilos.release()
+            raise
+        return self
+
+    def __exit__(self, *excepcion):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            self._hilos.release()
+
+    def cerrar(self) -> None:
+        os.close(self._fd)
+
+
+class AlmacenEstado:
+    """
+    Paso pendiente y configuración en un fichero proyectado en memoria.
+
+    Disposición fija (little-endian):
+    - magic (4s) y secuencia (Q): la secuencia es impar mientras hay una
+      escritura en curso; los lectores reintentan si cambia durante la lectura.
+    - timestamp Unix del paso pendiente por el sensor 1 (d, NaN si no hay).
+    - un double por clave de CLAVES_CONFIG (NaN si no está definida).
+
+    `nuevo` es True si el fichero no existía o no era válido, para que quien
+    lo abre pueda importar el estado anterior con iniciar().
+    """
+
+    MAGIC = b"RDRJ"
+    CABECERA = struct.Struct("<4sQ")
+    VALORES = struct.Struct("<d" + "d" * len(CLAVES_CONFIG))
+    TAMANO = CABECERA.size + VALORES.size
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._cerrojo = _Cerrojo(ruta + ".lock")
+        self._fd = os.open(ruta, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o600)
+        with self._cerrojo:
+            if os.fstat(self._fd).st_size < self.TAMANO:
+                os.ftruncate(self._fd, self.TAMANO)
+            self._mm = mmap.mmap(self._fd, self.TAMANO)
+            self.nuevo = self._mm[:4] != self.MAGIC
+            if self.nuevo:
+                self.VALORES.pack_into(self._mm, self.CABECERA.size, *([math.nan] * (1 + len(CLAVES_CONFIG))))
+                self.CABECERA.pack_into(self._mm, 0, self.MAGIC, 0)
+            self._reparar_secuencia()
+
+    def cerrar(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+        self._cerrojo.cerrar()
+
+    def _reparar_secuencia(self) -> int:
+        """Deja la secuencia par si un proceso murió a mitad de una escritura (requiere el cerrojo)."""
+        secuencia = self.CABECERA.unpack_from(self._mm, 0)[1]
+        if secuencia % 2:
+            secuencia += 1
+            self.CABECERA.pack_into(self._mm, 0, self.MAGIC, secuencia)
+        return secuencia
+
+    def _leer(self) -> Tuple[float, ...]:
+        """Instantánea coherente de (pendiente, *config) (seqlock)."""
+        esperas = 0
+        while True:
+            antes = self.CABECERA.unpack_from(self._mm, 0)[1]
+            if antes % 2 == 0:
+                valores = self.VALORES.unpack_from(self._mm, self.CABECERA.size)
+                if self.CABECERA.unpack_from(self._mm, 0)[1] == antes:
+                    return valores
+            esperas += 1
+            if esperas % 1000 == 0:
+                # Escritura en curso demasiado larga: comprobar si el escritor murió
+                with self._cerrojo:
+                    self._reparar_secuencia()
+            time.sleep(0)
+
+    def _actualizar(self, cambio: Callable[[list], object]):
+        """
+        Aplica `cambio` a la lista [pendiente, *config] de forma atómica.
+
+        `cambio` modifica la lista y su valor de retorno se devuelve.
+        """
+        with self._cerrojo:
+            secuencia = self._reparar_secuencia()
+            valores = list(self.VALORES.unpack_from(self._mm, self.CABECERA.size))
+            resultado = cambio(valores)
+            self.CABECERA.pack_into(self._mm, 0, self.MAGIC, secuencia + 1)
+            self.VALORES.pack_into(self._mm, self.CABECERA.size, *valores)
+            self.CABECERA.pack_into(self._mm, 0, self.MAGIC, secuencia + 2)
+        return resultado
+
+    def iniciar(self, config: dict, pendiente: Optional[float] = None) -> None:
+        """Carga la configuración y el paso pendiente iniciales (p. ej. de los antiguos JSON)."""
+        def cargar(valores):
+            if pendiente is not None:
+                valores[0] = float(pendiente)
+            for i, clave in enumerate(CLAVES_CONFIG, start=1):
+                if config.get(clave) is not None:
+                    valores[i] = float(config[clave])
+
+        self._actualizar(cargar)
+
+    def config(self, clave: str, defecto: float) -> float:
+        valor = self._leer()[1 + CLAVES_CONFIG.index(clave)]
+        return defecto if math.isnan(valor) else valor
+
+    def guardar_config(self, clave: str, valor: float) -> None:
+        indice = 1 + CLAVES_CONFIG.index(clave)
+
+        def guardar(valores):
+            valores[indice] = float(valor)
+
+        self._actualizar(guardar)
+
+    def pendiente(self) -> Optional[float]:
+        """Timestamp del paso pendiente por el sensor 1, o None."""
+        valor = self._leer()[0]
+        return None if math.isnan(valor) else valor
+
+    def registrar_paso(self, timestamp: float) -> Optional[float]:
+        """
+        Registra un paso por un sensor de forma atómica.
+
+        Si no había paso pendiente, `timestamp` queda pendiente y devuelve None;
+        si lo había, lo retira y devuelve su timestamp para calcular la velocidad.
+        """
+        def registrar(valores):
+            anterior = valores[0]
+            valores[0] = float(timestamp) if math.isnan(anterior) else math.nan
+            return None if math.isnan(anterior) else anterior
+
+        return self._actualizar(registrar)
+
+    def reiniciar(self) -> None:
+        """Descarta el paso pendiente."""
+        def reiniciar(valores):
+            valores[0] = math.nan
+
+        self._actualizar(reiniciar)
+
+
+class MedicionRegistrada(NamedTuple):
+    id: int
+    timestamp: float
+    velocidad_ms: float
+    velocidad_kmh: float
+    distancia: float
+    tiempo_recorrido: float
+
+
+class _VistaTimestamps:
+    """Secuencia de solo lectura con los timestamps del registro, para bisect."""
+
+    def __init__(self, registro: "RegistroMediciones", longitud: int):
+        self._registro = registro
+        self._longitud = longitud
+
+    def __len__(self) -> int:
+        return self._longitud
+
+    def __getitem__(self, indice: int) -> float:
+        return self._registro.TIMESTAMP.unpack(self._registro._leer(indice, 1)[:8])[0]
+
+
+class RegistroMediciones:
+    """
+    Mediciones completas en un fichero binario de solo añadir.
+
+    Cada registro tiene tamaño fijo (REGISTRO): timestamp Unix del sensor 1,
+    velocidad en m/s y km/h, distancia y tiempo recorrido. El id de una
+    medición es su posición en el fichero (desde 1). Si el proceso muere a
+    mitad de una escritura, el registro incompleto se descarta al abrir.
+
+    Las búsquedas por fecha suponen que los registros están ordenados por
+    timestamp, como ocurre al completarse las mediciones una tras otra. Si la
+    placa retrasa su reloj, las mediciones fuera de orden pueden quedar fuera
+    de un rango de fechas, aunque se siguen listando y contando.
+    """
+
+    REGISTRO = struct.Struct("<ddddd")
+    TIMESTAMP = struct.Struct("<d")
+    # Registros por lectura al recorrer el fichero
+    BLOQUE = 512
+    BLOQUE_AGREGADOS = 65536
+
+    def __init__(self, ruta: str):
+        self.ruta = ruta
+        self._cerrojo = _Cerrojo(ruta + ".lock")
+        self._fd = os.open(
+            ruta, os.O_RDWR | os.O_CREAT | os.O_APPEND | getattr(os, "O_BINARY", 0), 0o600
+        )
+        with self._cerrojo:
+            tamano = os.fstat(self._fd).st_size
+            if tamano % self.REGISTRO.size:
+                os.ftruncate(self._fd, tamano - tamano % self.REGISTRO.size)
+        self._lectura = threading.Lock()
+        # Agregados de los registros [0, _agregados[0]) para estadisticas()
+        self._agregados = [0, 0.0, None, None, 0]
+        self._umbral_agregados = None
+
+    def cerrar(self) -> None:
+        os.close(self._fd)
+        self._cerrojo.cerrar()
+
+    def _leer(self, indice: int, cantidad: int) -> bytes:
+        tamano = self.REGISTRO.size
+        with self._lectura:
+            os.lseek(self._fd, indice * tamano, os.SEEK_SET)
+            return os.read(self._fd, cantidad * tamano)
+
+    def __len__(self) -> int:
+        return os.fstat(self._fd).st_size // self.REGISTRO.size
+
+    def anotar(
+        self,
+        timestamp: float,
+        velocidad_ms: float,
+        velocidad_kmh: float,
+        distancia: float,
+        tiempo_recorrido: float
+    ) -> int:
+        """Añade una medición completa al final del registro y devuelve su id."""
+        registro = self.REGISTRO.pack(timestamp, velocidad_ms, velocidad_kmh, distancia, tiempo_recorrido)
+        with self._cerrojo:
+            medicion_id = len(self) + 1
+            os.write(self._fd, registro)
+        return medicion_id
+
+    def obtener(self, medicion_id: int) -> Optional[MedicionRegistrada]:
+        """Medición con el id indicado, o None si no existe."""
+        if not 1 <= medicion_id <= len(self):
+            return None
+        return MedicionRegistrada(medicion_id, *self.REGISTRO.unpack(self._leer(medicion_id - 1, 1)))
+
+    def posicion(self, timestamp: float, longitud: Optional[int] = None) -> int:
+        """Índice del primer registro con timestamp >= `timestamp` (búsqueda binaria)."""
+        vista = _VistaTimestamps(self, len(self) if longitud is None else longitud)
+        return bisect.bisect_left(vista, timestamp)
+
+    def rango(self, desde: Optional[float] = None, hasta: Optional[float] = None) -> Tuple[int, int]:
+        """
+        Índices [inicio, fin) de los registros con desde <= timestamp < hasta.
+
+        Parámetros:
+        - desde, hasta (float, opcional): Timestamps Unix; sin ellos el rango no
+          tiene límite por ese lado.
+
+        Retorno:
+        - Tuple[int, int]: Índice del primer registro del rango y del siguiente al último.
+        """
+        longitud = len(self)
+        inicio = 0 if desde is None else self.posicion(desde, longitud)
+        fin = longitud if hasta is None else self.posicion(hasta, longitud)
+        return inicio, max(inicio, fin)
+
+    def iterar(self, inicio: int, fin: int, inverso: bool = False) -> Iterator[MedicionRegistrada]:
+        """Recorre los registros [inicio, fin) leyendo BLOQUE registros cada vez."""
+        bloques = range(inicio, fin, self.BLOQUE)
+        for bloque in (reversed(bloques) if inverso else bloques):
+            cantidad = min(self.BLOQUE, fin - bloque)
+            mediciones = [
+                MedicionRegistrada(bloque + i + 1, *valores)
+                for i, valores in enumerate(self.REGISTRO.iter_unpack(self._leer(bloque, cantidad)))
+            ]
+            yield from (reversed(mediciones) if inverso else mediciones)
+
+    def estadisticas(self, umbral_exceso: float) -> dict:
+        """
+        Total, media, máximo, mínimo y excesos de velocidad (km/h) de todas las mediciones.
+
+        Los agregados se guardan en el proceso y cada llamada solo lee los
+        registros añadidos desde la anterior.
+        """
+        with self._lectura:
+            agregados = self._agregados
+            if self._umbral_agregados != umbral_exceso:
+                agregados = [0, 0.0, None, None, 0]
+        total, suma, maxima, minima, excesos = agregados
+        longitud = len(self)
+        for bloque in range(total, longitud, self.BLOQUE_AGREGADOS):
+            datos = self._leer(bloque, min(self.BLOQUE_AGREGADOS, longitud - bloque))
+            velocidades = [valores[2] for valores in self.REGISTRO.iter_unpack(datos)]
+            suma += math.fsum(velocidades)
+            maxima = max(velocidades) if maxima is None else max(maxima, *velocidades)
+            minima = min(velocidades) if minima is None else min(minima, *velocidades)
+            excesos += sum(1 for velocidad in velocidades if velocidad > umbral_exceso)
+        agregados = [longitud, suma, maxima, minima, excesos]
+        with self._lectura:
+            if self._umbral_agregados != umbral_exceso or self._agregados[0] < longitud:
+                self._agregados = agregados
+                self._umbral_agregados = umbral_exceso
+        return {
+            "total": longitud,
+            "suma_kmh": suma,
+            "maxima_kmh": maxima,
+            "minima_kmh": minima,
+            "excesos": excesos,
+        }
@@ -0,0 +1,278 @@
+"""
+Consultas de lectura compartidas por los endpoints síncronos y async.
+
+Cada función construye la sentencia select() y el llamador la ejecuta con su
+propio tipo de sesión (Session o AsyncSession), de modo que el listado y las
+estadísticas devuelven lo mismo con DB_ASYNC activado o desactivado.
+"""
+import base64
+import binascii
+import json
+from datetime import datetime, date
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select, case, tuple_, exists, func
+
+import models
+import schemas
+from emparejamiento import hora_local
+from estadisticas import ID_RESUMEN
+from sketch import SketchVelocidad
+
+
+class Cursor(NamedTuple):
+    """
+    Posición de una página del listado: la medición frontera y el sentido.
+
+    "siguiente" pide las mediciones anteriores (más antiguas) a la frontera y
+    "anterior" las posteriores, siempre en el orden (timestamp, id) descendente.
+    """
+    timestamp: datetime
+    id: int
+    direccion: str
+
+
+def codificar_cursor(medicion, direccion: str) -> str:
+    """Token opaco (base64 URL-safe) que apunta a una página vecina."""
+    datos = json.dumps(
+        [medicion.timestamp.isoformat(), medicion.id, direccion],
+        separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(token: str) -> Cursor:
+    """
+    Interpreta un token generado por codificar_cursor().
+
+    Excepciones:
+    - ValueError: Si el token no es válido.
+    """
+    try:
+        relleno = "=" * (-len(token) % 4)
+        timestamp, medicion_id, direccion = json.loads(base64.urlsafe_b64decode(token + relleno))
+        cursor = Cursor(datetime.fromisoformat(timestamp), int(medicion_id), direccion)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Cursor no válido")
+    if cursor.direccion not in ("siguiente", "anterior"):
+        raise ValueError("Cursor no válido")
+    return cursor
+
+
+def filtrar_mediciones(
+    sentencia,
+    solo_completas: bool = True,
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    carril: Optional[str] = None
+):
+    """Aplica a un SELECT sobre mediciones los filtros comunes del listado y la exportación."""
+    if solo_completas:
+        sentencia = sentencia.where(models.Medicion.medicion_completa == True)
+
+    if fecha_inicio:
+        inicio = datetime.combine(fecha_inicio, datetime.min.time())
+        sentencia = sentencia.where(models.Medicion.timestamp >= inicio)
+    if fecha_fin:
+        fin = datetime.combine(fecha_fin, datetime.max.time())
+        sentencia = sentencia.where(models.Medicion.timestamp <= fin)
+    if carril:
+        sentencia = sentencia.where(models.Medicion.carril == carril)
+    return sentencia
+
+
+def sentencia_listado(
+    skip: int = 0,
+    limit: int = 20,
+    solo_completas: bool = True,
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    carril: Optional[str] = None,
+    cursor: Optional[Cursor] = None
+):
+    """
+    SELECT de mediciones para GET /mediciones/, más recientes primero.
+
+    Con cursor, la página empieza justo después de la medición frontera
+    mediante una comparación sobre (timestamp, id), que recorre el índice
+    ix_mediciones_completa_timestamp_id desde ese punto: cualquier página cuesta lo
+    mismo que la primera. Se pide una fila más de limit para saber si hay
+    otra página en el mismo sentido (ver paginar()).
+
+    Parámetros:
+    - skip, limit: Paginación. skip solo se aplica sin cursor.
+    - solo_completas (bool): Si True, solo incluye mediciones con velocidad calculada.
+    - fecha_inicio, fecha_fin (date, opcional): Rango de fechas, ambos inclusive.
+    - carril (str, opcional): Si se proporciona, solo incluye mediciones de ese carril.
+    - cursor (Cursor, opcional): Página a partir de la que se lista.
+    """
+    sentencia = filtrar_mediciones(
+        select(models.Medicion), solo_completas, fecha_inicio, fecha_fin, carril
+    )
+
+    clave = tuple_(models.Medicion.timestamp, models.Medicion.id)
+    if cursor is None:
+        return sentencia.order_by(
+            models.Medicion.timestamp.desc(), models.Medicion.id.desc()
+        ).offset(skip).limit(limit + 1)
+    if cursor.direccion == "siguiente":
+        return sentencia.where(clave < tuple_(cursor.timestamp, cursor.id)).order_by(
+            models.Medicion.timestamp.desc(), models.Medicion.id.desc()
+        ).limit(limit + 1)
+    # Página anterior: recorrer hacia delante desde la frontera y devolver invertido
+    return sentencia.where(clave > tuple_(cursor.timestamp, cursor.id)).order_by(
+        models.Medicion.timestamp.asc(), models.Medicion.id.asc()
+    ).limit(limit + 1)
+
+
+def paginar(
+    filas: list,
+    limit: int,
+    cursor: Optional[Cursor] = None,
+    skip: int = 0
+) -> Tuple[list, Optional[str], Optional[str]]:
+    """
+    Recorta el resultado de sentencia_listado() y calcula los cursores vecinos.
+
+    Retorno:
+    - Tupla (mediciones en orden descendente, cursor siguiente, cursor anterior);
+      cada cursor es None si no hay página en ese sentido.
+    """
+    hay_mas = len(filas) > limit
+    filas = filas[:limit]
+    if cursor is not None and cursor.direccion == "anterior":
+        filas.reverse()
+        hay_siguiente, hay_anterior = True, hay_mas
+    else:
+        hay_siguiente, hay_anterior = hay_mas, cursor is not None or skip > 0
+
+    if not filas:
+        return filas, None, None
+    siguiente = codificar_cursor(filas[-1], "siguiente") if hay_siguiente else None
+    anterior = codificar_cursor(filas[0], "anterior") if hay_anterior else None
+    return filas, siguiente, anterior
+
+
+def sentencia_estadisticas(hoy: date):
+    """
+    SELECT de las estadísticas materializadas para GET /estadisticas/.
+
+    Lee la fila del resumen y la del día actual por clave primaria, por lo que
+    su coste no depende del número de mediciones almacenadas.
+    """
+    resumen = models.EstadisticasResumen
+    mediciones_hoy = select(models.EstadisticasDiarias.total).where(
+        models.EstadisticasDiarias.fecha == hoy
+    ).scalar_subquery()
+
+    return select(
+        resumen.total.label("total"),
+        case((resumen.total > 0, resumen.suma_kmh / resumen.total), else_=None).label("promedio"),
+        resumen.maxima_kmh.label("maxima"),
+        resumen.minima_kmh.label("minima"),
+        mediciones_hoy.label("mediciones_hoy"),
+        resumen.excesos.label("excesos")
+    ).where(resumen.id == ID_RESUMEN)
+
+
+def respuesta_estadisticas(stats) -> schemas.EstadisticasResponse:
+    """Convierte la fila de sentencia_estadisticas() en EstadisticasResponse."""
+    if stats is None:
+        # Resumen todavía no creado (init_estadisticas no se ha ejecutado)
+        return schemas.EstadisticasResponse(total_mediciones=0, mediciones_hoy=0, excesos_velocidad=0)
+    return schemas.EstadisticasResponse(
+        total_mediciones=stats.total or 0,
+        velocidad_promedio_kmh=round(stats.promedio, 2) if stats.promedio else None,
+        velocidad_maxima_kmh=round(stats.maxima, 2) if stats.maxima else None,
+        velocidad_minima_kmh=round(stats.minima, 2) if stats.minima else None,
+        mediciones_hoy=stats.mediciones_hoy or 0,
+        excesos_velocidad=stats.excesos or 0
+    )
+
+
+def sentencia_series(granularidad: str, fecha_inicio: date, fecha_fin: date):
+    """SELECT de los intervalos de series_velocidad entre dos fechas, ambas inclusive."""
+    serie = models.SerieVelocidad
+    return select(serie).where(
+        serie.granularidad == granularidad,
+        serie.inicio >= datetime.combine(fecha_inicio, datetime.min.time()),
+        serie.inicio <= datetime.combine(fecha_fin, datetime.max.time())
+    ).order_by(serie.inicio)
+
+
+def respuesta_series(intervalos) -> List[schemas.PuntoSerieResponse]:
+    """Convierte las filas de sentencia_series() en puntos con media y percentiles."""
+    puntos = []
+    for intervalo in intervalos:
+        sketch = SketchVelocidad.desde_json(intervalo.sketch) if intervalo.sketch else None
+
+        def percentil(q):
+            valor = sketch.cuantil(q) if sketch else None
+            return round(valor, 2) if valor is not None else None
+
+        puntos.append(schemas.PuntoSerieResponse(
+            inicio=intervalo.inicio,
+            total=intervalo.total,
+            velocidad_media_kmh=round(intervalo.suma_kmh / intervalo.total, 2) if intervalo.total else None,
+            p50_kmh=percentil(0.50),
+            p85_kmh=percentil(0.85),
+            p95_kmh=percentil(0.95),
+            excesos=intervalo.excesos
+        ))
+    return puntos
+
+
+def sentencia_carriles_pendientes():
+    """
+    SELECT de (carril, pendientes, desde) de cada carril con pasos pendientes.
+
+    El filtro coincide con el del índice parcial ix_mediciones_pendientes, que
+    solo contiene las filas pendientes: el coste depende de cuántos pasos
+    esperan a su detector2, no del tamaño de la tabla.
+    """
+    return select(
+        models.Medicion.carril,
+        func.count().label("pendientes"),
+        func.min(models.Medicion.timestamp).label("desde")
+    ).where(
+        models.Medicion.es_primera_medicion == True,
+        models.Medicion.medicion_completa == False
+    ).group_by(models.Medicion.carril).order_by(models.Medicion.carril)
+
+
+def respuesta_estado(
+    filas,
+    distancia_sensores: float,
+    limite_velocidad: float
+) -> schemas.EstadoResponse:
+    """
+    Construye EstadoResponse a partir de filas (carril, pendientes, desde).
+
+    Las filas pueden venir de sentencia_carriles_pendientes() o de
+    MotorEmparejamiento.resumen_pendientes(); un "desde" con zona horaria se
+    pasa a hora local para calcular la antigüedad.
+    """
+    ahora = datetime.now()
+    carriles = [
+        schemas.CarrilPendienteResponse(
+            carril=carril,
+            pendientes=pendientes,
+            desde=desde,
+            antiguedad_segundos=round(max((ahora - hora_local(desde)).total_seconds(), 0.0), 3)
+        )
+        for carril, pendientes, desde in filas
+    ]
+    return schemas.EstadoResponse(
+        esperando_sensor2=bool(carriles),
+        carriles=carriles,
+        distancia_sensores=distancia_sensores,
+        limite_velocidad=limite_velocidad
+    )
+
+
+def sentencia_hay_pendiente():
+    """SELECT EXISTS de alguna medición iniciada por detector1 y sin completar."""
+    return select(exists().where(
+        models.Medicion.es_primera_medicion == True,
+        models.Medicion.medicion_completa == False
+    ))
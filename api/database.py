@@ -1,24 +1,33 @@
 from sqlalchemy import create_engine, event
+from sqlalchemy import exc
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
 
+from metricas import METRICAS, instrumentar_engine, QueuePoolMedido, AsyncQueuePoolMedido
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{os.path.join(BASE_DIR, 'db', 'radar_velocidad.db')}")
 
+# Con METRICAS, los pools miden la espera de cada checkout (ver metricas.py)
+opciones_pool = {"poolclass": QueuePoolMedido} if METRICAS else {}
+opciones_pool_async = {"poolclass": AsyncQueuePoolMedido} if METRICAS else {}
+
 # Configuración según el tipo de base de datos
 if DATABASE_URL.startswith("postgresql"):
     engine = create_engine(
         DATABASE_URL,
         pool_size=10,
         max_overflow=20,
-        pool_pre_ping=True
+        pool_pre_ping=True,
+        **opciones_pool
     )
 else:
     # SQLite
     engine = create_engine(
         DATABASE_URL,
-        connect_args={"check_same_thread": False}
+        connect_args={"check_same_thread": False},
+        **opciones_pool
     )
 
     @event.listens_for(engine, "connect")
@@ -30,14 +39,76 @@ else:
         cursor.execute("PRAGMA temp_store=MEMORY")
         cursor.close()
 
+if METRICAS:
+    instrumentar_engine(engine)
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Con DB_ASYNC=true, la ingesta, el listado y las estadísticas usan un engine async
+# (asyncpg para PostgreSQL, aiosqlite para SQLite) y se atienden en el event loop
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() == "true"
+
+
+def url_async(url: str) -> str:
+    """Traduce DATABASE_URL al driver async equivalente."""
+    if url.startswith("postgresql"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+async_engine = None
+AsyncSessionLocal = None
+
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+
+    if DATABASE_URL.startswith("postgresql"):
+        async_engine = create_async_engine(
+            url_async(DATABASE_URL),
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            **opciones_pool_async
+        )
+    else:
+        async_engine = create_async_engine(url_async(DATABASE_URL), **opciones_pool_async)
+        # Mismos PRAGMA que el engine síncrono en cada conexión nueva
+        event.listen(async_engine.sync_engine, "connect", set_sqlite_pragma)
+    if METRICAS:
+        instrumentar_engine(async_engine.sync_engine)
+
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+    )
+
 Base = declarative_base()
 
 
+def es_error_transitorio(error: BaseException) -> bool:
+    """
+    Indica si un error de base de datos puede desaparecer al reintentar.
+
+    Son transitorios los errores de conexión, de bloqueo (por ejemplo, "database
+    is locked" en SQLite) y la espera agotada del pool; los errores de datos o de
+    integridad se repiten en cada intento.
+    """
+    if isinstance(error, exc.DBAPIError) and error.connection_invalidated:
+        return True
+    return isinstance(error, (
+        exc.OperationalError, exc.InterfaceError, exc.DisconnectionError, exc.TimeoutError
+    ))
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
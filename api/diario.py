@@ -0,0 +1,356 @@
+"""
+Diario de ingesta para el modo de escritura diferida (INGESTA_DIFERIDA=true).
+
+En este modo POST /mediciones/ y POST /mediciones/batch (rutas_diferidas.py)
+no escriben en la base de datos: validan los eventos, los añaden a un fichero
+local de solo anexado y responden en cuanto el fichero está en disco (fsync).
+Un hilo escritor los aplica después a la base de datos con la misma lógica que
+POST /mediciones/batch (registrar_lote), en grupos de hasta
+DIARIO_MAX_EVENTOS eventos con un único commit por grupo, cada
+DIARIO_INTERVALO_MS milisegundos o en cuanto hay un grupo completo.
+
+Las peticiones concurrentes comparten el fsync del diario: cada una espera a
+que alguna sincronización cubra su evento, de modo que con muchas peticiones
+a la vez se hace un fsync por ronda y no uno por evento.
+
+Formato: una primera línea JSON con la época del fichero ({"diario": "<hex>"})
+y una línea por evento ([tipo, carril, timestamp ISO] y, en las mediciones
+completas calculadas en la placa, su tiempo_recorrido). La posición hasta la
+que se aplicó se guarda en la tabla estado ("época:offset") en la misma
+transacción que cada grupo, de modo que al arrancar se aplica exactamente lo
+que faltaba. Cuando todo está aplicado y el fichero supera DIARIO_MAX_BYTES,
+se vacía y empieza una época nueva.
+
+Cada worker usa su propio fichero (ingesta.N.diario), reservado con flock; al
+reiniciar, el worker que reserva un fichero aplica primero sus eventos
+pendientes.
+
+Un grupo que falla por un error transitorio (base de datos no disponible,
+bloqueo, conflicto 409) se reintenta entero. Si el error es permanente, el
+grupo se aplica evento a evento y los que vuelven a fallar se apartan en
+<fichero>.rechazados (una línea JSON por evento, con el error) y se dan por
+aplicados, para que un evento defectuoso no detenga el diario.
+
+La respuesta no incluye la medición (id, velocidad), que solo se conoce al
+aplicar el evento: los dashboards la reciben por /stream/mediciones.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from typing import Deque, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from database import BASE_DIR, SessionLocal, es_error_transitorio
+import models
+from emparejamiento import Evento, hora_local
+from estadisticas import insertar_con_conflicto
+from ingesta import registrar_lote
+
+try:
+    import fcntl
+except ImportError:
+    # Sin flock (Windows) un único proceso usa el primer fichero
+    fcntl = None
+
+# Modo de ingesta diferida: confirmar al escribir en el diario y aplicar en segundo plano
+INGESTA_DIFERIDA = os.getenv("INGESTA_DIFERIDA", "false").lower() == "true"
+# Prefijo de los ficheros del diario (uno por worker: <prefijo>.N.diario)
+RUTA_DIARIO = os.getenv("DIARIO_INGESTA", os.path.join(BASE_DIR, "db", "ingesta"))
+# Milisegundos que el escritor espera a completar un grupo
+INTERVALO_DIARIO_MS = float(os.getenv("DIARIO_INTERVALO_MS", "5"))
+# Eventos máximos por grupo (un commit)
+MAX_EVENTOS_GRUPO = int(os.getenv("DIARIO_MAX_EVENTOS", "1000"))
+# Tamaño a partir del cual el diario se vacía cuando no quedan eventos por aplicar
+MAX_BYTES_DIARIO = int(os.getenv("DIARIO_MAX_BYTES", str(16 * 1024 * 1024)))
+# Ficheros de diario que se prueban al reservar uno
+MAX_FICHEROS_DIARIO = 64
+# Segundos de espera tras un error al aplicar un grupo
+ESPERA_REINTENTO = 1.0
+
+
+def _campos(evento: Evento) -> list:
+    campos = [evento.tipo, evento.carril, evento.timestamp.isoformat()]
+    if evento.tiempo_recorrido is not None:
+        campos.append(evento.tiempo_recorrido)
+    return campos
+
+
+def _codificar(evento: Evento) -> bytes:
+    return (json.dumps(_campos(evento)) + "\n").encode()
+
+
+def _decodificar(linea: bytes) -> Evento:
+    tipo, carril, timestamp, *tiempo_recorrido = json.loads(linea)
+    # Los diarios anteriores pueden contener timestamps con zona horaria
+    return Evento(tipo, carril, hora_local(datetime.fromisoformat(timestamp)), *tiempo_recorrido)
+
+
+def _es_transitorio(error: BaseException) -> bool:
+    """Errores tras los que se reintenta el mismo grupo: de conexión o bloqueo, o un conflicto 409."""
+    if isinstance(error, HTTPException):
+        return error.status_code == 409
+    return es_error_transitorio(error)
+
+
+class DiarioIngesta:
+    """
+    Diario local de eventos con confirmación por fsync y escritor en segundo plano.
+
+    Uso:
+
+        diario.iniciar()            # al arrancar: reserva el fichero y lanza el escritor
+        diario.anotar([evento])     # en cada petición; vuelve con el evento en disco
+        diario.detener()            # al parar: aplica lo pendiente y cierra
+    """
+
+    def __init__(self, prefijo: str = RUTA_DIARIO):
+        self.prefijo = prefijo
+        self.ruta: Optional[str] = None
+        self.clave: Optional[str] = None
+        self.epoca = ""
+        self._fichero = None
+        # Protege el fichero, la cola y los offsets; el escritor espera en _hay_eventos
+        self._lock = threading.Lock()
+        self._hay_eventos = threading.Condition(self._lock)
+        # Serializa los fsync: quien lo obtiene sincroniza lo escrito por todos
+        self._lock_sync = threading.Lock()
+        # Eventos escritos y no aplicados, con el offset del final de su línea
+        self._cola: Deque[Tuple[int, Evento]] = deque()
+        self._escrito = 0
+        self._sincronizado = 0
+        self._detener = False
+        self._hilo: Optional[threading.Thread] = None
+        self.aplicados = 0
+        self.grupos = 0
+        self.rechazados = 0
+
+    def __len__(self) -> int:
+        return len(self._cola)
+
+    def _reservar(self) -> int:
+        """Abre el primer fichero del diario que ningún otro proceso tiene reservado."""
+        os.makedirs(os.path.dirname(os.path.abspath(self.prefijo)), exist_ok=True)
+        for numero in range(MAX_FICHEROS_DIARIO):
+            ruta = f"{self.prefijo}.{numero}.diario"
+            fichero = open(ruta, "a+b")
+            if fcntl is None:
+                self.ruta, self._fichero = ruta, fichero
+                return numero
+            try:
+                fcntl.flock(fichero.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                fichero.close()
+                continue
+            self.ruta, self._fichero = ruta, fichero
+            return numero
+        raise RuntimeError(f"No hay ningún fichero de diario libre en {self.prefijo}.*.diario")
+
+    def _nueva_epoca(self) -> None:
+        """Vacía el fichero y escribe la cabecera de una época nueva (requiere _lock)."""
+        self.epoca = uuid.uuid4().hex
+        self._fichero.truncate(0)
+        self._fichero.write((json.dumps({"diario": self.epoca}) + "\n").encode())
+        self._fichero.flush()
+        os.fsync(self._fichero.fileno())
+        self._escrito = self._sincronizado = self._fichero.tell()
+
+    def _leer_aplicado(self) -> Tuple[str, int]:
+        with SessionLocal() as db:
+            fila = db.get(models.Estado, self.clave)
+        if fila is None:
+            return "", 0
+        epoca, offset = fila.valor.split(":")
+        return epoca, int(offset)
+
+    def _recuperar(self) -> None:
+        """
+        Lee el fichero reservado y encola los eventos que no llegaron a aplicarse.
+
+        Una última línea incompleta (proceso interrumpido a mitad de escritura)
+        nunca se confirmó al cliente y se descarta. Una línea que no se puede
+        decodificar se aparta en el fichero de rechazados.
+        """
+        self._fichero.seek(0)
+        contenido = self._fichero.read()
+        if not contenido.startswith(b'{"diario"') or b"\n" not in contenido:
+            self._nueva_epoca()
+            return
+
+        cabecera, _, _ = contenido.partition(b"\n")
+        self.epoca = json.loads(cabecera)["diario"]
+        epoca_aplicada, aplicado = self._leer_aplicado()
+        if epoca_aplicada != self.epoca:
+            aplicado = 0
+
+        offset = len(cabecera) + 1
+        while True:
+            fin = contenido.find(b"\n", offset)
+            if fin < 0:
+                break
+            if fin + 1 > aplicado:
+                linea = contenido[offset:fin]
+                try:
+                    self._cola.append((fin + 1, _decodificar(linea)))
+                except (ValueError, TypeError) as e:
+                    self._apartar(linea.decode(errors="replace"), e)
+            offset = fin + 1
+        if offset < len(contenido):
+            self._fichero.truncate(offset)
+        self._fichero.seek(0, os.SEEK_END)
+        self._escrito = self._sincronizado = offset
+
+    def iniciar(self) -> None:
+        """Reserva un fichero, recupera sus eventos pendientes y lanza el hilo escritor."""
+        numero = self._reservar()
+        self.clave = f"diario_ingesta_{numero}"
+        with self._lock:
+            self._recuperar()
+        if self._cola:
+            print(f"Diario {self.ruta}: {len(self._cola)} eventos pendientes de aplicar")
+        self._detener = False
+        self._hilo = threading.Thread(target=self._escribir, name="escritor-diario", daemon=True)
+        self._hilo.start()
+
+    def anotar(self, eventos: List[Evento]) -> None:
+        """
+        Añade eventos al diario y vuelve cuando están en disco.
+
+        Parámetros:
+        - eventos (List[Evento]): Eventos ya normalizados, en orden de llegada.
+        """
+        with self._lock:
+            for evento in eventos:
+                evento = evento._replace(timestamp=hora_local(evento.timestamp))
+                linea = _codificar(evento)
+                self._fichero.write(linea)
+                self._escrito += len(linea)
+                self._cola.append((self._escrito, evento))
+            objetivo = self._escrito
+            epoca = self.epoca
+            self._hay_eventos.notify()
+
+        with self._lock_sync:
+            if self._sincronizado >= objetivo or self.epoca != epoca:
+                # Otro hilo sincronizó ya este evento, o ya se aplicó y el diario se vació
+                return
+            with self._lock:
+                self._fichero.flush()
+                hasta = self._escrito
+            os.fsync(self._fichero.fileno())
+            self._sincronizado = hasta
+
+    def _sentencia_aplicado(self, offset: int):
+        valor = f"{self.epoca}:{offset}"
+        upsert = insertar_con_conflicto(models.Estado).values(clave=self.clave, valor=valor)
+        return upsert.on_conflict_do_update(index_elements=[models.Estado.clave], set_={"valor": valor})
+
+    def _siguiente_grupo(self) -> List[Tuple[int, Evento]]:
+        """Espera a que haya eventos y devuelve el siguiente grupo sin sacarlo de la cola."""
+        with self._lock:
+            while not self._cola and not self._detener:
+                self._hay_eventos.wait()
+            if len(self._cola) < MAX_EVENTOS_GRUPO and not self._detener:
+                self._hay_eventos.wait_for(
+                    lambda: len(self._cola) >= MAX_EVENTOS_GRUPO or self._detener,
+                    timeout=INTERVALO_DIARIO_MS / 1000
+                )
+            return list(islice(self._cola, MAX_EVENTOS_GRUPO))
+
+    def _aplicar(self, grupo: List[Tuple[int, Evento]]) -> None:
+        """Aplica un grupo en una transacción junto con la nueva posición aplicada."""
+        with SessionLocal() as db:
+            registrar_lote(
+                db, [evento for _, evento in grupo],
+                sentencias_extra=[self._sentencia_aplicado(grupo[-1][0])]
+            )
+        self._avanzar(len(grupo))
+        self.aplicados += len(grupo)
+        self.grupos += 1
+
+    def _avanzar(self, eventos: int) -> None:
+        """Saca de la cola los primeros eventos, ya aplicados o rechazados."""
+        with self._lock_sync, self._lock:
+            for _ in range(eventos):
+                self._cola.popleft()
+            if not self._cola and self._escrito > MAX_BYTES_DIARIO:
+                self._nueva_epoca()
+
+    def _apartar(self, evento, error: BaseException) -> None:
+        """Añade un evento (campos o línea original) al fichero de rechazados, con su error."""
+        linea = json.dumps({
+            "evento": evento,
+            "error": f"{type(error).__name__}: {error}",
+            "rechazado": datetime.now().isoformat()
+        })
+        with open(f"{self.ruta}.rechazados", "ab") as fichero:
+            fichero.write((linea + "\n").encode())
+            fichero.flush()
+            os.fsync(fichero.fileno())
+
+    def _rechazar(self, entrada: Tuple[int, Evento], error: BaseException) -> None:
+        """
+        Aparta un evento que no se puede aplicar y avanza la posición aplicada.
+
+        Si el proceso termina entre ambos pasos, el evento se rechaza de nuevo al
+        arrancar y aparece dos veces en el fichero de rechazados.
+        """
+        offset, evento = entrada
+        print(f"Diario {self.ruta}: evento rechazado {_campos(evento)}:", error)
+        self._apartar(_campos(evento), error)
+        with SessionLocal() as db:
+            db.execute(self._sentencia_aplicado(offset))
+            db.commit()
+        self._avanzar(1)
+        self.rechazados += 1
+
+    def _aplicar_uno_a_uno(self, grupo: List[Tuple[int, Evento]]) -> None:
+        """Aplica cada evento del grupo por separado y rechaza los que fallan de forma permanente."""
+        for entrada in grupo:
+            try:
+                self._aplicar([entrada])
+            except Exception as e:
+                if _es_transitorio(e):
+                    raise
+                self._rechazar(entrada, e)
+
+    def _escribir(self) -> None:
+        while True:
+            grupo = self._siguiente_grupo()
+            if not grupo:
+                return
+            try:
+                try:
+                    self._aplicar(grupo)
+                except Exception as e:
+                    if _es_transitorio(e):
+                        raise
+                    # Algún evento del grupo no se puede aplicar: localizarlo
+                    self._aplicar_uno_a_uno(grupo)
+            except Exception as e:
+                # Los eventos siguen en la cola y en el diario: reintentar el mismo
+                # grupo, o al arrancar de nuevo si el proceso se está deteniendo
+                print("Error aplicando el diario de ingesta:", e)
+                if self._detener:
+                    return
+                time.sleep(ESPERA_REINTENTO)
+
+    def detener(self) -> None:
+        """Aplica los eventos pendientes, detiene el escritor y cierra el fichero."""
+        if self._hilo is not None:
+            with self._lock:
+                self._detener = True
+                self._hay_eventos.notify()
+            self._hilo.join()
+            self._hilo = None
+        if self._fichero is not None:
+            self._fichero.close()
+            self._fichero = None
+
+
+diario = DiarioIngesta() if INGESTA_DIFERIDA else None
@@ -0,0 +1,95 @@
+"""
+Difusión en tiempo real de las mediciones (Server-Sent Events).
+
+Un único Difusor por worker vigila el "último post" del estado compartido y,
+cada vez que cambia, reenvía el nuevo valor a las colas de todos los clientes
+suscritos a /stream/mediciones. registrar_medicion avisa al difusor de su
+propio worker al instante con notificar(); los cambios hechos por otros
+workers se detectan comparando estado.version() cada INTERVALO_COMPARTIDO
+segundos, sin consultar la base de datos.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Optional, Set
+
+from estado_compartido import EstadoCompartido
+
+# Eventos que puede acumular un cliente lento antes de descartar los más antiguos
+TAM_COLA_CLIENTE = 32
+# Cada cuánto se comprueba si otro worker publicó un cambio
+INTERVALO_COMPARTIDO = 0.05
+
+
+class Difusor:
+    def __init__(self, estado: EstadoCompartido):
+        self.estado = estado
+        self._clientes: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._aviso: Optional[asyncio.Event] = None
+        self._tarea: Optional[asyncio.Task] = None
+        self._ultimo_timestamp = None
+
+    @property
+    def clientes(self) -> int:
+        return len(self._clientes)
+
+    def iniciar(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        self._aviso = asyncio.Event()
+        self._ultimo_timestamp = self.estado.ultimo_post()["timestamp"]
+        self._tarea = loop.create_task(self._vigilar())
+
+    async def detener(self) -> None:
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+        # None indica a cada suscriptor que la conexión debe cerrarse
+        for cola in list(self._clientes):
+            self._encolar(cola, None)
+
+    def notificar(self) -> None:
+        """Avisa de un cambio en el último post. Se puede llamar desde cualquier hilo."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._aviso.set)
+
+    @asynccontextmanager
+    async def suscripcion(self):
+        cola: asyncio.Queue = asyncio.Queue(maxsize=TAM_COLA_CLIENTE)
+        self._clientes.add(cola)
+        try:
+            yield cola
+        finally:
+            self._clientes.discard(cola)
+
+    @staticmethod
+    def _encolar(cola: asyncio.Queue, post) -> None:
+        if cola.full():
+            cola.get_nowait()
+        cola.put_nowait(post)
+
+    async def _vigilar(self) -> None:
+        espera = INTERVALO_COMPARTIDO if self.estado.compartido else None
+        version = self.estado.version()
+        while True:
+            try:
+                await asyncio.wait_for(self._aviso.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+            self._aviso.clear()
+
+            actual = self.estado.version()
+            if actual == version:
+                continue
+            version = actual
+
+            # La versión también cambia con la configuración: difundir solo
+            # si hay un último post distinto del ya enviado
+            post = self.estado.ultimo_post()
+            if post["data"] is None or post["timestamp"] == self._ultimo_timestamp:
+                continue
+            self._ultimo_timestamp = post["timestamp"]
+            for cola in list(self._clientes):
+                self._encolar(cola, post)
@@ -0,0 +1,344 @@
+"""
+Motor de emparejamiento en memoria para los eventos detector1/detector2.
+
+Mantiene, para cada carril, una cola FIFO con los pasos por el detector1 que
+todavía esperan su detector2, de modo que registrar_medicion no necesita
+consultar la base de datos para encontrar la fila que debe completar. La tabla
+sigue siendo la fuente de verdad: al arrancar se reconstruye el estado a partir
+de las filas pendientes y, si la memoria no coincide con la tabla (por ejemplo,
+porque otro worker inició o completó la medición), se recurre a la consulta por
+carril, que usa el índice parcial de pasos pendientes (carril, timestamp).
+"""
+import asyncio
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+
+CARRIL_POR_DEFECTO = "principal"
+
+
+def hora_local(valor: datetime) -> datetime:
+    """Convierte un datetime con zona horaria a hora local naive; los naive no cambian."""
+    if valor.tzinfo is None:
+        return valor
+    return valor.astimezone().replace(tzinfo=None)
+
+
+class Pendiente(NamedTuple):
+    """Paso por el detector1 que todavía espera al detector2."""
+    id: int
+    timestamp: datetime
+    distancia: float
+    carril: str = CARRIL_POR_DEFECTO
+
+
+class MotorEmparejamiento:
+    """
+    Estado de emparejamiento de un proceso de la API.
+
+    Todas las operaciones sobre las colas son O(1) y no acceden a la base de
+    datos, salvo reconstruir() y reconstruir_carril(), que se usan en el
+    arranque y como ruta de recuperación. bloqueo(carril) devuelve un lock por
+    carril para que los endpoints serialicen la decisión de emparejamiento
+    junto con la escritura correspondiente sin bloquear a los demás carriles.
+    """
+
+    def __init__(self):
+        self._colas: Dict[str, Deque[Pendiente]] = {}
+        self._bloqueos: Dict[str, threading.Lock] = {}
+        self._bloqueos_async: Dict[str, asyncio.Lock] = {}
+        self._lock = threading.Lock()
+
+    def bloqueo(self, carril: str) -> threading.Lock:
+        bloqueo = self._bloqueos.get(carril)
+        if bloqueo is None:
+            with self._lock:
+                bloqueo = self._bloqueos.setdefault(carril, threading.Lock())
+        return bloqueo
+
+    def bloqueo_async(self, carril: str) -> asyncio.Lock:
+        """Equivalente a bloqueo() para los endpoints async, que no deben bloquear el event loop."""
+        bloqueo = self._bloqueos_async.get(carril)
+        if bloqueo is None:
+            with self._lock:
+                bloqueo = self._bloqueos_async.setdefault(carril, asyncio.Lock())
+        return bloqueo
+
+    def _cola(self, carril: str) -> Deque[Pendiente]:
+        cola = self._colas.get(carril)
+        if cola is None:
+            with self._lock:
+                cola = self._colas.setdefault(carril, deque())
+        return cola
+
+    def pendientes(self, carril: str) -> List[Pendiente]:
+        """Pasos pendientes del carril, del más antiguo al más reciente."""
+        return list(self._colas.get(carril, ()))
+
+    def carriles_pendientes(self) -> Dict[str, List[Pendiente]]:
+        return {carril: list(cola) for carril, cola in list(self._colas.items()) if cola}
+
+    def resumen_pendientes(self) -> List[Tuple[str, int, datetime]]:
+        """(carril, número de pasos pendientes, timestamp del más antiguo) de cada carril con pendientes."""
+        return sorted(
+            (carril, len(pendientes), pendientes[0].timestamp)
+            for carril, pendientes in self.carriles_pendientes().items()
+        )
+
+    def hay_pendiente(self, carril: Optional[str] = None) -> bool:
+        if carril is not None:
+            return bool(self._colas.get(carril))
+        return any(self._colas.values())
+
+    def iniciar(
+        self,
+        medicion_id: int,
+        timestamp: datetime,
+        distancia: float,
+        carril: str = CARRIL_POR_DEFECTO
+    ) -> Pendiente:
+        """Encola un detector1 ya persistido como fila pendiente."""
+        pendiente = Pendiente(medicion_id, timestamp, distancia, carril)
+        self._cola(carril).append(pendiente)
+        return pendiente
+
+    def tomar(self, carril: str = CARRIL_POR_DEFECTO) -> Optional[Pendiente]:
+        """Extrae el paso pendiente más antiguo del carril para completarlo."""
+        cola = self._colas.get(carril)
+        return cola.popleft() if cola else None
+
+    def devolver(self, pendiente: Pendiente) -> None:
+        """Devuelve a la cabeza de su cola un paso extraído con tomar()."""
+        self._cola(pendiente.carril).appendleft(pendiente)
+
+    @staticmethod
+    def sentencia_pendientes(carril: Optional[str] = None):
+        """SELECT de las filas pendientes (de un carril o de todos) en orden FIFO."""
+        sentencia = select(
+            models.Medicion.id,
+            models.Medicion.timestamp,
+            models.Medicion.distancia,
+            models.Medicion.carril
+        ).where(
+            models.Medicion.es_primera_medicion == True,
+            models.Medicion.medicion_completa == False
+        )
+        if carril is not None:
+            sentencia = sentencia.where(models.Medicion.carril == carril)
+        return sentencia.order_by(models.Medicion.timestamp, models.Medicion.id)
+
+    def cargar(self, filas) -> Dict[str, List[Pendiente]]:
+        """Sustituye el estado de todos los carriles por las filas pendientes dadas."""
+        colas: Dict[str, Deque[Pendiente]] = {}
+        for fila in filas:
+            carril = fila.carril or CARRIL_POR_DEFECTO
+            colas.setdefault(carril, deque()).append(
+                Pendiente(fila.id, fila.timestamp, fila.distancia, carril)
+            )
+        with self._lock:
+            self._colas = colas
+        return self.carriles_pendientes()
+
+    def cargar_carril(self, carril: str, filas) -> List[Pendiente]:
+        """Sustituye la cola de un carril por las filas pendientes dadas."""
+        cola = deque(Pendiente(f.id, f.timestamp, f.distancia, carril) for f in filas)
+        with self._lock:
+            self._colas[carril] = cola
+        return list(cola)
+
+    def reconstruir(self, db: Session) -> Dict[str, List[Pendiente]]:
+        """
+        Reconstruye el estado de todos los carriles a partir de la tabla.
+
+        Parámetros:
+        - db (Session): Sesión de base de datos de SQLAlchemy.
+
+        Retorno:
+        - Dict[str, List[Pendiente]]: Pasos pendientes por carril, en orden FIFO.
+        """
+        return self.cargar(db.execute(self.sentencia_pendientes()).all())
+
+    def reconstruir_carril(self, db: Session, carril: str) -> List[Pendiente]:
+        """
+        Reconstruye la cola de un único carril a partir de la tabla.
+
+        Es la ruta de recuperación cuando la memoria no conoce ningún paso
+        pendiente del carril o el que conocía ya había sido completado.
+
+        Parámetros:
+        - db (Session): Sesión de base de datos de SQLAlchemy.
+        - carril (str): Identificador del carril a reconstruir.
+
+        Retorno:
+        - List[Pendiente]: Pasos pendientes del carril, en orden FIFO.
+        """
+        return self.cargar_carril(carril, db.execute(self.sentencia_pendientes(carril)).all())
+
+    def descartar_anteriores(self, limite: datetime) -> int:
+        """
+        Quita de las colas los pasos anteriores a `limite`, ya eliminados de la tabla por la retención.
+
+        Retorno:
+        - int: Número de pasos descartados.
+        """
+        descartados = 0
+        for carril in list(self._colas):
+            with self.bloqueo(carril):
+                cola = self._colas.get(carril, deque())
+                conservados = deque(p for p in cola if hora_local(p.timestamp) >= limite)
+                descartados += len(cola) - len(conservados)
+                with self._lock:
+                    self._colas[carril] = conservados
+        return descartados
+
+    def reemplazar(self, carril: str, pendientes: List[Pendiente]) -> None:
+        """Sustituye la cola de un carril tras persistir un lote de eventos."""
+        with self._lock:
+            self._colas[carril] = deque(pendientes)
+
+
+class Evento(NamedTuple):
+    """
+    Evento de sensor ya normalizado: tipo ('detector1'/'detector2'), carril y hora.
+
+    tiempo_recorrido solo se indica en los detector1 de las placas que miden
+    ellas mismas el paso por los dos sensores: el evento es ya una medición
+    completa y no pasa por la cola del carril.
+    """
+    tipo: str
+    carril: str
+    timestamp: datetime
+    tiempo_recorrido: Optional[float] = None
+
+
+class PlanLote(NamedTuple):
+    """
+    Resultado de emparejar un lote de eventos en memoria.
+
+    - filas_nuevas: filas a insertar (pasos del detector1 del propio lote, ya
+      completadas si su detector2 llegó en el mismo lote o si el evento traía
+      su tiempo_recorrido).
+    - actualizaciones: mediciones pendientes previas al lote que se completan.
+    - resultados: un dict por evento, en el orden de entrada.
+    - colas: cola final de cada carril; contiene Pendiente y filas nuevas sin id.
+    """
+    filas_nuevas: List[dict]
+    actualizaciones: List[dict]
+    resultados: List[dict]
+    colas: Dict[str, Deque]
+
+
+def emparejar_lote(
+    colas: Dict[str, Deque[Pendiente]],
+    eventos: List[Optional[Evento]],
+    distancia: float
+) -> PlanLote:
+    """
+    Empareja en una sola pasada una secuencia ordenada de eventos.
+
+    No accede a la base de datos ni modifica el motor: trabaja sobre copias de
+    las colas recibidas, de modo que el plan solo se aplica a memoria una vez
+    que la transacción que lo persiste ha confirmado.
+
+    Parámetros:
+    - colas (Dict[str, Deque[Pendiente]]): Pasos pendientes de cada carril al
+      inicio del lote.
+    - eventos (List[Optional[Evento]]): Eventos en orden de llegada; None para
+      los eventos que no son válidos.
+    - distancia (float): Distancia entre sensores usada para calcular la velocidad.
+
+    Retorno:
+    - PlanLote con las filas a insertar y actualizar y el resultado de cada evento.
+    """
+    trabajo = {carril: deque(cola) for carril, cola in colas.items()}
+    filas_nuevas: List[dict] = []
+    actualizaciones: List[dict] = []
+    resultados: List[dict] = []
+
+    for evento in eventos:
+        if evento is None:
+            resultados.append({
+                "estado": "error",
+                "mensaje": "Datos inválidos. Se espera detector1 o detector2"
+            })
+            continue
+
+        if evento.tiempo_recorrido is not None:
+            # Medición completa calculada en la placa: no toca la cola del carril
+            velocidad_ms = distancia / evento.tiempo_recorrido
+            fila = {
+                "id": None,
+                "timestamp": evento.timestamp,
+                "distancia": distancia,
+                "carril": evento.carril,
+                "velocidad_ms": velocidad_ms,
+                "velocidad_kmh": velocidad_ms * 3.6,
+                "tiempo_recorrido": evento.tiempo_recorrido,
+                "es_primera_medicion": False,
+                "medicion_completa": True,
+            }
+            filas_nuevas.append(fila)
+            resultados.append({"estado": "completada", "mensaje": "Medición completada", "fila": fila})
+            continue
+
+        cola = trabajo.setdefault(evento.carril, deque())
+
+        if evento.tipo == "detector1":
+            fila = {
+                "id": None,
+                "timestamp": evento.timestamp,
+                "distancia": distancia,
+                "carril": evento.carril,
+                "velocidad_ms": None,
+                "velocidad_kmh": None,
+                "tiempo_recorrido": None,
+                "es_primera_medicion": True,
+                "medicion_completa": False,
+            }
+            filas_nuevas.append(fila)
+            cola.append(fila)
+            resultados.append({
+                "estado": "pendiente",
+                "mensaje": "Sensor 1 activado. Esperando sensor 2...",
+                "fila": fila
+            })
+            continue
+
+        if not cola:
+            resultados.append({
+                "estado": "ignorado",
+                "mensaje": "No hay medición en progreso. Esperando detector 1"
+            })
+            continue
+
+        paso = cola[0]
+        inicio = paso.timestamp if isinstance(paso, Pendiente) else paso["timestamp"]
+        tiempo_recorrido = (evento.timestamp - inicio).total_seconds()
+        if tiempo_recorrido <= 0:
+            resultados.append({"estado": "error", "mensaje": "Tiempo recorrido inválido"})
+            continue
+        cola.popleft()
+
+        velocidad_ms = distancia / tiempo_recorrido
+        valores = {
+            "velocidad_ms": velocidad_ms,
+            "velocidad_kmh": velocidad_ms * 3.6,
+            "tiempo_recorrido": tiempo_recorrido,
+            "es_primera_medicion": False,
+            "medicion_completa": True,
+        }
+        if isinstance(paso, Pendiente):
+            fila = dict(paso._asdict(), **valores)
+            actualizaciones.append(fila)
+        else:
+            fila = paso
+            fila.update(valores)
+        resultados.append({"estado": "completada", "mensaje": "Medición completada", "fila": fila})
+
+    return PlanLote(filas_nuevas, actualizaciones, resultados, trabajo)
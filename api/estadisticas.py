@@ -0,0 +1,427 @@
+"""
+Estadísticas materializadas de las mediciones completas.
+
+GET /estadisticas/ lee una fila de estadisticas_resumen y otra de
+estadisticas_diarias en lugar de agregar toda la tabla mediciones. Ambas
+tablas se actualizan en la misma transacción que completa cada medición
+(sentencias_acumular) y un trabajo periódico las recalcula desde mediciones
+(reconciliar) para corregir cualquier desviación, por ejemplo por cambios
+hechos directamente en la base de datos. La reconciliación agrega la tabla
+sin bloquear la fila del resumen y después le aplica solo la diferencia, de
+modo que la ingesta no espera a la agregación. Los días anteriores a la frontera de
+retención (ver retencion.py) ya no están en mediciones y conservan sus
+agregados diarios tal como quedaron al resumirlos.
+"""
+import asyncio
+import os
+import math
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update, delete, insert, func, case, literal, null, true, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import engine, SessionLocal
+import models
+
+# Velocidad (km/h) a partir de la cual una medición cuenta como exceso
+UMBRAL_EXCESO = 50
+# Segundos entre reconciliaciones; con varios workers solo reconcilia el primero
+# que encuentra la última reconciliación caducada
+INTERVALO_RECONCILIACION = int(os.getenv("ESTADISTICAS_RECONCILIACION", "3600"))
+
+ID_RESUMEN = 1
+# Fila de la tabla estado con el inicio de las mediciones conservadas (ver retencion.py)
+CLAVE_FRONTERA = "retencion_frontera"
+
+Resumen = models.EstadisticasResumen
+Diarias = models.EstadisticasDiarias
+
+# INSERT ... ON CONFLICT DO UPDATE del dialecto en uso (misma API en ambos)
+insertar_con_conflicto = postgresql.insert if engine.dialect.name == "postgresql" else sqlite.insert
+
+
+def _acumular_maxima(columna, valor):
+    return case(((columna.is_(None)) | (columna < valor), valor), else_=columna)
+
+
+def _acumular_minima(columna, valor):
+    return case(((columna.is_(None)) | (columna > valor), valor), else_=columna)
+
+
+def sentencias_acumular(filas: List[dict]) -> list:
+    """
+    Sentencias que suman un conjunto de mediciones recién completadas a los agregados.
+
+    Deben ejecutarse en la transacción que completa las mediciones. Los días se
+    actualizan antes que el resumen: la fila única del resumen la comparten
+    todos los escritores, así que se bloquea lo más cerca posible del commit.
+
+    Parámetros:
+    - filas (List[dict]): Mediciones completadas, con "timestamp" y "velocidad_kmh".
+
+    Retorno:
+    - list: Un único upsert con una fila por día afectado y un UPDATE del
+      resumen; vacía si no hay filas.
+    """
+    if not filas:
+        return []
+
+    dias: Dict = {}
+    for fila in filas:
+        velocidad = fila["velocidad_kmh"]
+        dia = dias.get(fila["timestamp"].date())
+        if dia is None:
+            dias[fila["timestamp"].date()] = dia = {
+                "fecha": fila["timestamp"].date(), "total": 0, "suma_kmh": 0.0,
+                "maxima_kmh": velocidad, "minima_kmh": velocidad, "excesos": 0
+            }
+        dia["total"] += 1
+        dia["suma_kmh"] += velocidad
+        dia["maxima_kmh"] = max(dia["maxima_kmh"], velocidad)
+        dia["minima_kmh"] = min(dia["minima_kmh"], velocidad)
+        dia["excesos"] += velocidad > UMBRAL_EXCESO
+
+    valores = list(dias.values())
+    upsert = insertar_con_conflicto(Diarias).values(valores)
+    sentencias = [upsert.on_conflict_do_update(
+        index_elements=[Diarias.fecha],
+        set_={
+            "total": Diarias.total + upsert.excluded.total,
+            "suma_kmh": Diarias.suma_kmh + upsert.excluded.suma_kmh,
+            "maxima_kmh": _acumular_maxima(Diarias.maxima_kmh, upsert.excluded.maxima_kmh),
+            "minima_kmh": _acumular_minima(Diarias.minima_kmh, upsert.excluded.minima_kmh),
+            "excesos": Diarias.excesos + upsert.excluded.excesos
+        }
+    )]
+    sentencias.append(
+        update(Resumen)
+        .where(Resumen.id == ID_RESUMEN)
+        .values(
+            total=Resumen.total + sum(d["total"] for d in valores),
+            suma_kmh=Resumen.suma_kmh + sum(d["suma_kmh"] for d in valores),
+            maxima_kmh=_acumular_maxima(Resumen.maxima_kmh, max(d["maxima_kmh"] for d in valores)),
+            minima_kmh=_acumular_minima(Resumen.minima_kmh, min(d["minima_kmh"] for d in valores)),
+            excesos=Resumen.excesos + sum(d["excesos"] for d in valores)
+        )
+    )
+    return sentencias
+
+
+def leer_frontera(db: Session) -> Optional[datetime]:
+    """
+    Inicio de las mediciones conservadas tras aplicar la retención.
+
+    Las mediciones anteriores ya no están (o dejarán de estar) en la tabla
+    mediciones; solo cuentan a través de sus filas de estadisticas_diarias.
+
+    Retorno:
+    - datetime: Medianoche del primer día conservado, o None si nunca se aplicó la retención.
+    """
+    fila = db.get(models.Estado, CLAVE_FRONTERA)
+    return datetime.fromisoformat(fila.valor) if fila is not None else None
+
+
+def recalcular_diarias(db: Session, desde: Optional[datetime] = None, hasta: Optional[datetime] = None) -> None:
+    """
+    Sustituye los agregados diarios de un rango por los calculados desde mediciones.
+
+    No confirma la transacción. Los límites deben caer a medianoche.
+
+    Parámetros:
+    - db (Session): Sesión de base de datos de SQLAlchemy.
+    - desde, hasta (datetime, opcional): Rango [desde, hasta); sin límite si se omiten.
+    """
+    filtro = models.Medicion.medicion_completa == True
+    dias = []
+    if desde is not None:
+        filtro &= models.Medicion.timestamp >= desde
+        dias.append(Diarias.fecha >= desde.date())
+    if hasta is not None:
+        filtro &= models.Medicion.timestamp < hasta
+        dias.append(Diarias.fecha < hasta.date())
+
+    velocidad = models.Medicion.velocidad_kmh
+    fecha = func.date(models.Medicion.timestamp)
+    db.execute(delete(Diarias).where(*dias))
+    db.execute(insert(Diarias).from_select(
+        ["fecha", "total", "suma_kmh", "maxima_kmh", "minima_kmh", "excesos"],
+        select(
+            fecha,
+            func.count(models.Medicion.id),
+            func.sum(velocidad),
+            func.max(velocidad),
+            func.min(velocidad),
+            func.coalesce(func.sum(case((velocidad > UMBRAL_EXCESO, 1), else_=0)), 0)
+        ).where(filtro).group_by(fecha)
+    ))
+
+
+class Agregados(NamedTuple):
+    """Agregados de un conjunto de mediciones completas, con las columnas de las tablas materializadas."""
+    total: int = 0
+    suma_kmh: float = 0.0
+    maxima_kmh: Optional[float] = None
+    minima_kmh: Optional[float] = None
+    excesos: int = 0
+
+    def sumar(self, otro: "Agregados") -> "Agregados":
+        maximas = [v for v in (self.maxima_kmh, otro.maxima_kmh) if v is not None]
+        minimas = [v for v in (self.minima_kmh, otro.minima_kmh) if v is not None]
+        return Agregados(
+            self.total + otro.total,
+            self.suma_kmh + otro.suma_kmh,
+            max(maximas) if maximas else None,
+            min(minimas) if minimas else None,
+            self.excesos + otro.excesos
+        )
+
+    def coincide(self, otro: "Agregados") -> bool:
+        return (
+            self.total == otro.total and self.excesos == otro.excesos
+            and math.isclose(self.suma_kmh, otro.suma_kmh, rel_tol=1e-9, abs_tol=1e-6)
+            and self.maxima_kmh == otro.maxima_kmh and self.minima_kmh == otro.minima_kmh
+        )
+
+
+class Desviaciones(NamedTuple):
+    """
+    Agregados calculados desde mediciones frente a los guardados, leídos juntos.
+
+    resumen y cada día son tuplas (calculado, guardado) obtenidas de una misma
+    consulta, así que su diferencia no incluye lo que los escritores sumen después.
+    """
+    frontera: Optional[datetime]
+    resumen: Tuple[Agregados, Agregados]
+    dias: Dict[date, Tuple[Agregados, Agregados]]
+
+
+def _agregar(velocidad, total, *agrupar):
+    return select(
+        *agrupar,
+        total.label("total"),
+        func.coalesce(func.sum(velocidad), 0.0).label("suma_kmh"),
+        func.max(velocidad).label("maxima_kmh"),
+        func.min(velocidad).label("minima_kmh"),
+        func.coalesce(func.sum(case((velocidad > UMBRAL_EXCESO, 1), else_=0)), 0).label("excesos")
+    )
+
+
+def _agregados(fila, prefijo: str = "") -> Agregados:
+    return Agregados(*(getattr(fila, prefijo + campo) for campo in Agregados._fields))
+
+
+def leer_desviaciones(db: Session) -> Desviaciones:
+    """
+    Lee, sin bloquear filas, los agregados calculados desde mediciones y los guardados.
+
+    El resumen se lee en una única consulta junto con la agregación de la tabla
+    (y de los días archivados, si se aplicó la retención), y los días en otra,
+    de modo que cada diferencia se mide sobre una misma instantánea.
+    """
+    frontera = leer_frontera(db)
+    completas = models.Medicion.medicion_completa == True
+    if frontera is not None:
+        completas &= models.Medicion.timestamp >= frontera
+    velocidad = models.Medicion.velocidad_kmh
+
+    calculado = _agregar(velocidad, func.count(models.Medicion.id)).where(completas).subquery()
+    sentencia = select(
+        *[getattr(Resumen, campo) for campo in Agregados._fields],
+        *[calculado.c[campo].label("calculado_" + campo) for campo in Agregados._fields]
+    ).select_from(Resumen).join(calculado, true())
+    if frontera is not None:
+        # Días ya eliminados de mediciones: sus agregados diarios son definitivos
+        archivados = select(
+            func.coalesce(func.sum(Diarias.total), 0).label("total"),
+            func.coalesce(func.sum(Diarias.suma_kmh), 0.0).label("suma_kmh"),
+            func.max(Diarias.maxima_kmh).label("maxima_kmh"),
+            func.min(Diarias.minima_kmh).label("minima_kmh"),
+            func.coalesce(func.sum(Diarias.excesos), 0).label("excesos")
+        ).where(Diarias.fecha < frontera.date()).subquery()
+        sentencia = sentencia.add_columns(
+            *[archivados.c[campo].label("archivado_" + campo) for campo in Agregados._fields]
+        ).join(archivados, true())
+    fila = db.execute(sentencia.where(Resumen.id == ID_RESUMEN)).one()
+    resumen_calculado = _agregados(fila, "calculado_")
+    if frontera is not None:
+        resumen_calculado = resumen_calculado.sumar(_agregados(fila, "archivado_"))
+
+    fecha = func.date(models.Medicion.timestamp)
+    por_dia = _agregar(
+        velocidad, func.count(models.Medicion.id), fecha.label("fecha"), literal(1).label("calculado")
+    ).where(completas).group_by(fecha)
+    guardados = select(
+        Diarias.fecha, literal(0), Diarias.total, Diarias.suma_kmh,
+        Diarias.maxima_kmh, Diarias.minima_kmh, Diarias.excesos
+    )
+    if frontera is not None:
+        guardados = guardados.where(Diarias.fecha >= frontera.date())
+    dias: Dict[date, List[Agregados]] = {}
+    for dia, es_calculado, *valores in db.execute(union_all(por_dia, guardados)):
+        if not isinstance(dia, date):
+            # func.date() devuelve texto en SQLite
+            dia = date.fromisoformat(str(dia))
+        dias.setdefault(dia, [Agregados(), Agregados()])[0 if es_calculado else 1] = Agregados(*valores)
+    return Desviaciones(frontera, (resumen_calculado, _agregados(fila)), {
+        dia: tuple(par) for dia, par in dias.items()
+    })
+
+
+def _corregir_extremo(columna, sin_cambios, calculado: Optional[float], acumular):
+    """
+    Máxima o mínima corregida: la calculada si ningún escritor sumó mediciones
+    desde la lectura (sin_cambios); si no, la acumulada con la calculada.
+    """
+    if calculado is None:
+        return case((sin_cambios, null()), else_=columna)
+    return case((sin_cambios, calculado), else_=acumular(columna, calculado))
+
+
+def sentencias_corregir(desviaciones: Desviaciones) -> list:
+    """
+    Sentencias que llevan los agregados guardados a los calculados, como incrementos.
+
+    Suman a cada contador la diferencia leída en lugar de sobrescribirlo, por lo
+    que se conservan las mediciones que los escritores acumularon después de
+    leer_desviaciones(). La máxima y la mínima se sustituyen si el total no
+    cambió desde la lectura; si cambió, se acumulan con las calculadas y una
+    desviación que quede se corrige en la siguiente reconciliación. Los días
+    quedan antes que el resumen, como en sentencias_acumular(), y se borran los
+    que se quedan sin mediciones.
+    """
+    sentencias = []
+    ajustados = []
+    for dia, (calculado, guardado) in sorted(desviaciones.dias.items()):
+        if calculado.coincide(guardado):
+            continue
+        ajustados.append(dia)
+        sin_cambios = Diarias.total == guardado.total
+        upsert = insertar_con_conflicto(Diarias).values(
+            fecha=dia,
+            total=calculado.total - guardado.total,
+            suma_kmh=calculado.suma_kmh - guardado.suma_kmh,
+            maxima_kmh=calculado.maxima_kmh,
+            minima_kmh=calculado.minima_kmh,
+            excesos=calculado.excesos - guardado.excesos
+        )
+        sentencias.append(upsert.on_conflict_do_update(
+            index_elements=[Diarias.fecha],
+            set_={
+                "total": Diarias.total + upsert.excluded.total,
+                "suma_kmh": Diarias.suma_kmh + upsert.excluded.suma_kmh,
+                "maxima_kmh": _corregir_extremo(
+                    Diarias.maxima_kmh, sin_cambios, calculado.maxima_kmh, _acumular_maxima
+                ),
+                "minima_kmh": _corregir_extremo(
+                    Diarias.minima_kmh, sin_cambios, calculado.minima_kmh, _acumular_minima
+                ),
+                "excesos": Diarias.excesos + upsert.excluded.excesos
+            }
+        ))
+    if ajustados:
+        sentencias.append(delete(Diarias).where(Diarias.fecha.in_(ajustados), Diarias.total <= 0))
+
+    calculado, guardado = desviaciones.resumen
+    if not calculado.coincide(guardado):
+        sin_cambios = Resumen.total == guardado.total
+        sentencias.append(
+            update(Resumen)
+            .where(Resumen.id == ID_RESUMEN)
+            .values(
+                total=Resumen.total + (calculado.total - guardado.total),
+                suma_kmh=Resumen.suma_kmh + (calculado.suma_kmh - guardado.suma_kmh),
+                maxima_kmh=_corregir_extremo(Resumen.maxima_kmh, sin_cambios, calculado.maxima_kmh, _acumular_maxima),
+                minima_kmh=_corregir_extremo(Resumen.minima_kmh, sin_cambios, calculado.minima_kmh, _acumular_minima),
+                excesos=Resumen.excesos + (calculado.excesos - guardado.excesos)
+            )
+        )
+    return sentencias
+
+
+def reconciliar(db: Session, forzar: bool = False) -> bool:
+    """
+    Recalcula el resumen y los agregados diarios a partir de la tabla mediciones.
+
+    Se hace en tres transacciones cortas: marca la reconciliación en la fila
+    del resumen (para que un solo worker la ejecute), lee las desviaciones sin
+    bloquear nada (leer_desviaciones) y aplica las correcciones como
+    incrementos (sentencias_corregir), que solo bloquean las filas afectadas
+    hasta el commit. Si se aplicó la retención, solo recalcula los días
+    conservados y suma al resumen los agregados diarios anteriores a la
+    frontera (ver leer_frontera()); si la frontera avanza durante la lectura,
+    la reconciliación se descarta hasta la siguiente.
+
+    Parámetros:
+    - db (Session): Sesión de base de datos de SQLAlchemy.
+    - forzar (bool): Si False, no hace nada cuando otro worker reconcilió hace
+      menos de INTERVALO_RECONCILIACION / 2 segundos.
+
+    Retorno:
+    - bool: True si se reconcilió.
+    """
+    ahora = datetime.now()
+    marcar = update(Resumen).where(Resumen.id == ID_RESUMEN).values(reconciliado=ahora)
+    if not forzar:
+        limite = ahora - timedelta(seconds=INTERVALO_RECONCILIACION / 2)
+        marcar = marcar.where(
+            (Resumen.reconciliado.is_(None)) | (Resumen.reconciliado < limite)
+        )
+    if not db.execute(marcar).rowcount:
+        db.rollback()
+        return False
+    db.commit()
+
+    desviaciones = leer_desviaciones(db)
+    cambio_frontera = leer_frontera(db) != desviaciones.frontera
+    db.commit()
+    if cambio_frontera:
+        return False
+
+    for sentencia in sentencias_corregir(desviaciones):
+        db.execute(sentencia)
+    db.commit()
+    return True
+
+
+def init_estadisticas(db: Session) -> None:
+    """
+    Crea la fila del resumen si no existe y, en ese caso, la calcula desde la tabla.
+
+    Se ejecuta al arrancar la aplicación, de modo que una base de datos con
+    mediciones anteriores a las tablas materializadas queda reconciliada.
+    """
+    if db.get(Resumen, ID_RESUMEN) is not None:
+        return
+    db.add(Resumen(id=ID_RESUMEN, total=0, suma_kmh=0.0, excesos=0))
+    try:
+        db.commit()
+    except IntegrityError:
+        # Otro worker la creó a la vez y se encarga de reconciliarla
+        db.rollback()
+        return
+    reconciliar(db, forzar=True)
+
+
+async def reconciliar_periodicamente(tras_reconciliar: Optional[Callable[[], None]] = None) -> None:
+    """
+    Tarea de fondo que ejecuta reconciliar() cada INTERVALO_RECONCILIACION segundos.
+
+    Parámetros:
+    - tras_reconciliar (Callable, opcional): Se llama cuando los agregados se
+      recalculan, para invalidar las respuestas cacheadas que los incluyen.
+    """
+    def ejecutar():
+        with SessionLocal() as db:
+            if reconciliar(db) and tras_reconciliar is not None:
+                tras_reconciliar()
+
+    while True:
+        await asyncio.sleep(INTERVALO_RECONCILIACION)
+        try:
+            await run_in_threadpool(ejecutar)
+        except Exception as e:
+            print("Error reconciliando estadísticas:", e)
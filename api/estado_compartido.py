@@ -0,0 +1,569 @@
+"""
+Estado compartido entre workers: cache de configuración, "último post" y
+modelos de reloj de las placas (relojes.py).
+
+La API se despliega con varios workers de gunicorn, así que el estado que antes
+vivía en variables globales del módulo se guarda en un backend intercambiable,
+elegido con la variable de entorno ESTADO_COMPARTIDO:
+
+- "memoria" (por defecto): diccionario del propio proceso. Solo es coherente
+  con un único worker, como en desarrollo con uvicorn.
+- "mmap": fichero de tamaño fijo proyectado en memoria (por defecto en
+  /dev/shm) que comparten todos los workers de una misma máquina. Las lecturas
+  no toman locks (seqlock) y las escrituras se serializan con flock.
+- "notificado": para varias máquinas. Cada proceso mantiene una copia local que
+  se invalida cuando otro la cambia: LISTEN/NOTIFY en PostgreSQL y
+  PRAGMA data_version en SQLite. El "último post" y los modelos de reloj se
+  guardan en la tabla estado.
+
+En todos los casos las lecturas se sirven desde memoria, sin consultar la base
+de datos en cada petición.
+"""
+import json
+import math
+import mmap
+import os
+import select
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from database import SessionLocal
+import models
+from estadisticas import insertar_con_conflicto
+from relojes import Relojes
+
+try:
+    import fcntl
+except ImportError:  # Windows: el backend mmap no está disponible
+    fcntl = None
+
+CLAVES_CONFIG = ("distancia_sensores", "limite_velocidad")
+CANAL_NOTIFICACIONES = "radar_estado"
+# Contenido de la notificación que solo invalida las respuestas cacheadas
+AVISO_LECTURAS = "lecturas"
+# Prefijo de las claves de la tabla estado con el modelo de reloj de cada placa
+PREFIJO_RELOJ = "reloj:"
+
+
+class EstadoCompartido:
+    """
+    Backend en memoria del proceso; define la interfaz del resto de backends.
+
+    version() se incrementa con cada cambio, lo que permite a los consumidores
+    detectar cambios sin comparar el contenido. generacion() se incrementa con
+    invalidar_lecturas(), que los endpoints llaman después de confirmar cambios
+    en mediciones o configuración; la caché de respuestas descarta lo guardado
+    con una generación anterior.
+
+    La ingesta publica cada lote en dos pasos: sentencias_publicar() devuelve
+    las sentencias que se ejecutan dentro de su transacción (los backends que
+    guardan el estado en la base de datos no necesitan así transacciones
+    propias) y publicado() actualiza el estado tras el commit.
+
+    Los latidos de reloj se anotan en el backend (anotar_latido) para que
+    relojes() devuelva en todos los workers los mismos modelos.
+    """
+
+    compartido = False
+
+    def __init__(self):
+        self._config: Dict[str, float] = {}
+        self._ultimo_post = {"timestamp": None, "data": None}
+        self._version = 0
+        self._generacion = 0
+        self._relojes = Relojes()
+
+    def iniciar(self, config: Dict[str, float]) -> None:
+        """Carga los valores de configuración leídos de la base de datos al arrancar."""
+        for clave, valor in config.items():
+            self.guardar_config(clave, valor)
+
+    def cerrar(self) -> None:
+        pass
+
+    def version(self) -> int:
+        return self._version
+
+    def generacion(self) -> int:
+        return self._generacion
+
+    def invalidar_lecturas(self) -> None:
+        self._generacion += 1
+
+    def config(self, clave: str, defecto: float) -> float:
+        valor = self._config.get(clave)
+        return defecto if valor is None else valor
+
+    def guardar_config(self, clave: str, valor: float) -> None:
+        self._config[clave] = valor
+        self._version += 1
+
+    def ultimo_post(self) -> dict:
+        return self._ultimo_post
+
+    def guardar_ultimo_post(self, data: dict) -> None:
+        self.guardar_post(self.envolver_post(data))
+
+    @staticmethod
+    def envolver_post(data: dict) -> dict:
+        """Último post con la hora en que se publica, tal como lo devuelve ultimo_post()."""
+        return {"timestamp": datetime.now().isoformat(), "data": data}
+
+    def guardar_post(self, post: dict) -> None:
+        self._ultimo_post = post
+        self._version += 1
+
+    def sentencias_publicar(self, post: Optional[dict]) -> list:
+        """Sentencias que publican un lote dentro de la transacción de la ingesta."""
+        return []
+
+    def publicado(self, post: Optional[dict]) -> None:
+        """Tras confirmar un lote: invalida las lecturas y guarda su último post, si lo hay."""
+        self.invalidar_lecturas()
+        if post is not None:
+            self.guardar_post(post)
+
+    def relojes(self) -> Relojes:
+        """Modelos de reloj vigentes de las placas, para corregir y describir."""
+        return self._relojes
+
+    def anotar_latido(self, placa: str, ticks: int, epoch_ms: int,
+                      recibido_ms: Optional[float] = None) -> dict:
+        """
+        Registra un latido de reloj de una placa en el modelo compartido.
+
+        Parámetros:
+        - placa (str): Identificador de la placa.
+        - ticks (int): ticks_ms de la placa al enviar el latido.
+        - epoch_ms (int): Hora Unix de la placa en milisegundos al enviar el latido.
+        - recibido_ms (float, opcional): Hora Unix de recepción en ms (por defecto, ahora).
+
+        Retorno:
+        - dict: Estado actualizado del modelo de la placa (Relojes.describir).
+        """
+        self._relojes.latido(placa, ticks, epoch_ms, recibido_ms)
+        return self._relojes.describir(placa)
+
+
+class EstadoMmap(EstadoCompartido):
+    """
+    Estado en un fichero proyectado en memoria, compartido por los workers de un host.
+
+    Disposición fija (little-endian):
+    - magic (4s) y secuencia (Q): la secuencia es impar mientras hay una
+      escritura en curso; los lectores reintentan si cambia durante la lectura.
+    - un double por clave de CLAVES_CONFIG (NaN si no está definida).
+    - generación de las lecturas (Q).
+    - longitud (I) y JSON del "último post" (hasta TAM_ULTIMO_POST bytes).
+    - cambios (Q), longitud (I) y JSON de los modelos de reloj (hasta
+      TAM_RELOJES bytes). El contador de cambios permite reutilizar los
+      modelos ya decodificados mientras no llegue un latido.
+    """
+
+    compartido = True
+
+    MAGIC = b"RDR3"
+    CABECERA = struct.Struct("<4sQ")
+    CONFIG = struct.Struct("<" + "d" * len(CLAVES_CONFIG))
+    GENERACION = struct.Struct("<Q")
+    LONGITUD = struct.Struct("<I")
+    RELOJES = struct.Struct("<QI")
+    TAM_ULTIMO_POST = 8192
+    TAM_RELOJES = 65536
+    OFFSET_CONFIG = CABECERA.size
+    OFFSET_GENERACION = OFFSET_CONFIG + CONFIG.size
+    OFFSET_ULTIMO_POST = OFFSET_GENERACION + GENERACION.size
+    OFFSET_RELOJES = OFFSET_ULTIMO_POST + LONGITUD.size + TAM_ULTIMO_POST
+    TAMANO = OFFSET_RELOJES + RELOJES.size + TAM_RELOJES
+
+    def __init__(self, ruta: str):
+        if fcntl is None:
+            raise RuntimeError("El backend mmap requiere fcntl (Linux/macOS)")
+        super().__init__()
+        self.ruta = ruta
+        self._fd = os.open(ruta, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < self.TAMANO:
+                os.ftruncate(self._fd, self.TAMANO)
+            self._mm = mmap.mmap(self._fd, self.TAMANO)
+            if self._mm[:4] != self.MAGIC:
+                self._mm[:self.TAMANO] = bytes(self.TAMANO)
+                self.CONFIG.pack_into(self._mm, self.OFFSET_CONFIG, *([math.nan] * len(CLAVES_CONFIG)))
+                self.CABECERA.pack_into(self._mm, 0, self.MAGIC, 0)
+            self._reparar_secuencia()
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._cache_post = (-1, self._ultimo_post)
+        self._cache_relojes = (-1, self._relojes)
+
+    def cerrar(self) -> None:
+        self._mm.close()
+        os.close(self._fd)
+
+    def version(self) -> int:
+        return self.CABECERA.unpack_from(self._mm, 0)[1] // 2
+
+    def _reparar_secuencia(self) -> int:
+        """Deja la secuencia par si un proceso murió a mitad de una escritura (requiere el flock)."""
+        secuencia = self.CABECERA.unpack_from(self._mm, 0)[1]
+        if secuencia % 2:
+            secuencia += 1
+            self.CABECERA.pack_into(self._mm, 0, self.MAGIC, secuencia)
+        return secuencia
+
+    def _leer(self, lector):
+        """Ejecuta `lector` con una instantánea coherente del fichero (seqlock)."""
+        esperas = 0
+        while True:
+            antes = self.CABECERA.unpack_from(self._mm, 0)[1]
+            if antes % 2:
+                esperas += 1
+                if esperas % 1000 == 0:
+                    # Escritura en curso demasiado larga: comprobar si el escritor murió
+                    with self._exclusivo():
+                        self._reparar_secuencia()
+                time.sleep(0)
+                continue
+            resultado = lector()
+            if self.CABECERA.unpack_from(self._mm, 0)[1] == antes:
+                return antes, resultado
+
+    @contextmanager
+    def _exclusivo(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _escribir_bloqueado(self, escritor) -> None:
+        """Ejecuta `escritor` con la secuencia impar (requiere el flock)."""
+        secuencia = self._reparar_secuencia()
+        self.CABECERA.pack_into(self._mm, 0, self.MAGIC, secuencia + 1)
+        escritor()
+        self.CABECERA.pack_into(self._mm, 0, self.MAGIC, secuencia + 2)
+
+    def _escribir(self, escritor) -> None:
+        with self._exclusivo():
+            self._escribir_bloqueado(escritor)
+
+    def generacion(self) -> int:
+        return self._leer(lambda: self.GENERACION.unpack_from(self._mm, self.OFFSET_GENERACION)[0])[1]
+
+    def invalidar_lecturas(self) -> None:
+        def incrementar():
+            actual = self.GENERACION.unpack_from(self._mm, self.OFFSET_GENERACION)[0]
+            self.GENERACION.pack_into(self._mm, self.OFFSET_GENERACION, actual + 1)
+
+        self._escribir(incrementar)
+
+    def config(self, clave: str, defecto: float) -> float:
+        _, valores = self._leer(lambda: self.CONFIG.unpack_from(self._mm, self.OFFSET_CONFIG))
+        valor = valores[CLAVES_CONFIG.index(clave)] if clave in CLAVES_CONFIG else math.nan
+        return defecto if math.isnan(valor) else valor
+
+    def guardar_config(self, clave: str, valor: float) -> None:
+        if clave not in CLAVES_CONFIG:
+            return
+        offset = self.OFFSET_CONFIG + CLAVES_CONFIG.index(clave) * 8
+        self._escribir(lambda: struct.pack_into("<d", self._mm, offset, float(valor)))
+
+    def ultimo_post(self) -> dict:
+        secuencia_cache, post = self._cache_post
+        if secuencia_cache == self.CABECERA.unpack_from(self._mm, 0)[1]:
+            return post
+
+        def leer_post():
+            longitud = self.LONGITUD.unpack_from(self._mm, self.OFFSET_ULTIMO_POST)[0]
+            inicio = self.OFFSET_ULTIMO_POST + self.LONGITUD.size
+            return bytes(self._mm[inicio:inicio + longitud])
+
+        secuencia, contenido = self._leer(leer_post)
+        post = json.loads(contenido) if contenido else {"timestamp": None, "data": None}
+        self._cache_post = (secuencia, post)
+        return post
+
+    def _escritor_post(self, post: dict):
+        contenido = json.dumps(post).encode("utf-8")
+        if len(contenido) > self.TAM_ULTIMO_POST:
+            raise ValueError("El último post no cabe en el estado compartido")
+
+        def escribir_post():
+            self.LONGITUD.pack_into(self._mm, self.OFFSET_ULTIMO_POST, len(contenido))
+            inicio = self.OFFSET_ULTIMO_POST + self.LONGITUD.size
+            self._mm[inicio:inicio + len(contenido)] = contenido
+
+        return escribir_post
+
+    def guardar_post(self, post: dict) -> None:
+        self._escribir(self._escritor_post(post))
+
+    def publicado(self, post: Optional[dict]) -> None:
+        # Generación y último post en una sola escritura (un flock)
+        escribir_post = self._escritor_post(post) if post is not None else None
+
+        def escribir():
+            actual = self.GENERACION.unpack_from(self._mm, self.OFFSET_GENERACION)[0]
+            self.GENERACION.pack_into(self._mm, self.OFFSET_GENERACION, actual + 1)
+            if escribir_post is not None:
+                escribir_post()
+
+        self._escribir(escribir)
+
+    def _leer_relojes(self):
+        cambios, longitud = self.RELOJES.unpack_from(self._mm, self.OFFSET_RELOJES)
+        inicio = self.OFFSET_RELOJES + self.RELOJES.size
+        return cambios, bytes(self._mm[inicio:inicio + longitud])
+
+    def relojes(self) -> Relojes:
+        cambios_cache, relojes = self._cache_relojes
+        if cambios_cache == self.RELOJES.unpack_from(self._mm, self.OFFSET_RELOJES)[0]:
+            return relojes
+        _, (cambios, contenido) = self._leer(self._leer_relojes)
+        relojes = Relojes.importar(json.loads(contenido)) if contenido else Relojes()
+        self._cache_relojes = (cambios, relojes)
+        return relojes
+
+    def anotar_latido(self, placa: str, ticks: int, epoch_ms: int,
+                      recibido_ms: Optional[float] = None) -> dict:
+        if recibido_ms is None:
+            recibido_ms = time.time() * 1000
+        with self._exclusivo():
+            # Con el flock ningún otro proceso escribe: se lee sin seqlock
+            cambios, contenido = self._leer_relojes()
+            relojes = Relojes.importar(json.loads(contenido)) if contenido else Relojes()
+            relojes.latido(placa, ticks, epoch_ms, recibido_ms)
+            nuevo = json.dumps(relojes.exportar()).encode("utf-8")
+            if len(nuevo) > self.TAM_RELOJES:
+                raise ValueError("Los modelos de reloj no caben en el estado compartido")
+
+            def escribir_relojes():
+                self.RELOJES.pack_into(self._mm, self.OFFSET_RELOJES, cambios + 1, len(nuevo))
+                inicio = self.OFFSET_RELOJES + self.RELOJES.size
+                self._mm[inicio:inicio + len(nuevo)] = nuevo
+
+            self._escribir_bloqueado(escribir_relojes)
+        self._cache_relojes = (cambios + 1, relojes)
+        return relojes.describir(placa)
+
+
+class EstadoNotificado(EstadoCompartido):
+    """
+    Copia local del estado invalidada por notificaciones de la base de datos.
+
+    Un hilo por proceso escucha los cambios (LISTEN en PostgreSQL, sondeo de
+    PRAGMA data_version en SQLite) y recarga solo entonces la configuración,
+    el último post y los modelos de reloj. Las lecturas de las peticiones nunca
+    tocan la base de datos.
+    """
+
+    compartido = True
+    INTERVALO_SQLITE = 0.02
+
+    def __init__(self, engine: Engine):
+        super().__init__()
+        self.engine = engine
+        self._postgres = engine.dialect.name == "postgresql"
+        self._parar = threading.Event()
+        self._hilo: Optional[threading.Thread] = None
+        self._cambio = threading.Lock()
+
+    def iniciar(self, config: Dict[str, float]) -> None:
+        with self._cambio:
+            self._config.update(config)
+            self._version += 1
+        self._recargar()
+        self._hilo = threading.Thread(
+            target=self._escuchar_postgres if self._postgres else self._sondear_sqlite,
+            name="estado-compartido",
+            daemon=True
+        )
+        self._hilo.start()
+
+    def cerrar(self) -> None:
+        self._parar.set()
+        if self._hilo is not None:
+            self._hilo.join(timeout=2)
+
+    def _recargar(self) -> None:
+        with SessionLocal() as db:
+            filas = db.query(models.Configuracion).filter(
+                models.Configuracion.clave.in_(CLAVES_CONFIG)
+            ).all()
+            estado = db.get(models.Estado, "ultimo_post")
+            modelos = db.query(models.Estado).filter(
+                models.Estado.clave.startswith(PREFIJO_RELOJ)
+            ).all()
+        relojes = Relojes.importar({
+            fila.clave[len(PREFIJO_RELOJ):]: json.loads(fila.valor) for fila in modelos
+        })
+        with self._cambio:
+            for fila in filas:
+                try:
+                    self._config[fila.clave] = float(fila.valor)
+                except ValueError:
+                    pass
+            if estado is not None:
+                self._ultimo_post = json.loads(estado.valor)
+            self._relojes = relojes
+            self._version += 1
+            # Otro proceso pudo escribir mediciones o configuración
+            self._generacion += 1
+
+    @staticmethod
+    def _sentencia_notificar(aviso: str = ""):
+        return text("SELECT pg_notify(:canal, :aviso)").bindparams(
+            canal=CANAL_NOTIFICACIONES, aviso=aviso
+        )
+
+    def _notificar(self, db, aviso: str = "") -> None:
+        if self._postgres:
+            db.execute(self._sentencia_notificar(aviso))
+
+    def invalidar_lecturas(self) -> None:
+        with self._cambio:
+            self._generacion += 1
+        # En SQLite el resto de procesos lo detecta por PRAGMA data_version
+        if self._postgres:
+            with SessionLocal() as db:
+                self._notificar(db, AVISO_LECTURAS)
+                db.commit()
+
+    def guardar_config(self, clave: str, valor: float) -> None:
+        # El valor ya está confirmado en la tabla configuracion; basta con
+        # actualizar la copia local y avisar al resto de procesos
+        super().guardar_config(clave, valor)
+        if self._postgres:
+            with SessionLocal() as db:
+                self._notificar(db)
+                db.commit()
+
+    def guardar_post(self, post: dict) -> None:
+        with SessionLocal() as db:
+            for sentencia in self.sentencias_publicar(post):
+                db.execute(sentencia)
+            db.commit()
+        super().guardar_post(post)
+
+    def sentencias_publicar(self, post: Optional[dict]) -> list:
+        """
+        Upsert del último post en la tabla estado y, en PostgreSQL, el NOTIFY.
+
+        Ejecutadas en la transacción de la ingesta, la publicación no añade
+        transacciones: el NOTIFY se entrega al confirmar, y en SQLite el resto
+        de procesos ve el commit por PRAGMA data_version.
+        """
+        sentencias = []
+        if post is not None:
+            valor = json.dumps(post)
+            upsert = insertar_con_conflicto(models.Estado).values(clave="ultimo_post", valor=valor)
+            sentencias.append(upsert.on_conflict_do_update(
+                index_elements=[models.Estado.clave], set_={"valor": valor}
+            ))
+        if self._postgres:
+            sentencias.append(self._sentencia_notificar("" if post is not None else AVISO_LECTURAS))
+        return sentencias
+
+    def publicado(self, post: Optional[dict]) -> None:
+        # Las sentencias de sentencias_publicar() ya avisaron al resto de procesos
+        with self._cambio:
+            self._generacion += 1
+            if post is not None:
+                self._ultimo_post = post
+                self._version += 1
+
+    def anotar_latido(self, placa: str, ticks: int, epoch_ms: int,
+                      recibido_ms: Optional[float] = None) -> dict:
+        if recibido_ms is None:
+            recibido_ms = time.time() * 1000
+        clave = PREFIJO_RELOJ + placa
+        with SessionLocal() as db:
+            # FOR UPDATE: dos latidos simultáneos de la misma placa no se pisan
+            fila = db.get(models.Estado, clave, with_for_update=True)
+            relojes = Relojes.importar({} if fila is None else {placa: json.loads(fila.valor)})
+            modelo = relojes.latido(placa, ticks, epoch_ms, recibido_ms)
+            valor = json.dumps(modelo.exportar())
+            upsert = insertar_con_conflicto(models.Estado).values(clave=clave, valor=valor)
+            db.execute(upsert.on_conflict_do_update(
+                index_elements=[models.Estado.clave], set_={"valor": valor}
+            ))
+            self._notificar(db)
+            db.commit()
+        with self._cambio:
+            modelos = self._relojes.exportar()
+            modelos[placa] = modelo.exportar()
+            self._relojes = Relojes.importar(modelos)
+            self._version += 1
+        return relojes.describir(placa)
+
+    def _escuchar_postgres(self) -> None:
+        while not self._parar.is_set():
+            try:
+                conexion = self.engine.raw_connection()
+                try:
+                    driver = conexion.driver_connection
+                    driver.autocommit = True
+                    with driver.cursor() as cursor:
+                        cursor.execute(f"LISTEN {CANAL_NOTIFICACIONES}")
+                    # Recargar por si hubo cambios mientras no se escuchaba
+                    self._recargar()
+                    while not self._parar.is_set():
+                        if select.select([driver], [], [], 1.0) == ([], [], []):
+                            continue
+                        driver.poll()
+                        if driver.notifies:
+                            avisos = {aviso.payload for aviso in driver.notifies}
+                            driver.notifies.clear()
+                            if avisos == {AVISO_LECTURAS}:
+                                # Solo cambiaron datos: no hace falta releer el estado
+                                with self._cambio:
+                                    self._generacion += 1
+                            else:
+                                self._recargar()
+                finally:
+                    conexion.invalidate()
+            except Exception as e:
+                print("Error escuchando notificaciones de estado:", e)
+                self._parar.wait(1.0)
+
+    def _sondear_sqlite(self) -> None:
+        conexion = self.engine.raw_connection()
+        try:
+            cursor = conexion.cursor()
+            version = cursor.execute("PRAGMA data_version").fetchone()[0]
+            while not self._parar.wait(self.INTERVALO_SQLITE):
+                actual = cursor.execute("PRAGMA data_version").fetchone()[0]
+                if actual != version:
+                    version = actual
+                    self._recargar()
+        finally:
+            conexion.close()
+
+
+def crear_estado_compartido(engine: Engine) -> EstadoCompartido:
+    """
+    Crea el backend de estado compartido indicado por ESTADO_COMPARTIDO.
+
+    Parámetros:
+    - engine (Engine): Engine de la base de datos, usado por el backend "notificado".
+
+    Retorno:
+    - EstadoCompartido: Backend "memoria", "mmap" o "notificado".
+    """
+    tipo = os.getenv("ESTADO_COMPARTIDO", "memoria").lower()
+    if tipo == "mmap":
+        directorio = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        ruta = os.getenv("ESTADO_MMAP_RUTA", os.path.join(directorio, "radar_estado.bin"))
+        return EstadoMmap(ruta)
+    if tipo == "notificado":
+        return EstadoNotificado(engine)
+    return EstadoCompartido()
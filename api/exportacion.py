@@ -0,0 +1,178 @@
+"""
+Exportación masiva de mediciones en streaming (CSV, NDJSON, Parquet o Arrow).
+
+Las filas se leen con yield_per, que en PostgreSQL usa un cursor del lado del
+servidor, y cada bloque se serializa y se envía antes de leer el siguiente,
+por lo que la memoria usada no depende del número de filas exportadas. Los
+formatos columnares requieren pyarrow, que es opcional.
+"""
+import csv
+import io
+import json
+from datetime import date
+from typing import Iterator, Optional
+
+from sqlalchemy import select
+
+from database import SessionLocal
+import models
+from consultas import filtrar_mediciones
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Sin pyarrow solo están disponibles CSV y NDJSON
+    pa = None
+    pq = None
+
+# Filas leídas y serializadas por bloque
+TAMANO_BLOQUE_EXPORTACION = 5000
+
+COLUMNAS = [
+    "id", "timestamp", "carril", "distancia", "velocidad_ms", "velocidad_kmh",
+    "tiempo_recorrido", "es_primera_medicion", "medicion_completa",
+]
+
+# Formato: (tipo MIME, extensión del fichero, necesita pyarrow)
+FORMATOS = {
+    "csv": ("text/csv", "csv", False),
+    "ndjson": ("application/x-ndjson", "ndjson", False),
+    "parquet": ("application/vnd.apache.parquet", "parquet", True),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow", True),
+}
+
+
+def formato_disponible(formato: str) -> bool:
+    return formato in FORMATOS and (pa is not None or not FORMATOS[formato][2])
+
+
+def _bloques(
+    solo_completas: bool,
+    fecha_inicio: Optional[date],
+    fecha_fin: Optional[date],
+    carril: Optional[str]
+) -> Iterator[list]:
+    """
+    Recorre las mediciones filtradas en bloques de TAMANO_BLOQUE_EXPORTACION filas.
+
+    Abre su propia sesión porque el generador se consume mientras se envía la
+    respuesta, después de que FastAPI haya cerrado las dependencias.
+    """
+    columnas = [models.Medicion.__table__.c[nombre] for nombre in COLUMNAS]
+    sentencia = filtrar_mediciones(
+        select(*columnas), solo_completas, fecha_inicio, fecha_fin, carril
+    ).order_by(models.Medicion.timestamp, models.Medicion.id)
+
+    with SessionLocal() as db:
+        resultado = db.execute(
+            sentencia.execution_options(yield_per=TAMANO_BLOQUE_EXPORTACION)
+        )
+        for bloque in resultado.partitions():
+            yield bloque
+
+
+def _csv(bloques) -> Iterator[str]:
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(COLUMNAS)
+    for bloque in bloques:
+        escritor.writerows(
+            [fila[0], fila[1].isoformat(), *fila[2:]] for fila in bloque
+        )
+        yield salida.getvalue()
+        salida.seek(0)
+        salida.truncate()
+    # Solo la cabecera si no hay filas
+    if salida.tell():
+        yield salida.getvalue()
+
+
+def _ndjson(bloques) -> Iterator[str]:
+    for bloque in bloques:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNAS, (fila[0], fila[1].isoformat(), *fila[2:])))) + "\n"
+            for fila in bloque
+        )
+
+
+class _SalidaIncremental(io.RawIOBase):
+    """Fichero de solo escritura cuyo contenido se recoge y vacía tras cada bloque."""
+
+    def __init__(self):
+        super().__init__()
+        self._partes = []
+        self._posicion = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, datos) -> int:
+        datos = bytes(datos)
+        self._partes.append(datos)
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self) -> int:
+        return self._posicion
+
+    def recoger(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes.clear()
+        return datos
+
+
+def _esquema_arrow():
+    return pa.schema([
+        ("id", pa.int64()),
+        ("timestamp", pa.timestamp("us")),
+        ("carril", pa.string()),
+        ("distancia", pa.float64()),
+        ("velocidad_ms", pa.float64()),
+        ("velocidad_kmh", pa.float64()),
+        ("tiempo_recorrido", pa.float64()),
+        ("es_primera_medicion", pa.bool_()),
+        ("medicion_completa", pa.bool_()),
+    ])
+
+
+def _columnar(bloques, formato: str) -> Iterator[bytes]:
+    """Parquet (un row group por bloque) o Arrow IPC stream (un record batch por bloque)."""
+    esquema = _esquema_arrow()
+    salida = _SalidaIncremental()
+    if formato == "parquet":
+        escritor = pq.ParquetWriter(salida, esquema, compression="zstd")
+    else:
+        escritor = pa.ipc.new_stream(salida, esquema)
+
+    for bloque in bloques:
+        columnas = list(zip(*bloque))
+        escritor.write_batch(pa.record_batch(
+            [pa.array(columna, type=campo.type) for columna, campo in zip(columnas, esquema)],
+            schema=esquema
+        ))
+        yield salida.recoger()
+    escritor.close()
+    yield salida.recoger()
+
+
+def exportar(
+    formato: str,
+    solo_completas: bool = True,
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    carril: Optional[str] = None
+) -> Iterator:
+    """
+    Generador con el contenido de la exportación, bloque a bloque.
+
+    Parámetros:
+    - formato (str): "csv", "ndjson", "parquet" o "arrow" (ver formato_disponible()).
+    - solo_completas, fecha_inicio, fecha_fin, carril: Mismos filtros que GET /mediciones/.
+    """
+    bloques = _bloques(solo_completas, fecha_inicio, fecha_fin, carril)
+    if formato == "csv":
+        return _csv(bloques)
+    if formato == "ndjson":
+        return _ndjson(bloques)
+    return _columnar(bloques, formato)
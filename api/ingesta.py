@@ -0,0 +1,494 @@
+"""
+Estado y utilidades compartidas por los endpoints de ingesta de eventos.
+
+Reúne los objetos de proceso (estado compartido, motor de emparejamiento y
+difusor del stream) y la lógica de ingesta: emparejar, persistir y publicar un
+lote de eventos. Los endpoints síncronos de main.py usan registrar_lote() y los
+async de rutas_async.py registrar_lote_async(), que solo cambian la forma de
+bloquear los carriles y de hablar con la base de datos; POST /mediciones/ es un
+lote de un evento.
+"""
+from contextlib import AsyncExitStack, ExitStack
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, insert, update
+from sqlalchemy.orm import Session
+
+from database import engine, SessionLocal
+import models
+import schemas
+from emparejamiento import (
+    MotorEmparejamiento, Pendiente, Evento, PlanLote, CARRIL_POR_DEFECTO, emparejar_lote, hora_local
+)
+from estado_compartido import crear_estado_compartido
+from consultas import sentencia_carriles_pendientes
+from difusion import Difusor
+from estadisticas import sentencias_acumular
+from series import acumulador_series
+from metricas import Indicador, contar_eventos, eventos_sensor
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+# Máximo de eventos aceptados por POST /mediciones/batch
+MAX_EVENTOS_LOTE = 10000
+# Filas completadas por cada UPDATE masivo
+TAMANO_BLOQUE_UPDATE = 500
+# Intentos de emparejar y persistir un lote antes de responder 409
+INTENTOS_LOTE = 3
+# Timestamps numéricos a partir de este valor se interpretan en milisegundos
+# (1e11 segundos es el año 5138; 1e11 milisegundos, marzo de 1973)
+UMBRAL_TIMESTAMP_MS = 1e11
+
+# Cache de configuración y último POST recibido, compartidos entre workers
+estado = crear_estado_compartido(engine)
+
+# Envío de mediciones a los dashboards suscritos a /stream/mediciones
+difusor = Difusor(estado)
+
+# Pasos pendientes (detector1 sin detector2) de cada carril, mantenidos en memoria
+emparejador = MotorEmparejamiento()
+
+
+def _resumen_pendientes():
+    """
+    (carril, pendientes, desde) de cada carril con pasos pendientes.
+
+    Con varios workers (estado.compartido) otros procesos completan las filas
+    que este tiene en memoria, así que se consulta la tabla, como GET /estado/.
+    """
+    if not estado.compartido:
+        return emparejador.resumen_pendientes()
+    with SessionLocal() as db:
+        return db.execute(sentencia_carriles_pendientes()).all()
+
+
+def _pasos_pendientes():
+    return [((carril,), pendientes) for carril, pendientes, _ in _resumen_pendientes()]
+
+
+def _antiguedad_pendientes():
+    ahora = datetime.now()
+    return [
+        ((carril,), max((ahora - hora_local(desde)).total_seconds(), 0.0))
+        for carril, _, desde in _resumen_pendientes()
+    ]
+
+
+Indicador(
+    "radar_pasos_pendientes", "Pasos por el detector1 que esperan su detector2",
+    ("carril",), _pasos_pendientes
+)
+Indicador(
+    "radar_paso_pendiente_antiguedad_segundos", "Antigüedad del paso pendiente más antiguo",
+    ("carril",), _antiguedad_pendientes
+)
+
+
+def get_distancia_sensores() -> float:
+    """
+    Obtiene la distancia configurada entre los dos sensores desde el estado compartido.
+
+    Esta función retorna el valor cacheado de 'distancia_sensores', que es el mismo en
+    todos los workers. Si no está en cache, retorna un valor por defecto de 100.0 metros.
+
+    Retorno:
+    - float: La distancia en metros entre los sensores.
+    """
+    return estado.config("distancia_sensores", 100.0)
+
+
+def convertir_timestamp(valor):
+    """
+    Convierte timestamp a datetime. Acepta string ISO, unix timestamp, o datetime.
+
+    El resultado es siempre naive en hora local, como los unix timestamp; los
+    valores con zona horaria ("Z", "+00:00", ...) se convierten con hora_local()
+    para que coincidan con lo que devuelve la base de datos.
+    """
+    if isinstance(valor, str):
+        # Probar formato ISO
+        try:
+            return hora_local(datetime.fromisoformat(valor.replace('Z', '+00:00')))
+        except:
+            pass
+    if isinstance(valor, (int, float)):
+        # Unix timestamp en segundos, o en milisegundos como lo envían las placas
+        try:
+            if abs(valor) >= UMBRAL_TIMESTAMP_MS:
+                valor = valor / 1000
+            return datetime.fromtimestamp(valor)
+        except:
+            pass
+    if isinstance(valor, datetime):
+        return hora_local(valor)
+    # Si todo falla, usar ahora
+    return datetime.now()
+
+
+def normalizar_evento(evento) -> Optional[Evento]:
+    """
+    Convierte un evento JSON ({"detector1"|"detector2": ts, "carril": ...}) en Evento.
+
+    Un detector1 con "tiempo_recorrido" (segundos, mayor que 0) es una medición
+    completa calculada en la placa. Si el evento indica "placa", su timestamp se
+    corrige con el modelo de reloj de la placa (relojes.py). Devuelve None si el
+    evento no es válido.
+    """
+    if not isinstance(evento, dict):
+        return None
+    normalizado = _normalizar(evento)
+    if normalizado is None:
+        return None
+    return normalizado._replace(timestamp=corregir_reloj(evento, normalizado.timestamp))
+
+
+def corregir_reloj(datos: dict, timestamp: datetime) -> datetime:
+    """Corrige el timestamp de un evento que indica "placa" con el modelo de reloj de la placa."""
+    placa = datos.get("placa")
+    return timestamp if placa is None else estado.relojes().corregir(str(placa), timestamp)
+
+
+def _normalizar(evento: dict) -> Optional[Evento]:
+    carril = str(evento.get("carril") or CARRIL_POR_DEFECTO)
+    if evento.get("detector1") is not None and evento.get("tiempo_recorrido") is not None:
+        try:
+            tiempo_recorrido = float(evento["tiempo_recorrido"])
+        except (TypeError, ValueError):
+            return None
+        if not tiempo_recorrido > 0:
+            return None
+        return Evento("detector1", carril, convertir_timestamp(evento["detector1"]), tiempo_recorrido)
+    for tipo in ("detector1", "detector2"):
+        if evento.get(tipo) is not None:
+            return Evento(tipo, carril, convertir_timestamp(evento[tipo]))
+    return None
+
+
+def evento_no_valido(datos: dict) -> dict:
+    """Respuesta de POST /mediciones/ a un cuerpo que normalizar_evento() no acepta."""
+    eventos_sensor.inc("ninguno", "error")
+    if datos.get("detector1") is not None and datos.get("tiempo_recorrido") is not None:
+        mensaje = "Tiempo recorrido inválido"
+    else:
+        mensaje = "Datos inválidos. Se espera detector1 o detector2"
+    return {"mensaje": mensaje, "estado": "error"}
+
+
+def respuesta_evento(resultado: dict):
+    """Respuesta de POST /mediciones/: la medición afectada o el mensaje de estado."""
+    if "medicion" in resultado:
+        return resultado["medicion"]
+    return {"mensaje": resultado["mensaje"], "estado": resultado["estado"]}
+
+
+def carriles_lote(normalizados: List[Optional[Evento]]) -> List[str]:
+    """Carriles cuya cola de pasos pendientes usa el lote, en el orden en que se bloquean."""
+    return sorted({
+        evento.carril for evento in normalizados
+        if evento is not None and evento.tiempo_recorrido is None
+    })
+
+
+def carriles_a_releer(normalizados: List[Optional[Evento]]) -> set:
+    """
+    Carriles cuya cola se lee de la tabla antes de emparejar el lote.
+
+    Con un único worker la memoria es exacta. Con varios (estado.compartido),
+    otro worker puede haber iniciado un paso más antiguo que el primero que
+    conoce este proceso, así que la memoria es solo una pista: los carriles en
+    los que el lote completa mediciones (eventos detector2) se leen del índice
+    parcial de pasos pendientes para completar siempre el más antiguo.
+    """
+    if not estado.compartido:
+        return set()
+    return {
+        evento.carril for evento in normalizados
+        if evento is not None and evento.tipo == "detector2"
+    }
+
+
+def datos_ultimo_post(fila: dict, mensaje: str) -> dict:
+    """Datos del último post (para mostrarlo en tiempo real) a partir de una fila de medición."""
+    completa = fila["medicion_completa"]
+    return {
+        "id": fila["id"],
+        "timestamp": fila["timestamp"].isoformat(),
+        "distancia": fila["distancia"],
+        "carril": fila["carril"],
+        "velocidad_ms": round(fila["velocidad_ms"], 2) if completa else None,
+        "velocidad_kmh": round(fila["velocidad_kmh"], 2) if completa else None,
+        "tiempo_recorrido": round(fila["tiempo_recorrido"], 3) if completa else None,
+        "medicion_completa": completa,
+        "es_primera_medicion": fila["es_primera_medicion"],
+        "mensaje": mensaje
+    }
+
+
+def post_lote(plan: PlanLote) -> Optional[dict]:
+    """Último post que publica un lote ya persistido: su último evento que afectó a una medición."""
+    for resultado in reversed(plan.resultados):
+        fila = resultado.get("fila")
+        if fila is not None:
+            return estado.envolver_post(datos_ultimo_post(fila, resultado["mensaje"]))
+    return None
+
+
+def sentencia_completar_una(medicion_id: int, velocidad_ms: float, tiempo_recorrido: float):
+    """
+    UPDATE por clave primaria que completa una medición pendiente.
+
+    La condición sobre medicion_completa detecta, con rowcount == 0, que la fila
+    ya fue completada por otro proceso.
+    """
+    return (
+        update(models.Medicion)
+        .where(
+            models.Medicion.id == medicion_id,
+            models.Medicion.medicion_completa == False
+        )
+        .values(
+            velocidad_ms=velocidad_ms,
+            velocidad_kmh=velocidad_ms * 3.6,
+            tiempo_recorrido=tiempo_recorrido,
+            medicion_completa=True,
+            es_primera_medicion=False
+        )
+    )
+
+
+def sentencia_completar(filas: List[dict]):
+    """
+    Construye un único UPDATE que completa varias mediciones pendientes.
+
+    Los valores de cada fila se seleccionan con CASE sobre el id, y la condición
+    medicion_completa == False permite comprobar con rowcount que ninguna de las
+    filas había sido completada ya por otro proceso.
+    """
+    def por_id(campo):
+        return case({fila["id"]: fila[campo] for fila in filas}, value=models.Medicion.id)
+
+    return (
+        update(models.Medicion)
+        .where(
+            models.Medicion.id.in_([fila["id"] for fila in filas]),
+            models.Medicion.medicion_completa == False
+        )
+        .values(
+            velocidad_ms=por_id("velocidad_ms"),
+            velocidad_kmh=por_id("velocidad_kmh"),
+            tiempo_recorrido=por_id("tiempo_recorrido"),
+            medicion_completa=True,
+            es_primera_medicion=False
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def bloques_completar(plan: PlanLote):
+    """
+    Divide las actualizaciones del plan en UPDATE de TAMANO_BLOQUE_UPDATE filas.
+
+    Una única fila (el caso de POST /mediciones/) se completa con un UPDATE por
+    clave primaria, sin CASE.
+    """
+    if len(plan.actualizaciones) == 1:
+        fila = plan.actualizaciones[0]
+        yield sentencia_completar_una(fila["id"], fila["velocidad_ms"], fila["tiempo_recorrido"]), 1
+        return
+    for inicio in range(0, len(plan.actualizaciones), TAMANO_BLOQUE_UPDATE):
+        bloque = plan.actualizaciones[inicio:inicio + TAMANO_BLOQUE_UPDATE]
+        yield sentencia_completar(bloque), len(bloque)
+
+
+def filas_completadas(plan: PlanLote) -> List[dict]:
+    """Mediciones que el plan completa, para acumularlas en las estadísticas."""
+    return [r["fila"] for r in plan.resultados if r["estado"] == "completada"]
+
+
+def preparar_insercion(filas: List[dict]) -> Tuple[object, List[dict], Dict[tuple, List[dict]]]:
+    """
+    Prepara el INSERT masivo de las filas nuevas de un lote.
+
+    Se usa RETURNING sin sort_by_parameter_order para que SQLite también agrupe
+    el INSERT en lotes; los ids se asignan después con asignar_ids(), casando
+    cada fila devuelta por sus valores (las filas con valores idénticos son
+    intercambiables).
+
+    Retorno:
+    - Tupla (sentencia, parámetros, índice por valores) para ejecutar el INSERT
+      y pasar su resultado a asignar_ids().
+    """
+    columnas = [c.name for c in models.Medicion.__table__.columns if c.name != "id"]
+    por_valores: Dict[tuple, List[dict]] = {}
+    for fila in filas:
+        por_valores.setdefault(tuple(fila[c] for c in columnas), []).append(fila)
+    sentencia = insert(models.Medicion).returning(
+        models.Medicion.id, *[models.Medicion.__table__.c[c] for c in columnas]
+    )
+    parametros = [{columna: fila[columna] for columna in columnas} for fila in filas]
+    return sentencia, parametros, por_valores
+
+
+def asignar_ids(devueltas, por_valores: Dict[tuple, List[dict]]) -> None:
+    for devuelta in devueltas:
+        por_valores[tuple(devuelta[1:])].pop()["id"] = devuelta[0]
+
+
+def aplicar_plan(plan: PlanLote) -> List[dict]:
+    """
+    Aplica a memoria un plan ya confirmado en la base de datos.
+
+    Sustituye las colas de los carriles afectados y construye el resultado de
+    cada evento.
+    """
+    for carril, cola in plan.colas.items():
+        emparejador.reemplazar(carril, [
+            paso if isinstance(paso, Pendiente)
+            else Pendiente(paso["id"], paso["timestamp"], paso["distancia"], carril)
+            for paso in cola
+        ])
+
+    resultados = []
+    for resultado in plan.resultados:
+        fila = resultado.pop("fila", None)
+        if fila is not None:
+            resultado["medicion"] = schemas.MedicionResponse(**fila)
+        resultados.append(resultado)
+    return resultados
+
+
+def persistir_lote(db: Session, plan: PlanLote) -> bool:
+    """
+    Persiste un PlanLote en la transacción actual sin confirmarla.
+
+    Retorna False si alguna de las mediciones pendientes ya no lo estaba en la
+    tabla; en ese caso el llamador debe deshacer la transacción.
+    """
+    if plan.filas_nuevas:
+        sentencia, parametros, por_valores = preparar_insercion(plan.filas_nuevas)
+        asignar_ids(db.execute(sentencia, parametros).all(), por_valores)
+
+    for sentencia, filas in bloques_completar(plan):
+        if db.execute(sentencia).rowcount != filas:
+            return False
+
+    for sentencia in sentencias_acumular(filas_completadas(plan)):
+        db.execute(sentencia)
+    return True
+
+
+def registrar_bloqueado(
+    db: Session,
+    normalizados: List[Optional[Evento]],
+    sentencias_extra: Sequence = ()
+) -> Tuple[List[dict], Optional[dict]]:
+    """
+    Empareja, persiste y confirma un lote con sus carriles ya bloqueados.
+
+    Es la parte común de registrar_lote() y registrar_lote_async(); la versión
+    async la ejecuta con AsyncSession.run_sync(). Las sentencias con las que el
+    estado compartido publica el lote van en la misma transacción. Tras
+    confirmar, aplica el plan a memoria.
+
+    Retorno:
+    - Tupla (resultados, post): un resultado por evento y el último post del
+      lote (ver post_lote), o None.
+
+    Excepciones:
+    - HTTPException (409): Si el estado pendiente cambió en la tabla durante el
+      procesamiento y no pudo resincronizarse.
+    """
+    carriles = carriles_lote(normalizados)
+    releer = carriles_a_releer(normalizados)
+    distancia = get_distancia_sensores()
+
+    for intento in range(INTENTOS_LOTE):
+        colas = {}
+        for carril in carriles:
+            pendientes = emparejador.pendientes(carril)
+            if intento > 0 or carril in releer or not pendientes:
+                # Sin estado en memoria, con varios workers o tras un conflicto: leer la tabla
+                pendientes = emparejador.reconstruir_carril(db, carril)
+            colas[carril] = pendientes
+
+        plan = emparejar_lote(colas, normalizados, distancia)
+        if persistir_lote(db, plan):
+            post = post_lote(plan)
+            for sentencia in [*sentencias_extra, *estado.sentencias_publicar(post)]:
+                db.execute(sentencia)
+            db.commit()
+            break
+        db.rollback()
+    else:
+        raise HTTPException(
+            status_code=409,
+            detail="Las mediciones pendientes cambiaron durante el lote. Reintente"
+        )
+
+    acumulador_series.registrar(filas_completadas(plan))
+    return aplicar_plan(plan), post
+
+
+def publicar_lote(normalizados: List[Optional[Evento]], resultados: List[dict], post: Optional[dict]) -> None:
+    """Tras confirmar un lote: invalida las lecturas cacheadas, cuenta los eventos y publica el último."""
+    estado.publicado(post)
+    contar_eventos(normalizados, resultados)
+    if post is not None:
+        # Avisar a los dashboards de este worker sin esperar al sondeo
+        difusor.notificar()
+
+
+def registrar_lote(
+    db: Session,
+    normalizados: List[Optional[Evento]],
+    sentencias_extra: Sequence = ()
+) -> List[dict]:
+    """
+    Empareja y persiste en una transacción una secuencia ordenada de eventos.
+
+    Es la lógica de POST /mediciones/ y POST /mediciones/batch, compartida con
+    el escritor del diario de ingesta (diario.py).
+
+    Parámetros:
+    - db (Session): Sesión de base de datos de SQLAlchemy.
+    - normalizados (List[Evento]): Eventos en orden de llegada; None para los no válidos.
+    - sentencias_extra (Sequence, opcional): Sentencias que se ejecutan en la
+      misma transacción antes de confirmarla.
+
+    Retorno:
+    - List[dict]: Un resultado por evento, en el mismo orden.
+
+    Excepciones:
+    - HTTPException (409): Si el estado pendiente cambió en la tabla durante el
+      procesamiento y no pudo resincronizarse.
+    """
+    with ExitStack() as bloqueos:
+        # Bloquear los carriles en orden fijo para evitar interbloqueos entre lotes
+        for carril in carriles_lote(normalizados):
+            bloqueos.enter_context(emparejador.bloqueo(carril))
+        resultados, post = registrar_bloqueado(db, normalizados, sentencias_extra)
+
+    publicar_lote(normalizados, resultados, post)
+    return resultados
+
+
+async def registrar_lote_async(db: "AsyncSession", normalizados: List[Optional[Evento]]) -> List[dict]:
+    """
+    Equivalente de registrar_lote() para los endpoints async.
+
+    Bloquea los carriles con locks de asyncio y ejecuta registrar_bloqueado()
+    con AsyncSession.run_sync(), de modo que las sentencias son las mismas y la
+    espera a la base de datos no ocupa el event loop. La publicación, que puede
+    escribir en disco o en la base de datos, se hace en el threadpool.
+    """
+    async with AsyncExitStack() as bloqueos:
+        for carril in carriles_lote(normalizados):
+            await bloqueos.enter_async_context(emparejador.bloqueo_async(carril))
+        resultados, post = await db.run_sync(registrar_bloqueado, normalizados)
+
+    await run_in_threadpool(publicar_lote, normalizados, resultados, post)
+    return resultados
@@ -1,21 +1,41 @@
-from fastapi import FastAPI, Depends, HTTPException, Query, Body
+from fastapi import FastAPI, Depends, HTTPException, Query, Body, Request, Response
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 from sqlalchemy import func, Integer, case
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, date
 from typing import List, Optional, Union, Dict
+import asyncio
+import json
 import os
 
-from database import engine, get_db, Base
+from database import engine, async_engine, get_db, Base, DB_ASYNC
 import models
 import schemas
+from migraciones import aplicar_migraciones
+from exportacion import exportar, formato_disponible, FORMATOS
+from respuestas import cache_respuestas
+from consultas import (
+    sentencia_listado, sentencia_estadisticas, respuesta_estadisticas,
+    sentencia_series, respuesta_series, decodificar_cursor, paginar,
+    sentencia_hay_pendiente, sentencia_carriles_pendientes, respuesta_estado
+)
+from ingesta import (
+    estado, emparejador, difusor, MAX_EVENTOS_LOTE, get_distancia_sensores,
+    normalizar_evento, evento_no_valido, respuesta_evento, registrar_lote
+)
+from series import rango_series, init_series, volcar_series, volcar_periodicamente
+from estadisticas import init_estadisticas, reconciliar_periodicamente
+from retencion import preparar_particiones, mantener_periodicamente
+from diario import diario
+from metricas import (
+    METRICAS, MiddlewareMetricas, TIPO_CONTENIDO_METRICAS, exportar as exportar_metricas
+)
 
-# Cache en memoria para configuración
-_config_cache = {"distancia_sensores": None, "limite_velocidad": None}
-
-# Almacenamiento del último POST recibido para mostrar en tiempo real
-_ultimo_post = {"timestamp": None, "data": None}
+# Intervalo máximo sin datos en el stream antes de enviar un comentario keep-alive
+KEEPALIVE_STREAM = 15
 
 app = FastAPI(
     title="Radar de Velocidad API",
@@ -42,8 +62,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Cursores de paginación de GET /mediciones/ y ETag de las respuestas condicionales
+    expose_headers=["X-Cursor-Siguiente", "X-Cursor-Anterior", "ETag"],
 )
 
+# Duración de cada petición por ruta para GET /metrics; se añade después de CORS
+# para que sea el middleware exterior y mida también las respuestas de CORS
+if METRICAS:
+    app.add_middleware(MiddlewareMetricas)
+
+# Con INGESTA_DIFERIDA, los POST de ingesta solo anotan los eventos en el diario
+# local y un hilo los aplica después en grupos (ver diario.py)
+if diario is not None:
+    from rutas_diferidas import router as router_diferido
+    app.include_router(router_diferido)
+
+# Con DB_ASYNC, las rutas async de ingesta, listado y estadísticas se registran
+# antes que las síncronas equivalentes y tienen prioridad sobre ellas
+if DB_ASYNC:
+    from rutas_async import router as router_async
+    app.include_router(router_async)
+
 
 def init_configuracion(db: Session):
     """
@@ -99,35 +138,76 @@ def init_configuracion(db: Session):
 
 @app.on_event("startup")
 def startup_event():
+    # Con PARTICIONES_MENSUALES, mediciones se crea (o convierte) como tabla particionada
+    preparar_particiones(engine)
     Base.metadata.create_all(bind=engine)
+    aplicar_migraciones(engine)
     with next(get_db()) as db:
         # Inicializar configuración en DB (ya verifica duplicados)
         init_configuracion(db)
 
-        # Cargar configuración en cache
+        # Cargar configuración en el estado compartido
         config = db.query(models.Configuracion).filter(
             models.Configuracion.clave == "distancia_sensores"
         ).first()
-        _config_cache["distancia_sensores"] = float(config.valor) if config else 100.0
-
         limite = db.query(models.Configuracion).filter(
             models.Configuracion.clave == "limite_velocidad"
         ).first()
-        _config_cache["limite_velocidad"] = float(limite.valor) if limite else 50.0
+        estado.iniciar({
+            "distancia_sensores": float(config.valor) if config else 100.0,
+            "limite_velocidad": float(limite.valor) if limite else 50.0
+        })
 
+        # Recuperar las mediciones pendientes que quedaron en la tabla
+        emparejador.reconstruir(db)
 
+        # Crear (y calcular la primera vez) las estadísticas materializadas
+        init_estadisticas(db)
+        # Rellenar las series por intervalo con las mediciones anteriores
+        init_series(db)
 
-def get_distancia_sensores() -> float:
-    """
-    Obtiene la distancia configurada entre los dos sensores desde la cache en memoria.
+    if diario is not None:
+        # Aplicar los eventos que quedaron en el diario y lanzar su escritor
+        diario.iniciar()
 
-    Esta función retorna el valor cacheado de 'distancia_sensores'. Si no está en cache,
-    retorna un valor por defecto de 100.0 metros.
 
-    Retorno:
-    - float: La distancia en metros entre los sensores.
-    """
-    return _config_cache.get("distancia_sensores", 100.0)
+@app.on_event("startup")
+async def iniciar_difusion():
+    difusor.iniciar(asyncio.get_running_loop())
+
+
+_tareas_fondo: List[asyncio.Task] = []
+
+
+@app.on_event("startup")
+async def iniciar_tareas_fondo():
+    _tareas_fondo.append(asyncio.create_task(
+        reconciliar_periodicamente(tras_reconciliar=estado.invalidar_lecturas)
+    ))
+    _tareas_fondo.append(asyncio.create_task(volcar_periodicamente()))
+    _tareas_fondo.append(asyncio.create_task(mantener_periodicamente(tras_mantener=_tras_mantener)))
+
+
+def _tras_mantener(frontera: datetime) -> None:
+    # Los pasos pendientes anteriores a la frontera se eliminaron de la tabla
+    emparejador.descartar_anteriores(frontera)
+    estado.invalidar_lecturas()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for tarea in _tareas_fondo:
+        tarea.cancel()
+    if diario is not None:
+        # Aplicar los eventos anotados que el escritor no llegó a procesar
+        await run_in_threadpool(diario.detener)
+    # Volcar las series acumuladas desde el último volcado periódico
+    await run_in_threadpool(volcar_series)
+    await difusor.detener()
+    estado.cerrar()
+    if async_engine is not None:
+        await async_engine.dispose()
+
 
 
 @app.post("/mediciones/")
@@ -139,150 +219,80 @@ def registrar_medicion(
     Registra una nueva medición de velocidad o completa una medición pendiente.
 
     Esta función maneja la lógica principal del sistema de radar de velocidad.
-    - Cuando llega {"detector1": "timestamp"}: inicia una nueva medición
-    - Ignora detector1 adicionales mientras haya medición pendiente
-    - Cuando llega {"detector2": "timestamp"}: completa la medición pendiente y calcula velocidad
-    
+    - Cuando llega {"detector1": "timestamp"}: inicia una nueva medición en el carril
+    - Cuando llega {"detector2": "timestamp"}: completa la medición pendiente más
+      antigua del carril (FIFO) y calcula velocidad
+    - La clave opcional "carril" identifica la estación/carril del par de sensores;
+      cada carril admite varios vehículos entre los sensores a la vez
+    - Cuando llega {"detector1": "timestamp", "tiempo_recorrido": segundos}: registra
+      una medición ya completa, calculada en una placa que lee los dos sensores
+      (placa/radar_doble.py), sin pasar por la cola de pasos pendientes
+
+    El evento se registra como un lote de un único evento (ingesta.registrar_lote).
+    Los pasos pendientes se mantienen en memoria (MotorEmparejamiento), por lo que
+    detector1 cuesta un único INSERT y detector2 un UPDATE por clave primaria más la
+    actualización de las estadísticas materializadas, sin ningún SELECT. Solo se
+    consulta la tabla si la memoria no conoce pasos pendientes del carril (arranque,
+    u otro worker los inició o completó) y, con varios workers, en cada detector2,
+    para completar el paso pendiente más antiguo del carril aunque lo haya
+    iniciado otro worker (ver ingesta.carriles_a_releer).
+
     Parámetros:
-    - datos: JSON con clave "detector1" o "detector2" y su timestamp como valor
+    - datos: JSON con clave "detector1" o "detector2" y su timestamp como valor,
+      y opcionalmente "carril" (por defecto "principal")
     - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
 
     Retorno:
     - Medición registrada, completada o mensaje de estado
+
+    Excepciones:
+    - HTTPException (409): Si el estado pendiente cambió en la tabla durante el
+      procesamiento y no pudo resincronizarse.
     """
-    
-    def convertir_timestamp(valor):
-        """Convierte timestamp a datetime. Acepta string ISO, unix timestamp, o datetime"""
-        if isinstance(valor, str):
-            # Probar formato ISO
-            try:
-                return datetime.fromisoformat(valor.replace('Z', '+00:00'))
-            except:
-                pass
-        if isinstance(valor, (int, float)):
-            # Unix timestamp (segundos)
-            try:
-                return datetime.fromtimestamp(valor)
-            except:
-                pass
-        if isinstance(valor, datetime):
-            return valor
-        # Si todo falla, usar ahora
-        return datetime.now()
-    
-    # Extraer detector1 o detector2 del JSON
-    detector1 = datos.get("detector1")
-    detector2 = datos.get("detector2")
-    
-    # Si llega detector1
-    if detector1 is not None:
-        # Verificar si ya hay una medición pendiente
-        medicion_pendiente = db.query(models.Medicion).filter(
-            models.Medicion.es_primera_medicion == True,
-            models.Medicion.medicion_completa == False
-        ).first()
-        
-        if medicion_pendiente:
-            # Ya hay una medición esperando detector2, ignorar este detector1
-            return {
-                "mensaje": "Medición ya en progreso. Esperando detector 2",
-                "estado": "ignorado"
-            }
-        
-        # Convertir timestamp a datetime
-        timestamp_dt = convertir_timestamp(detector1)
-        
-        # Crear nueva medición con detector1
-        distancia = get_distancia_sensores()
-        nueva_medicion = models.Medicion(
-            timestamp=timestamp_dt,
-            distancia=distancia,
-            es_primera_medicion=True,
-            medicion_completa=False
+    evento = normalizar_evento(datos)
+    if evento is None:
+        return evento_no_valido(datos)
+    return respuesta_evento(registrar_lote(db, [evento])[0])
+
+
+@app.post("/mediciones/batch")
+def registrar_mediciones_lote(
+    eventos: List[Dict] = Body(...),
+    db: Session = Depends(get_db)
+):
+    """
+    Registra en una sola petición una secuencia ordenada de eventos de sensor.
+
+    Pensado para pasarelas y para reenviar eventos acumulados: cada elemento tiene
+    la misma forma que el cuerpo de POST /mediciones/ ({"detector1": ts} o
+    {"detector2": ts}, con "carril" opcional). Los eventos se emparejan en una
+    única pasada en memoria, en el orden recibido, y se persisten en una sola
+    transacción: un INSERT masivo para los pasos nuevos y un UPDATE masivo para
+    las mediciones pendientes que el lote completa.
+
+    Parámetros:
+    - eventos: Lista JSON de eventos en orden de llegada (máximo MAX_EVENTOS_LOTE).
+    - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
+
+    Retorno:
+    - Dict con "procesados" y "resultados": un resultado por evento, en el mismo
+      orden, con su "estado" (pendiente, completada, ignorado o error), "mensaje"
+      y, si aplica, la "medicion" afectada.
+
+    Excepciones:
+    - HTTPException (413): Si el lote supera MAX_EVENTOS_LOTE eventos.
+    - HTTPException (409): Si el estado pendiente cambió en la tabla durante el
+      procesamiento y no pudo resincronizarse.
+    """
+    if len(eventos) > MAX_EVENTOS_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote admite como máximo {MAX_EVENTOS_LOTE} eventos"
         )
-        db.add(nueva_medicion)
-        db.commit()
-        db.refresh(nueva_medicion)
-        
-        # Guardar en memoria para mostrar en tiempo real
-        _ultimo_post["timestamp"] = datetime.now().isoformat()
-        _ultimo_post["data"] = {
-            "id": nueva_medicion.id,
-            "timestamp": nueva_medicion.timestamp.isoformat(),
-            "distancia": nueva_medicion.distancia,
-            "velocidad_ms": None,
-            "velocidad_kmh": None,
-            "tiempo_recorrido": None,
-            "medicion_completa": False,
-            "es_primera_medicion": True,
-            "mensaje": "Sensor 1 activado. Esperando sensor 2..."
-        }
-        
-        return nueva_medicion
-    
-    # Si llega detector2
-    elif detector2 is not None:
-        # Buscar medición pendiente
-        medicion_pendiente = db.query(models.Medicion).filter(
-            models.Medicion.es_primera_medicion == True,
-            models.Medicion.medicion_completa == False
-        ).first()
-        
-        if not medicion_pendiente:
-            # No hay medición iniciada, ignorar este detector2
-            return {
-                "mensaje": "No hay medición en progreso. Esperando detector 1",
-                "estado": "ignorado"
-            }
-        
-        # Convertir timestamp a datetime
-        timestamp_dt = convertir_timestamp(detector2)
-        
-        # Completar la medición
-        distancia = get_distancia_sensores()
-        tiempo_recorrido = (timestamp_dt - medicion_pendiente.timestamp).total_seconds()
-        
-        # Evitar división por cero
-        if tiempo_recorrido <= 0:
-            return {
-                "mensaje": "Tiempo recorrido inválido",
-                "estado": "error"
-            }
-        
-        velocidad_ms = distancia / tiempo_recorrido
-        velocidad_kmh = velocidad_ms * 3.6
-
-        medicion_pendiente.velocidad_ms = velocidad_ms
-        medicion_pendiente.velocidad_kmh = velocidad_kmh
-        medicion_pendiente.tiempo_recorrido = tiempo_recorrido
-        medicion_pendiente.medicion_completa = True
-        medicion_pendiente.es_primera_medicion = False
-
-        db.commit()
-        db.refresh(medicion_pendiente)
-        
-        # Guardar en memoria para mostrar en tiempo real
-        _ultimo_post["timestamp"] = datetime.now().isoformat()
-        _ultimo_post["data"] = {
-            "id": medicion_pendiente.id,
-            "timestamp": medicion_pendiente.timestamp.isoformat(),
-            "distancia": medicion_pendiente.distancia,
-            "velocidad_ms": round(medicion_pendiente.velocidad_ms, 2),
-            "velocidad_kmh": round(medicion_pendiente.velocidad_kmh, 2),
-            "tiempo_recorrido": round(medicion_pendiente.tiempo_recorrido, 3),
-            "medicion_completa": True,
-            "es_primera_medicion": False,
-            "mensaje": "Medición completada"
-        }
-        
-        return medicion_pendiente
-    
-    else:
-        # No llegó ni detector1 ni detector2
-        return {
-            "mensaje": "Datos inválidos. Se espera detector1 o detector2",
-            "estado": "error"
-        }
+
+    normalizados = [normalizar_evento(evento) for evento in eventos]
+    resultados = registrar_lote(db, normalizados)
+    return {"procesados": len(resultados), "resultados": resultados}
 
 
 @app.get("/ultimo-post/")
@@ -290,21 +300,134 @@ def obtener_ultimo_post():
     """
     Devuelve el último POST recibido en /mediciones/ para mostrar en tiempo real.
     
-    Este endpoint es usado por auto.html para mostrar los datos que llegan
-    de los sensores en tiempo real.
+    Los dashboards usan /stream/mediciones para recibir estos datos en tiempo real;
+    este endpoint queda como alternativa por polling cuando el stream no está disponible.
     """
-    if _ultimo_post["data"] is None:
+    ultimo_post = estado.ultimo_post()
+    if ultimo_post["data"] is None:
         return {"mensaje": "No hay datos aún", "data": None}
-    return _ultimo_post
+    return ultimo_post
+
+
+@app.get("/estado/", response_model=schemas.EstadoResponse)
+def obtener_estado(db: Session = Depends(get_db)):
+    """
+    Indica qué carriles tienen un paso por el detector1 esperando al detector2.
+
+    Con un único proceso (ESTADO_COMPARTIDO=memoria) el motor de emparejamiento
+    conoce todos los pasos pendientes y la respuesta sale de memoria, sin
+    consultar la base de datos. Con varios workers cada uno solo conoce los
+    suyos, así que se consulta la tabla mediante el índice parcial
+    ix_mediciones_pendientes, que solo contiene las filas pendientes.
+
+    Mantiene los campos del /estado/ de la API simple (esperando_sensor2,
+    distancia_sensores y limite_velocidad), por lo que los clientes de ambas
+    APIs usan el mismo endpoint.
+
+    Parámetros:
+    - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
+
+    Retorno:
+    - EstadoResponse: esperando_sensor2, la configuración actual y, por cada
+      carril con pasos pendientes, cuántos hay, el timestamp del más antiguo y
+      su antigüedad en segundos.
+    """
+    if estado.compartido:
+        filas = db.execute(sentencia_carriles_pendientes()).all()
+    else:
+        filas = emparejador.resumen_pendientes()
+    return respuesta_estado(
+        filas, get_distancia_sensores(), estado.config("limite_velocidad", 50.0)
+    )
+
+
+@app.post("/relojes/latido", response_model=schemas.RelojResponse)
+def registrar_latido(latido: schemas.LatidoCreate):
+    """
+    Registra un latido de reloj de una placa detectora (ver relojes.py).
+
+    Las placas lo envían periódicamente con su ticks_ms y la hora que creen
+    que es; con ellos se estima el desfase y la deriva de su reloj, que se
+    aplican a los eventos que indican la misma "placa".
+
+    Parámetros:
+    - latido (LatidoCreate): Identificador de la placa, ticks_ms y hora Unix de
+      la placa en milisegundos al enviar el latido.
+
+    Retorno:
+    - RelojResponse: Modelo actualizado del reloj de la placa.
+    """
+    return estado.anotar_latido(latido.placa, latido.ticks, latido.epoch)
+
+
+@app.get("/relojes/", response_model=List[schemas.RelojResponse])
+def listar_relojes():
+    """Desfase (ms) y deriva (ppm) estimados del reloj de cada placa que envía latidos."""
+    return estado.relojes().resumen()
+
+
+@app.get("/metrics", include_in_schema=False)
+def obtener_metricas():
+    """
+    Métricas del proceso en el formato de texto de Prometheus (ver metricas.py).
+
+    Incluye la latencia por ruta, la duración y el número de sentencias SQL, la
+    espera por conexiones del pool, los eventos de sensor por detector y
+    resultado, y los pasos pendientes por carril con su antigüedad. Cada worker
+    exporta sus propias métricas.
+    """
+    return Response(exportar_metricas(), media_type=TIPO_CONTENIDO_METRICAS)
+
+
+@app.get("/stream/mediciones")
+async def stream_mediciones(request: Request):
+    """
+    Canal Server-Sent Events con las mediciones en tiempo real.
+
+    Sustituye al polling de /ultimo-post/: al conectarse el cliente recibe el último
+    post actual y, a partir de ahí, un evento "medicion" cada vez que registrar_medicion
+    inicia o completa una medición en cualquier worker. Los datos de cada evento tienen
+    el mismo formato que la respuesta de /ultimo-post/.
+
+    Parámetros:
+    - request (Request): Petición HTTP, usada para detectar la desconexión del cliente.
+
+    Retorno:
+    - StreamingResponse de tipo text/event-stream.
+    """
+    async def eventos():
+        async with difusor.suscripcion() as cola:
+            post = estado.ultimo_post()
+            if post["data"] is not None:
+                yield f"event: medicion\ndata: {json.dumps(post)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    post = await asyncio.wait_for(cola.get(), timeout=KEEPALIVE_STREAM)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if post is None:
+                    break
+                yield f"event: medicion\ndata: {json.dumps(post)}\n\n"
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/mediciones/", response_model=List[schemas.MedicionResponse])
 def listar_mediciones(
+    request: Request,
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=100),
     solo_completas: bool = Query(True),
     fecha_inicio: Optional[date] = None,
     fecha_fin: Optional[date] = None,
+    carril: Optional[str] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     """
@@ -312,10 +435,24 @@ def listar_mediciones(
 
     Esta función permite obtener una lista de mediciones almacenadas en la base de datos,
     con la posibilidad de aplicar filtros por estado de completitud, rango de fechas,
-    y controlar la paginación mediante skip y limit.
+    y controlar la paginación mediante cursores (o skip y limit).
+
+    La paginación por cursor compara (timestamp, id) con la última medición de la
+    página anterior en lugar de saltar filas, por lo que cualquier página cuesta lo
+    mismo que la primera. Los cursores de las páginas vecinas se devuelven en las
+    cabeceras X-Cursor-Siguiente y X-Cursor-Anterior (ausentes si no hay página).
+
+    La primera página (sin cursor ni skip), que es la que consultan los
+    dashboards, se sirve desde la caché de respuestas mientras no se registren
+    mediciones, con ETag y 304 si el cliente ya la tiene.
+
+    Parámetros:
+    - request (Request): Petición HTTP, usada como clave de la caché y para If-None-Match.
+    - response (Response): Respuesta HTTP, usada para escribir las cabeceras de cursor.
 
     Parámetros de consulta:
-    - skip (int): Número de registros a saltar (para paginación). Por defecto 0. Debe ser >= 0.
+    - skip (int): Número de registros a saltar. Por defecto 0. Solo se usa sin cursor;
+      su coste crece con el número de filas saltadas.
     - limit (int): Número máximo de registros a retornar. Por defecto 20. Debe estar entre 1 y 100.
     - solo_completas (bool): Si True, solo retorna mediciones completas (con velocidad calculada).
       Por defecto True.
@@ -323,28 +460,95 @@ def listar_mediciones(
       Si se proporciona, solo incluye mediciones desde esta fecha inclusive.
     - fecha_fin (date, opcional): Fecha de fin para filtrar mediciones (formato YYYY-MM-DD).
       Si se proporciona, solo incluye mediciones hasta esta fecha inclusive.
+    - carril (str, opcional): Si se proporciona, solo incluye mediciones de ese carril.
+    - cursor (str, opcional): Token de X-Cursor-Siguiente o X-Cursor-Anterior de una
+      respuesta anterior con los mismos filtros.
     - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
 
     Retorno:
     - List[MedicionResponse]: Lista de objetos MedicionResponse ordenados por timestamp descendente
       (más recientes primero), aplicando los filtros y límites especificados.
 
-    La función construye una consulta SQLAlchemy dinámicamente aplicando los filtros
-    solicitados y retorna los resultados paginados.
+    Excepciones:
+    - HTTPException (400): Si el cursor no es válido.
+    """
+    try:
+        posicion = decodificar_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    generacion = estado.generacion()
+    primera_pagina = posicion is None and skip == 0
+    if primera_pagina:
+        cacheada = cache_respuestas.responder(request, generacion)
+        if cacheada is not None:
+            return cacheada
+
+    filas = db.scalars(sentencia_listado(
+        skip, limit, solo_completas, fecha_inicio, fecha_fin, carril, posicion
+    )).all()
+    mediciones, siguiente, anterior = paginar(filas, limit, posicion, skip)
+    cabeceras = {}
+    if siguiente:
+        cabeceras["X-Cursor-Siguiente"] = siguiente
+    if anterior:
+        cabeceras["X-Cursor-Anterior"] = anterior
+    if primera_pagina:
+        return cache_respuestas.guardar(
+            request, generacion,
+            [schemas.MedicionResponse.model_validate(medicion) for medicion in mediciones],
+            cabeceras
+        )
+    response.headers.update(cabeceras)
+    return mediciones
+
+
+@app.get("/mediciones/export")
+def exportar_mediciones(
+    formato: str = Query("csv"),
+    solo_completas: bool = Query(True),
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    carril: Optional[str] = None
+):
     """
-    query = db.query(models.Medicion)
+    Exporta todas las mediciones que cumplen los filtros en una única respuesta en streaming.
+
+    A diferencia de GET /mediciones/, no tiene límite de filas: se leen de la base de
+    datos en bloques con un cursor del lado del servidor y cada bloque se envía en
+    cuanto se serializa, con un uso de memoria constante.
 
-    if solo_completas:
-        query = query.filter(models.Medicion.medicion_completa == True)
+    Parámetros de consulta:
+    - formato (str): "csv" (por defecto), "ndjson", "parquet" o "arrow" (Arrow IPC
+      stream). Los dos últimos requieren pyarrow en el servidor.
+    - solo_completas (bool): Si True, solo exporta mediciones completas. Por defecto True.
+    - fecha_inicio, fecha_fin (date, opcional): Rango de fechas, ambos inclusive.
+    - carril (str, opcional): Si se proporciona, solo exporta mediciones de ese carril.
+
+    Retorno:
+    - StreamingResponse con las mediciones en orden cronológico.
 
-    if fecha_inicio:
-        inicio = datetime.combine(fecha_inicio, datetime.min.time())
-        query = query.filter(models.Medicion.timestamp >= inicio)
-    if fecha_fin:
-        fin = datetime.combine(fecha_fin, datetime.max.time())
-        query = query.filter(models.Medicion.timestamp <= fin)
+    Excepciones:
+    - HTTPException (400): Si el formato no existe.
+    - HTTPException (501): Si el formato requiere pyarrow y no está instalado.
+    """
+    if formato not in FORMATOS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Formato no válido. Opciones: {', '.join(FORMATOS)}"
+        )
+    if not formato_disponible(formato):
+        raise HTTPException(
+            status_code=501,
+            detail=f"La exportación {formato} requiere pyarrow en el servidor"
+        )
 
-    return query.order_by(models.Medicion.timestamp.desc()).offset(skip).limit(limit).all()
+    tipo, extension, _ = FORMATOS[formato]
+    return StreamingResponse(
+        exportar(formato, solo_completas, fecha_inicio, fecha_fin, carril),
+        media_type=tipo,
+        headers={"Content-Disposition": f'attachment; filename="mediciones.{extension}"'}
+    )
 
 
 @app.get("/mediciones/{medicion_id}", response_model=schemas.MedicionResponse)
@@ -377,7 +581,7 @@ def obtener_medicion(medicion_id: int, db: Session = Depends(get_db)):
 
 
 @app.get("/estadisticas/", response_model=schemas.EstadisticasResponse)
-def obtener_estadisticas(db: Session = Depends(get_db)):
+def obtener_estadisticas(request: Request, db: Session = Depends(get_db)):
     """
     Obtiene estadísticas generales de todas las mediciones completas.
 
@@ -386,6 +590,7 @@ def obtener_estadisticas(db: Session = Depends(get_db)):
     Incluye promedios, máximos, mínimos, conteos por día y excesos de velocidad.
 
     Parámetros:
+    - request (Request): Petición HTTP, usada como clave de la caché y para If-None-Match.
     - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
 
     Retorno:
@@ -398,54 +603,121 @@ def obtener_estadisticas(db: Session = Depends(get_db)):
       - excesos_velocidad: Número de mediciones donde la velocidad supera los 50 km/h.
 
     Cálculos realizados:
-    - Consulta todas las mediciones completas.
-    - Calcula estadísticas agregadas usando funciones SQL (AVG, MAX, MIN).
-    - Filtra mediciones del día actual usando la fecha de hoy.
-    - Cuenta excesos de velocidad (mayor a 50 km/h).
+    - Los agregados se mantienen en las tablas estadisticas_resumen y
+      estadisticas_diarias al completar cada medición, y se reconcilian con la
+      tabla mediciones cada ESTADISTICAS_RECONCILIACION segundos.
+    - Se leen la fila del resumen y la del día actual en una única consulta, con
+      coste constante independientemente del número de mediciones.
     - Redondea los valores de velocidad a 2 decimales para presentación.
+    - La respuesta se guarda en la caché de respuestas hasta la siguiente
+      medición o cambio de configuración (o CACHE_RESPUESTAS_TTL segundos), y
+      lleva ETag para responder 304 si el cliente ya la tiene.
 
     Si no hay mediciones completas, los valores de velocidad serán None.
     """
-    hoy = date.today()
-    inicio_hoy = datetime.combine(hoy, datetime.min.time())
-    fin_hoy = datetime.combine(hoy, datetime.max.time())
-
-    # Query única consolidada
-    stats = db.query(
-        func.count(models.Medicion.id).label("total"),
-        func.avg(models.Medicion.velocidad_kmh).label("promedio"),
-        func.max(models.Medicion.velocidad_kmh).label("maxima"),
-        func.min(models.Medicion.velocidad_kmh).label("minima"),
-        func.sum(
-            case((
-                (models.Medicion.timestamp >= inicio_hoy) &
-                (models.Medicion.timestamp <= fin_hoy), 1
-            ), else_=0)
-        ).label("mediciones_hoy"),
-        func.sum(
-            case((models.Medicion.velocidad_kmh > 50, 1), else_=0)
-        ).label("excesos")
-    ).filter(models.Medicion.medicion_completa == True).first()
-
-    return schemas.EstadisticasResponse(
-        total_mediciones=stats.total or 0,
-        velocidad_promedio_kmh=round(stats.promedio, 2) if stats.promedio else None,
-        velocidad_maxima_kmh=round(stats.maxima, 2) if stats.maxima else None,
-        velocidad_minima_kmh=round(stats.minima, 2) if stats.minima else None,
-        mediciones_hoy=stats.mediciones_hoy or 0,
-        excesos_velocidad=stats.excesos or 0
+    generacion = estado.generacion()
+    cacheada = cache_respuestas.responder(request, generacion)
+    if cacheada is not None:
+        return cacheada
+
+    # Query única sobre las estadísticas materializadas
+    stats = db.execute(sentencia_estadisticas(date.today())).first()
+    return cache_respuestas.guardar(request, generacion, respuesta_estadisticas(stats))
+
+
+@app.get("/estadisticas/series", response_model=List[schemas.PuntoSerieResponse])
+def obtener_series(
+    granularidad: str = Query("hora"),
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Obtiene la serie temporal de velocidades agregada por minuto, hora o día.
+
+    Los intervalos se leen de la tabla series_velocidad, que se rellena a medida
+    que se completan mediciones (con un retraso de hasta SERIES_INTERVALO segundos),
+    por lo que el coste depende del número de puntos y no del de mediciones.
+
+    Parámetros de consulta:
+    - granularidad (str): "minuto", "hora" o "dia". Por defecto "hora".
+    - fecha_inicio (date, opcional): Primer día del rango (formato YYYY-MM-DD).
+      Por defecto, el mismo que fecha_fin.
+    - fecha_fin (date, opcional): Último día del rango, inclusive. Por defecto, hoy.
+    - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
+
+    Retorno:
+    - List[PuntoSerieResponse]: Un punto por intervalo con mediciones, en orden
+      cronológico, con total, velocidad media, percentiles 50/85/95 (estimados con
+      un error relativo menor del 1 %) y número de excesos.
+
+    Excepciones:
+    - HTTPException (400): Si la granularidad no es válida o el rango contiene más
+      de MAX_PUNTOS_SERIE intervalos.
+    """
+    fecha_inicio, fecha_fin = rango_series(granularidad, fecha_inicio, fecha_fin)
+    return respuesta_series(db.scalars(sentencia_series(granularidad, fecha_inicio, fecha_fin)))
+
+
+@app.get("/dashboard/snapshot", response_model=schemas.DashboardSnapshotResponse)
+def obtener_snapshot_dashboard(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    desde: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Devuelve en una sola respuesta todo lo que necesita una página del dashboard.
+
+    Sustituye a las llamadas separadas a /estadisticas/, /mediciones/, la configuración
+    de distancia y límite y la comprobación de medición pendiente: las consultas se
+    hacen en una única sesión de base de datos y la configuración se lee del estado
+    compartido. La respuesta se guarda en la caché de respuestas y lleva ETag; si
+    el cliente envía If-None-Match con el mismo valor, se responde 304 sin cuerpo.
+
+    Parámetros:
+    - request (Request): Petición HTTP, usada como clave de la caché y para If-None-Match.
+    - limit (int): Número de últimas mediciones completas a incluir. Por defecto 10.
+    - desde (datetime, opcional): Si se proporciona, solo incluye mediciones posteriores.
+    - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
+
+    Retorno:
+    - DashboardSnapshotResponse con estadísticas, últimas mediciones, distancia entre
+      sensores, límite de velocidad y si hay una medición esperando al sensor 2.
+    """
+    generacion = estado.generacion()
+    cacheada = cache_respuestas.responder(request, generacion)
+    if cacheada is not None:
+        return cacheada
+
+    sentencia = sentencia_listado(limit=limit)
+    if desde is not None:
+        sentencia = sentencia.where(models.Medicion.timestamp >= desde)
+    mediciones = db.scalars(sentencia).all()[:limit]
+
+    snapshot = schemas.DashboardSnapshotResponse(
+        estadisticas=respuesta_estadisticas(db.execute(sentencia_estadisticas(date.today())).first()),
+        ultimas_mediciones=mediciones,
+        distancia_sensores=get_distancia_sensores(),
+        limite_velocidad=estado.config("limite_velocidad", 50.0),
+        hay_medicion_pendiente=db.scalar(sentencia_hay_pendiente())
     )
+    return cache_respuestas.guardar(request, generacion, snapshot)
 
 
 @app.get("/configuracion/", response_model=List[schemas.ConfiguracionResponse])
-def listar_configuracion(db: Session = Depends(get_db)):
+def listar_configuracion(request: Request, db: Session = Depends(get_db)):
     """
     Lista todas las configuraciones almacenadas en la base de datos.
 
     Esta función retorna una lista completa de todas las entradas en la tabla
     Configuracion, incluyendo claves, valores y descripciones.
 
+    La respuesta se sirve desde la caché de respuestas hasta que cambie alguna
+    configuración, con ETag y 304 si el cliente ya la tiene.
+
     Parámetros:
+    - request (Request): Petición HTTP, usada como clave de la caché y para If-None-Match.
     - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
 
     Retorno:
@@ -455,19 +727,31 @@ def listar_configuracion(db: Session = Depends(get_db)):
     Esta función es útil para obtener una vista general de todos los parámetros
     configurables del sistema, como la distancia entre sensores u otras opciones.
     """
-    return db.query(models.Configuracion).all()
+    generacion = estado.generacion()
+    cacheada = cache_respuestas.responder(request, generacion)
+    if cacheada is not None:
+        return cacheada
+
+    configuraciones = db.query(models.Configuracion).all()
+    return cache_respuestas.guardar(request, generacion, [
+        schemas.ConfiguracionResponse.model_validate(config) for config in configuraciones
+    ])
 
 
 @app.get("/configuracion/{clave}", response_model=schemas.ConfiguracionResponse)
-def obtener_configuracion(clave: str, db: Session = Depends(get_db)):
+def obtener_configuracion(clave: str, request: Request, db: Session = Depends(get_db)):
     """
     Obtiene los detalles de una configuración específica por su clave.
 
     Esta función busca en la base de datos una configuración con la clave proporcionada.
     Si la configuración existe, la retorna; si no, lanza una excepción HTTP 404.
 
+    Como el listado, se sirve desde la caché de respuestas hasta que cambie
+    alguna configuración.
+
     Parámetros:
     - clave (str): La clave única de la configuración a obtener. Se extrae de la URL.
+    - request (Request): Petición HTTP, usada como clave de la caché y para If-None-Match.
     - db (Session): Sesión de base de datos inyectada automáticamente por FastAPI.
 
     Retorno:
@@ -481,12 +765,19 @@ def obtener_configuracion(clave: str, db: Session = Depends(get_db)):
     Esta función permite acceder a configuraciones individuales, útil para obtener
     valores específicos como la distancia entre sensores.
     """
+    generacion = estado.generacion()
+    cacheada = cache_respuestas.responder(request, generacion)
+    if cacheada is not None:
+        return cacheada
+
     config = db.query(models.Configuracion).filter(
         models.Configuracion.clave == clave
     ).first()
     if not config:
         raise HTTPException(status_code=404, detail="Configuracion no encontrada")
-    return config
+    return cache_respuestas.guardar(
+        request, generacion, schemas.ConfiguracionResponse.model_validate(config)
+    )
 
 
 @app.put("/configuracion/{clave}", response_model=schemas.ConfiguracionResponse)
@@ -529,11 +820,11 @@ def actualizar_configuracion(
     config.valor = config_update.valor
     db.commit()
     db.refresh(config)
-    # Actualizar cache
-    if clave == "distancia_sensores":
-        _config_cache["distancia_sensores"] = float(config.valor)
-    elif clave == "limite_velocidad":
-        _config_cache["limite_velocidad"] = float(config.valor)
+    # Actualizar el estado compartido para que todos los workers vean el cambio
+    # antes de invalidar: una lectura cacheada de nuevo debe ver ya el valor nuevo
+    if clave in ("distancia_sensores", "limite_velocidad"):
+        estado.guardar_config(clave, float(config.valor))
+    estado.invalidar_lecturas()
     return config
 
 
@@ -0,0 +1,346 @@
+"""
+Métricas de la API en el formato de texto de Prometheus (GET /metrics).
+
+Se registran:
+- radar_http_peticion_segundos: duración de cada petición por método, ruta
+  (la plantilla, p. ej. /mediciones/{medicion_id}) y código de estado. En los
+  streams de Server-Sent Events (/stream/mediciones), que duran lo que la
+  conexión del dashboard, se mide hasta el envío de las cabeceras.
+- radar_db_consulta_segundos: duración y número de sentencias SQL por
+  operación (eventos before/after_cursor_execute de SQLAlchemy).
+- radar_db_espera_conexion_segundos: tiempo de espera para obtener una
+  conexión del pool, por engine (sync o async).
+- radar_eventos_total: eventos de sensor por detector y resultado (pendiente,
+  completada, ignorado o error).
+- radar_pasos_pendientes y radar_paso_pendiente_antiguedad_segundos: pasos por
+  el detector1 que esperan su detector2 y antigüedad del más antiguo, por carril
+  (definidas en ingesta.py a partir del motor de emparejamiento).
+
+Registrar un valor no toma ningún lock: cada hilo acumula en su propio
+fragmento (un dict que solo él modifica) y GET /metrics suma los fragmentos de
+todos los hilos al exportar. Los fragmentos de los hilos que ya terminaron se
+pliegan en un acumulado al exportar. Cada proceso (worker) exporta sus propias
+métricas; Prometheus las distingue por instancia.
+
+Con METRICAS=false no se instala el middleware ni los eventos de SQLAlchemy.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Instrumentar peticiones y base de datos
+METRICAS = os.getenv("METRICAS", "true").lower() == "true"
+# Content-Type del formato de texto de Prometheus
+TIPO_CONTENIDO_METRICAS = "text/plain; version=0.0.4; charset=utf-8"
+
+# Límites (segundos) de los cubos de los histogramas
+LIMITES_PETICION = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LIMITES_CONSULTA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+# Operaciones SQL con etiqueta propia; el resto (PRAGMA, DDL...) se cuenta como OTRA
+OPERACIONES_SQL = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+_registradas: List["_Metrica"] = []
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _etiquetas(nombres: Sequence[str], valores: Sequence[str]) -> str:
+    if not nombres:
+        return ""
+    pares = ",".join(f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores))
+    return "{" + pares + "}"
+
+
+def _numero(valor: float) -> str:
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class _Metrica:
+    """
+    Base de las métricas con fragmentos por hilo.
+
+    _fragmento() devuelve el dict del hilo actual, indexado por la tupla de
+    valores de las etiquetas; solo se toma el lock la primera vez que un hilo
+    registra un valor en la métrica.
+    """
+
+    tipo = ""
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._local = threading.local()
+        self._fragmentos: List[Tuple[threading.Thread, dict]] = []
+        self._retirados: dict = {}
+        self._lock = threading.Lock()
+        _registradas.append(self)
+
+    def _fragmento(self) -> dict:
+        try:
+            return self._local.valores
+        except AttributeError:
+            valores = self._local.valores = {}
+            with self._lock:
+                self._fragmentos.append((threading.current_thread(), valores))
+            return valores
+
+    def _sumar(self, total: dict, valores: dict) -> None:
+        raise NotImplementedError
+
+    def valores(self) -> dict:
+        """Suma de los fragmentos de todos los hilos, indexada por valores de etiquetas."""
+        with self._lock:
+            vivos = []
+            for hilo, valores in self._fragmentos:
+                if hilo.is_alive():
+                    vivos.append((hilo, valores))
+                else:
+                    # El hilo ya no escribe en su fragmento: acumularlo y olvidarlo
+                    self._sumar(self._retirados, valores)
+            self._fragmentos = vivos
+            total: dict = {}
+            self._sumar(total, self._retirados)
+            for _, valores in vivos:
+                self._sumar(total, valores)
+        return total
+
+    def exportar(self) -> List[str]:
+        return [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+
+
+class Contador(_Metrica):
+    """Contador monótono con etiquetas."""
+
+    tipo = "counter"
+
+    def inc(self, *etiquetas: str, cantidad: float = 1) -> None:
+        valores = self._fragmento()
+        valores[etiquetas] = valores.get(etiquetas, 0) + cantidad
+
+    def _sumar(self, total: dict, valores: dict) -> None:
+        for clave, valor in list(valores.items()):
+            total[clave] = total.get(clave, 0) + valor
+
+    def exportar(self) -> List[str]:
+        lineas = super().exportar()
+        for clave, valor in sorted(self.valores().items()):
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}")
+        return lineas
+
+
+class Histograma(_Metrica):
+    """
+    Histograma con cubos fijos.
+
+    Cada serie se guarda como [n por cubo..., n por encima del último límite, suma].
+    """
+
+    tipo = "histogram"
+
+    def __init__(self, nombre: str, ayuda: str, etiquetas: Sequence[str] = (), limites: Sequence[float] = LIMITES_PETICION):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.limites = tuple(limites)
+
+    def observar(self, valor: float, *etiquetas: str) -> None:
+        valores = self._fragmento()
+        cubos = valores.get(etiquetas)
+        if cubos is None:
+            cubos = valores[etiquetas] = [0] * (len(self.limites) + 1) + [0.0]
+        cubos[bisect_left(self.limites, valor)] += 1
+        cubos[-1] += valor
+
+    def _sumar(self, total: dict, valores: dict) -> None:
+        for clave, cubos in list(valores.items()):
+            cubos = list(cubos)
+            acumulado = total.get(clave)
+            if acumulado is None:
+                total[clave] = cubos
+            else:
+                for i, valor in enumerate(cubos):
+                    acumulado[i] += valor
+
+    def exportar(self) -> List[str]:
+        lineas = super().exportar()
+        for clave, cubos in sorted(self.valores().items()):
+            acumulado = 0
+            for limite, n in zip(self.limites + (float("inf"),), cubos):
+                acumulado += n
+                le = "+Inf" if limite == float("inf") else _numero(limite)
+                lineas.append(
+                    f"{self.nombre}_bucket{_etiquetas(self.etiquetas + ('le',), clave + (le,))} {acumulado}"
+                )
+            serie = _etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{serie} {_numero(cubos[-1])}")
+            lineas.append(f"{self.nombre}_count{serie} {acumulado}")
+        return lineas
+
+
+class Indicador(_Metrica):
+    """Gauge calculado al exportar: `funcion` devuelve pares (valores de etiquetas, valor)."""
+
+    tipo = "gauge"
+
+    def __init__(
+        self,
+        nombre: str,
+        ayuda: str,
+        etiquetas: Sequence[str],
+        funcion: Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]
+    ):
+        super().__init__(nombre, ayuda, etiquetas)
+        self.funcion = funcion
+
+    def exportar(self) -> List[str]:
+        lineas = super().exportar()
+        for clave, valor in self.funcion():
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_numero(valor)}")
+        return lineas
+
+
+def exportar() -> str:
+    """Todas las métricas registradas en el formato de texto de Prometheus."""
+    lineas: List[str] = []
+    for metrica in _registradas:
+        lineas.extend(metrica.exportar())
+    return "\n".join(lineas) + "\n"
+
+
+peticiones_http = Histograma(
+    "radar_http_peticion_segundos", "Duración de las peticiones HTTP",
+    ("metodo", "ruta", "codigo"), LIMITES_PETICION
+)
+consultas_db = Histograma(
+    "radar_db_consulta_segundos", "Duración de las sentencias SQL",
+    ("operacion",), LIMITES_CONSULTA
+)
+espera_conexion = Histograma(
+    "radar_db_espera_conexion_segundos", "Espera para obtener una conexión del pool",
+    ("engine",), LIMITES_CONSULTA
+)
+eventos_sensor = Contador(
+    "radar_eventos_total", "Eventos de sensor recibidos por detector y resultado",
+    ("detector", "resultado")
+)
+
+
+def contar_eventos(eventos: Sequence[Optional[object]], resultados: Sequence[dict]) -> None:
+    """
+    Cuenta en radar_eventos_total los eventos de un lote y su resultado.
+
+    Parámetros:
+    - eventos: Eventos normalizados (emparejamiento.Evento) o None para los no válidos.
+    - resultados: Resultado de cada evento, en el mismo orden, con su "estado".
+    """
+    for evento, resultado in zip(eventos, resultados):
+        eventos_sensor.inc(evento.tipo if evento is not None else "ninguno", resultado["estado"])
+
+
+class MiddlewareMetricas:
+    """
+    Middleware ASGI que mide la duración de cada petición HTTP.
+
+    Se mide hasta que la aplicación termina de enviar la respuesta (incluido el
+    cuerpo de las respuestas en streaming), salvo en las respuestas
+    text/event-stream: duran lo que la conexión del cliente y desvirtuarían el
+    histograma, así que se mide el tiempo hasta la primera respuesta (las
+    cabeceras). La ruta es la plantilla que atendió la petición, o "sin_ruta"
+    si ninguna coincidió, para que las URL con identificadores no creen una
+    serie por valor.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def _ruta(scope) -> str:
+        ruta = scope.get("route")
+        if ruta is not None:
+            return getattr(ruta, "path", "sin_ruta")
+        if scope.get("endpoint") is not None:
+            return scope["endpoint"].__name__
+        return "sin_ruta"
+
+    @staticmethod
+    def _es_stream(mensaje) -> bool:
+        for nombre, valor in mensaje.get("headers", ()):
+            if nombre.lower() == b"content-type":
+                return valor.startswith(b"text/event-stream")
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        codigo = [500]
+        medida = [False]
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                codigo[0] = mensaje["status"]
+                if self._es_stream(mensaje):
+                    medida[0] = True
+                    peticiones_http.observar(
+                        time.perf_counter() - inicio, scope["method"], self._ruta(scope), str(codigo[0])
+                    )
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            if not medida[0]:
+                peticiones_http.observar(
+                    time.perf_counter() - inicio, scope["method"], self._ruta(scope), str(codigo[0])
+                )
+
+
+def _operacion(sentencia: str) -> str:
+    palabra = sentencia.lstrip()[:6].upper()
+    return palabra if palabra in OPERACIONES_SQL else "OTRA"
+
+
+def instrumentar_engine(engine) -> None:
+    """
+    Registra la duración de cada sentencia SQL del engine (síncrono, o el
+    sync_engine de un engine async) en radar_db_consulta_segundos.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def antes_de_ejecutar(conn, cursor, sentencia, parametros, contexto, executemany):
+        if contexto is not None:
+            contexto.inicio_metricas = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def despues_de_ejecutar(conn, cursor, sentencia, parametros, contexto, executemany):
+        inicio = getattr(contexto, "inicio_metricas", None)
+        if inicio is not None:
+            consultas_db.observar(time.perf_counter() - inicio, _operacion(sentencia))
+
+
+class _EsperaMedida:
+    """Mixin de pool que mide en radar_db_espera_conexion_segundos lo que tarda cada checkout."""
+
+    nombre_engine = ""
+
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            espera_conexion.observar(time.perf_counter() - inicio, self.nombre_engine)
+
+
+class QueuePoolMedido(_EsperaMedida, QueuePool):
+    nombre_engine = "sync"
+
+
+class AsyncQueuePoolMedido(_EsperaMedida, AsyncAdaptedQueuePool):
+    nombre_engine = "async"
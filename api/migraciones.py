@@ -0,0 +1,80 @@
+"""
+Migraciones ligeras del esquema.
+
+Base.metadata.create_all solo crea las tablas que no existen, de modo que las
+columnas e índices añadidos a tablas ya desplegadas se aplican aquí. Cada paso
+comprueba el esquema actual antes de modificarlo, por lo que es seguro
+ejecutarlo en cada arranque.
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+import models
+
+
+def _columnas(engine: Engine, tabla: str) -> set:
+    return {columna["name"] for columna in inspect(engine).get_columns(tabla)}
+
+
+def _indices(engine: Engine, tabla: str) -> set:
+    return {indice["name"] for indice in inspect(engine).get_indexes(tabla)}
+
+
+# Índices de versiones anteriores que ninguna consulta usa y solo encarecen
+# cada INSERT:
+# - id: duplica la clave primaria.
+# - velocidad_kmh: no se filtra ni se ordena por velocidad.
+# - es_primera_medicion y medicion_completa: booleanos de baja cardinalidad;
+#   las consultas los combinan con timestamp o carril y usan los índices
+#   compuesto y parcial.
+# - (carril, medicion_completa, timestamp): sustituido por el índice parcial
+#   ix_mediciones_pendientes, que solo contiene las filas pendientes.
+INDICES_OBSOLETOS = (
+    "ix_mediciones_id",
+    "ix_mediciones_velocidad_kmh",
+    "ix_mediciones_es_primera_medicion",
+    "ix_mediciones_medicion_completa",
+    "ix_mediciones_carril_pendientes",
+)
+
+
+def aplicar_migraciones(engine: Engine) -> None:
+    """
+    Aplica sobre la base de datos los cambios de esquema pendientes.
+
+    - Añade la columna `carril` a `mediciones` (las filas existentes quedan
+      en el carril 'principal').
+    - Crea los índices declarados en Medicion que falten: el compuesto
+      (medicion_completa, timestamp, id) y el parcial de los pasos pendientes.
+    - Elimina los índices de INDICES_OBSOLETOS.
+    - Si cambió algún índice, actualiza las estadísticas del planificador
+      (ANALYZE) para que use los nuevos desde la primera consulta.
+
+    Parámetros:
+    - engine (Engine): Engine de SQLAlchemy sobre el que aplicar los cambios.
+    """
+    tabla = models.Medicion.__table__
+
+    if "carril" not in _columnas(engine, tabla.name):
+        with engine.begin() as conn:
+            conn.execute(text(
+                "ALTER TABLE mediciones "
+                "ADD COLUMN carril VARCHAR(50) NOT NULL DEFAULT 'principal'"
+            ))
+
+    existentes = _indices(engine, tabla.name)
+    cambios = False
+    for indice in tabla.indexes:
+        if indice.name not in existentes:
+            indice.create(bind=engine, checkfirst=True)
+            cambios = True
+
+    for nombre in INDICES_OBSOLETOS:
+        if nombre in existentes:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP INDEX IF EXISTS {nombre}"))
+            cambios = True
+
+    if cambios:
+        with engine.begin() as conn:
+            conn.execute(text(f"ANALYZE {tabla.name}"))
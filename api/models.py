@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, DateTime, Boolean, String
+from sqlalchemy import Column, Integer, Float, DateTime, Date, Boolean, String, Index, Text
 from datetime import datetime
 from database import Base
 
@@ -6,14 +6,30 @@ from database import Base
 class Medicion(Base):
     __tablename__ = "mediciones"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # Cada índice se actualiza en cada INSERT; solo se declaran los que usan
+    # las consultas (ver INDICES_OBSOLETOS en migraciones.py)
+    id = Column(Integer, primary_key=True)
     timestamp = Column(DateTime, default=datetime.utcnow, index=True)
     velocidad_ms = Column(Float, nullable=True)
-    velocidad_kmh = Column(Float, nullable=True, index=True)
+    velocidad_kmh = Column(Float, nullable=True)
     distancia = Column(Float, default=100.0)
     tiempo_recorrido = Column(Float, nullable=True)
-    es_primera_medicion = Column(Boolean, default=False, index=True)
-    medicion_completa = Column(Boolean, default=False, index=True)
+    es_primera_medicion = Column(Boolean, default=False)
+    medicion_completa = Column(Boolean, default=False)
+    carril = Column(String(50), default="principal", server_default="principal", nullable=False)
+
+    __table_args__ = (
+        # Listado, paginación por cursor y exportación de mediciones completas,
+        # más recientes primero (el índice se recorre hacia atrás)
+        Index("ix_mediciones_completa_timestamp_id", "medicion_completa", "timestamp", "id"),
+        # Índice parcial con solo los pasos pendientes: reconstrucción de la cola
+        # de un carril y GET /estado/ con varios workers
+        Index(
+            "ix_mediciones_pendientes", "carril", "timestamp",
+            postgresql_where=(es_primera_medicion == True) & (medicion_completa == False),
+            sqlite_where=(es_primera_medicion == True) & (medicion_completa == False),
+        ),
+    )
 
 
 class Configuracion(Base):
@@ -23,3 +39,59 @@ class Configuracion(Base):
     clave = Column(String(50), unique=True, index=True)
     valor = Column(String(100))
     descripcion = Column(String(200), nullable=True)
+
+
+class Estado(Base):
+    """Estado compartido entre procesos (backend "notificado"), en JSON por clave."""
+    __tablename__ = "estado"
+
+    clave = Column(String(50), primary_key=True)
+    valor = Column(Text)
+
+
+class EstadisticasResumen(Base):
+    """
+    Agregados de todas las mediciones completas, mantenidos de forma incremental.
+
+    Tiene una única fila (id = 1) que se actualiza en la misma transacción que
+    completa cada medición y que el trabajo de reconciliación recalcula desde
+    la tabla mediciones.
+    """
+    __tablename__ = "estadisticas_resumen"
+
+    id = Column(Integer, primary_key=True)
+    total = Column(Integer, default=0, nullable=False)
+    suma_kmh = Column(Float, default=0.0, nullable=False)
+    maxima_kmh = Column(Float, nullable=True)
+    minima_kmh = Column(Float, nullable=True)
+    excesos = Column(Integer, default=0, nullable=False)
+    reconciliado = Column(DateTime, nullable=True)
+
+
+class EstadisticasDiarias(Base):
+    """Agregados de las mediciones completas de cada día (según su timestamp)."""
+    __tablename__ = "estadisticas_diarias"
+
+    fecha = Column(Date, primary_key=True)
+    total = Column(Integer, default=0, nullable=False)
+    suma_kmh = Column(Float, default=0.0, nullable=False)
+    maxima_kmh = Column(Float, nullable=True)
+    minima_kmh = Column(Float, nullable=True)
+    excesos = Column(Integer, default=0, nullable=False)
+
+
+class SerieVelocidad(Base):
+    """
+    Agregados de las mediciones completas por intervalo de tiempo.
+
+    Hay una fila por granularidad ("minuto", "hora" o "dia") e inicio del
+    intervalo; sketch guarda un SketchVelocidad en JSON para estimar cuantiles.
+    """
+    __tablename__ = "series_velocidad"
+
+    granularidad = Column(String(10), primary_key=True)
+    inicio = Column(DateTime, primary_key=True)
+    total = Column(Integer, default=0, nullable=False)
+    suma_kmh = Column(Float, default=0.0, nullable=False)
+    excesos = Column(Integer, default=0, nullable=False)
+    sketch = Column(Text, nullable=True)
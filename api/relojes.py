@@ -0,0 +1,208 @@
+"""
+Estimación del desfase de reloj de cada placa detectora.
+
+Las placas que envían eventos por separado (placa/detector1.py y detector2.py)
+ponen la hora con su propio NTP, y unos milisegundos de diferencia entre ellas
+se convierten en km/h de error. Cada placa envía periódicamente un latido con
+su ticks_ms y la hora que cree que es (epoch en ms) a POST /relojes/latido, y la
+API modela el desfase de cada placa respecto a su propio reloj:
+
+    desfase(t) = hora de recepción - hora de la placa = a + b·t
+
+con una regresión lineal sobre los últimos VENTANA_RELOJ latidos (b es la
+deriva del oscilador de la placa). Los eventos que indican "placa" se corrigen
+con ese modelo al normalizarlos (ingesta.normalizar_evento), antes de
+emparejarlos, de modo que el tiempo recorrido se calcula con las dos horas en
+la misma escala.
+
+La regresión es incremental: cada latido suma y resta su punto de unas sumas
+acumuladas (O(1)), y corregir un evento solo evalúa a + b·t. Las sumas se
+recalculan desde la ventana cada VENTANA_RELOJ latidos para no acumular error
+de redondeo. El desfase incluye la latencia de red de los latidos; al ser
+parecida para las dos placas, se cancela casi por completo en el tiempo
+recorrido.
+
+Si la placa reinicia o vuelve a poner la hora (cambia la diferencia entre su
+epoch y su ticks_ms), el modelo empieza de nuevo. Los modelos se guardan en el
+estado compartido (estado_compartido.py): cada latido llega a un solo worker,
+pero todos corrigen los eventos con el mismo modelo.
+"""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, List, Optional, Tuple
+
+# Latidos por placa que entran en la regresión
+VENTANA_RELOJ = int(os.getenv("RELOJ_VENTANA", "60"))
+# Cambio de (epoch - ticks) a partir del cual se considera que la placa reinició o volvió a poner la hora
+SALTO_BASE_RELOJ_MS = 1000
+# Con menos latidos (o todos casi en el mismo instante) solo se estima el desfase, sin deriva
+MIN_LATIDOS_DERIVA = 3
+MIN_VARIANZA_DERIVA = 1.0
+
+
+class ModeloReloj:
+    """
+    Regresión lineal incremental del desfase (ms) frente a la hora de la placa (s).
+
+    La hora se mide en segundos desde el primer latido del modelo para que las
+    sumas de cuadrados no pierdan precisión.
+    """
+
+    def __init__(self, ventana: int = VENTANA_RELOJ):
+        self.ventana = ventana
+        self.puntos: Deque[Tuple[float, float]] = deque()
+        self.base: Optional[int] = None
+        self.referencia = 0
+        self.latidos = 0
+        self._sumas = [0.0, 0.0, 0.0, 0.0]
+        self._retirados = 0
+        self.desfase_ms = 0.0
+        self.deriva = 0.0
+
+    def _reiniciar(self, base: int, epoch_ms: int) -> None:
+        self.puntos.clear()
+        self.base = base
+        self.referencia = epoch_ms
+        self._sumas = [0.0, 0.0, 0.0, 0.0]
+        self._retirados = 0
+
+    def _sumar(self, x: float, y: float, signo: int) -> None:
+        sumas = self._sumas
+        sumas[0] += signo * x
+        sumas[1] += signo * y
+        sumas[2] += signo * x * x
+        sumas[3] += signo * x * y
+
+    def anotar(self, ticks: int, epoch_ms: int, recibido_ms: float) -> None:
+        """Añade un latido: ticks_ms y hora de la placa, y hora de recepción en la API."""
+        base = epoch_ms - ticks
+        if self.base is None or abs(base - self.base) > SALTO_BASE_RELOJ_MS:
+            self._reiniciar(base, epoch_ms)
+
+        punto = ((epoch_ms - self.referencia) / 1000, recibido_ms - epoch_ms)
+        self.puntos.append(punto)
+        self._sumar(*punto, 1)
+        if len(self.puntos) > self.ventana:
+            self._sumar(*self.puntos.popleft(), -1)
+            self._retirados += 1
+            if self._retirados >= self.ventana:
+                self._sumas = [0.0, 0.0, 0.0, 0.0]
+                for x, y in self.puntos:
+                    self._sumar(x, y, 1)
+                self._retirados = 0
+        self.latidos += 1
+        self._ajustar()
+
+    def _ajustar(self) -> None:
+        n = len(self.puntos)
+        sx, sy, sxx, sxy = self._sumas
+        varianza = n * sxx - sx * sx
+        if n >= MIN_LATIDOS_DERIVA and varianza > MIN_VARIANZA_DERIVA * n * n:
+            self.deriva = (n * sxy - sx * sy) / varianza
+        else:
+            self.deriva = 0.0
+        self.desfase_ms = (sy - self.deriva * sx) / n
+
+    def exportar(self) -> dict:
+        """Estado del modelo serializable a JSON, para guardarlo en el estado compartido."""
+        return {
+            "base": self.base,
+            "referencia": self.referencia,
+            "latidos": self.latidos,
+            "puntos": [list(punto) for punto in self.puntos],
+        }
+
+    @classmethod
+    def importar(cls, datos: dict, ventana: int = VENTANA_RELOJ) -> "ModeloReloj":
+        """Reconstruye un modelo a partir de exportar(), recalculando sus sumas."""
+        modelo = cls(ventana)
+        modelo.base = datos["base"]
+        modelo.referencia = datos["referencia"]
+        modelo.latidos = datos["latidos"]
+        for x, y in datos["puntos"][-ventana:]:
+            modelo.puntos.append((x, y))
+            modelo._sumar(x, y, 1)
+        if modelo.puntos:
+            modelo._ajustar()
+        return modelo
+
+    def desfase(self, epoch_ms: float) -> float:
+        """Desfase estimado (ms) a sumar a una hora de la placa para llevarla a la hora de la API."""
+        if not self.puntos:
+            return 0.0
+        return self.desfase_ms + self.deriva * (epoch_ms - self.referencia) / 1000
+
+
+class Relojes:
+    """Modelos de reloj de todas las placas."""
+
+    def __init__(self, ventana: int = VENTANA_RELOJ):
+        self.ventana = ventana
+        self._modelos: Dict[str, ModeloReloj] = {}
+        self._lock = threading.Lock()
+
+    def latido(self, placa: str, ticks: int, epoch_ms: int, recibido_ms: Optional[float] = None) -> ModeloReloj:
+        """
+        Registra un latido de la placa y actualiza su modelo.
+
+        Parámetros:
+        - placa (str): Identificador de la placa.
+        - ticks (int): ticks_ms de la placa al enviar el latido.
+        - epoch_ms (int): Hora Unix de la placa en milisegundos al enviar el latido.
+        - recibido_ms (float, opcional): Hora Unix de recepción en ms (por defecto, ahora).
+
+        Retorno:
+        - ModeloReloj: Modelo actualizado de la placa.
+        """
+        if recibido_ms is None:
+            recibido_ms = time.time() * 1000
+        with self._lock:
+            modelo = self._modelos.get(placa)
+            if modelo is None:
+                modelo = self._modelos[placa] = ModeloReloj(self.ventana)
+            modelo.anotar(ticks, epoch_ms, recibido_ms)
+        return modelo
+
+    def exportar(self) -> Dict[str, dict]:
+        """Estado de todos los modelos por placa (ver ModeloReloj.exportar)."""
+        with self._lock:
+            return {placa: modelo.exportar() for placa, modelo in self._modelos.items()}
+
+    @classmethod
+    def importar(cls, datos: Dict[str, dict], ventana: int = VENTANA_RELOJ) -> "Relojes":
+        """Reconstruye los modelos de todas las placas a partir de exportar()."""
+        relojes = cls(ventana)
+        for placa, modelo in datos.items():
+            relojes._modelos[placa] = ModeloReloj.importar(modelo, ventana)
+        return relojes
+
+    def corregir(self, placa: str, timestamp: datetime) -> datetime:
+        """Lleva a la hora de la API un timestamp de la placa; sin latidos lo devuelve igual."""
+        modelo = self._modelos.get(placa)
+        if modelo is None or not modelo.puntos:
+            return timestamp
+        return timestamp + timedelta(milliseconds=modelo.desfase(timestamp.timestamp() * 1000))
+
+    @staticmethod
+    def _describir(placa: str, modelo: ModeloReloj) -> dict:
+        return {
+            "placa": placa,
+            "latidos": modelo.latidos,
+            "ventana": len(modelo.puntos),
+            "desfase_ms": round(modelo.desfase(time.time() * 1000), 3),
+            "deriva_ppm": round(modelo.deriva * 1000, 3),
+        }
+
+    def describir(self, placa: str) -> Optional[dict]:
+        """Estado del modelo de una placa (desfase actual en ms y deriva en ppm), o None."""
+        with self._lock:
+            modelo = self._modelos.get(placa)
+            return None if modelo is None else self._describir(placa, modelo)
+
+    def resumen(self) -> List[dict]:
+        """Estado del modelo de cada placa, ordenado por placa."""
+        with self._lock:
+            return [self._describir(placa, modelo) for placa, modelo in sorted(self._modelos.items())]
@@ -0,0 +1,161 @@
+"""
+Respuestas HTTP condicionales (ETag / If-None-Match) y caché de respuestas.
+
+Los dashboards consultan los mismos datos cada pocos segundos; si no han
+cambiado, el cliente recibe un 304 sin cuerpo y reutiliza su copia.
+
+CacheRespuestas guarda además el cuerpo ya serializado de los endpoints de
+lectura más consultados (/estadisticas/, /configuracion/, la primera página de
+/mediciones/ y /dashboard/snapshot), de modo que mientras nada cambie no se
+consulta la base de datos ni se vuelve a serializar. Cada entrada lleva la
+generación del estado compartido con la que se calculó (estado.generacion());
+los endpoints que escriben mediciones o configuración llaman a
+estado.invalidar_lecturas() tras confirmar, y las entradas anteriores dejan de
+servirse en todos los workers. El TTL acota lo que puede quedar desfasado por
+cambios que no pasan por la API (mediciones_hoy al cambiar de día, la
+reconciliación de estadísticas o escrituras directas en la base de datos).
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Sequence, Union
+
+from fastapi import Request, Response
+from pydantic import BaseModel
+
+# Segundos que una respuesta puede servirse desde la caché sin cambios en la API
+TTL_CACHE_RESPUESTAS = float(os.getenv("CACHE_RESPUESTAS_TTL", "30"))
+# Número máximo de respuestas guardadas por proceso
+MAX_CACHE_RESPUESTAS = int(os.getenv("CACHE_RESPUESTAS_MAX", "256"))
+
+
+def calcular_etag(cuerpo: bytes) -> str:
+    return '"' + hashlib.blake2b(cuerpo, digest_size=16).hexdigest() + '"'
+
+
+def serializar(contenido: Union[BaseModel, Sequence[BaseModel]]) -> bytes:
+    """JSON de un modelo o de una lista de modelos, igual que lo devolvería FastAPI."""
+    if isinstance(contenido, BaseModel):
+        return contenido.model_dump_json().encode()
+    return b"[" + b",".join(modelo.model_dump_json().encode() for modelo in contenido) + b"]"
+
+
+def _coincide(request: Request, etag: str) -> bool:
+    enviadas = request.headers.get("if-none-match", "")
+    return etag in [valor.strip() for valor in enviadas.split(",")] or enviadas.strip() == "*"
+
+
+def _responder(
+    request: Request,
+    cuerpo: bytes,
+    etag: str,
+    cabeceras: Optional[Dict[str, str]] = None
+) -> Response:
+    cabeceras = {**(cabeceras or {}), "ETag": etag, "Cache-Control": "no-cache"}
+    if _coincide(request, etag):
+        return Response(status_code=304, headers=cabeceras)
+    return Response(content=cuerpo, media_type="application/json", headers=cabeceras)
+
+
+class Entrada(NamedTuple):
+    generacion: int
+    caduca: float
+    cuerpo: bytes
+    etag: str
+    cabeceras: Dict[str, str]
+
+
+class CacheRespuestas:
+    """
+    Caché LRU con TTL de respuestas JSON, indexada por ruta y parámetros.
+
+    Uso en un endpoint:
+
+        generacion = estado.generacion()
+        cacheada = cache_respuestas.responder(request, generacion)
+        if cacheada is not None:
+            return cacheada
+        ...consultar la base de datos...
+        return cache_respuestas.guardar(request, generacion, contenido)
+
+    La generación se lee antes de consultar: si una escritura se confirma
+    mientras tanto, la entrada se guarda con la generación antigua y no llega
+    a servirse.
+    """
+
+    def __init__(self, max_entradas: int = MAX_CACHE_RESPUESTAS, ttl: float = TTL_CACHE_RESPUESTAS):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._entradas: "OrderedDict[str, Entrada]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+    @staticmethod
+    def clave(request: Request) -> str:
+        return request.url.path + "?" + "&".join(sorted(
+            f"{nombre}={valor}" for nombre, valor in request.query_params.multi_items()
+        ))
+
+    def responder(self, request: Request, generacion: int) -> Optional[Response]:
+        """
+        Respuesta guardada para la petición, o None si no hay una vigente.
+
+        Retorno:
+        - Response: 304 si el cliente ya tiene esa versión (If-None-Match), 200 si no.
+        - None: Si no hay entrada, caducó o es de una generación anterior.
+        """
+        clave = self.clave(request)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None or entrada.generacion != generacion or entrada.caduca < time.monotonic():
+                if entrada is not None:
+                    del self._entradas[clave]
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+        return _responder(request, entrada.cuerpo, entrada.etag, entrada.cabeceras)
+
+    def guardar(
+        self,
+        request: Request,
+        generacion: int,
+        contenido: Union[BaseModel, Sequence[BaseModel]],
+        cabeceras: Optional[Dict[str, str]] = None
+    ) -> Response:
+        """
+        Serializa el contenido, lo guarda para la petición y construye la respuesta.
+
+        Parámetros:
+        - request (Request): Petición HTTP; su ruta y parámetros forman la clave.
+        - generacion (int): Valor de estado.generacion() leído antes de consultar.
+        - contenido: Modelo o lista de modelos de la respuesta.
+        - cabeceras (Dict[str, str], opcional): Cabeceras adicionales, que también se guardan.
+
+        Retorno:
+        - Response: 200 con el JSON y la cabecera ETag, o 304 sin cuerpo.
+        """
+        cuerpo = serializar(contenido)
+        entrada = Entrada(
+            generacion, time.monotonic() + self.ttl, cuerpo, calcular_etag(cuerpo), cabeceras or {}
+        )
+        clave = self.clave(request)
+        with self._lock:
+            self._entradas[clave] = entrada
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return _responder(request, entrada.cuerpo, entrada.etag, entrada.cabeceras)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._entradas.clear()
+
+
+cache_respuestas = CacheRespuestas()
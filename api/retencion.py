@@ -0,0 +1,528 @@
+"""
+Particionado por mes de la tabla mediciones y retención de las mediciones antiguas.
+
+Con RETENCION_DIAS > 0, una tarea de fondo (mantener_periodicamente) resume y
+elimina las mediciones anteriores a ese número de días:
+
+1. Las series por hora y por día del periodo se recalculan desde las filas
+   originales y las series por minuto se descartan.
+2. Los agregados diarios del periodo se recalculan y la fila
+   "retencion_frontera" de la tabla estado pasa a indicar desde qué día se
+   conservan las mediciones. reconciliar() suma a partir de entonces los
+   agregados diarios anteriores a la frontera a las filas conservadas, por lo
+   que el resumen de GET /estadisticas/ no cambia.
+3. Se eliminan de mediciones las filas anteriores a la frontera. El paso es
+   idempotente y se repite en cada ejecución hasta completarse.
+
+Cómo se eliminan depende de la base de datos:
+
+- PostgreSQL con PARTICIONES_MENSUALES=true: mediciones es una tabla
+  particionada por rango de timestamp con una partición por mes, creadas con
+  PARTICIONES_ADELANTADAS meses de antelación. La retención elimina
+  particiones completas (DROP TABLE), sin recorrer filas ni dejar espacio
+  muerto, por lo que las filas de un mes se eliminan cuando caduca el mes
+  entero. Las consultas con rango de fechas solo leen las particiones del rango.
+- SQLite: las filas se copian a un fichero por mes en el directorio de
+  archivo (mediciones_AAAA_MM.db, con el esquema de mediciones) antes de
+  borrarlas de la base principal. Pueden consultarse con ATTACH DATABASE.
+- PostgreSQL sin particionar: DELETE por bloques.
+"""
+import asyncio
+import os
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Callable, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update, delete, func, text, bindparam, DateTime
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateTable
+
+from database import engine, SessionLocal
+import models
+from estadisticas import CLAVE_FRONTERA, ID_RESUMEN, leer_frontera, recalcular_diarias
+from migraciones import INDICES_OBSOLETOS
+from series import AcumuladorSeries, volcar_series
+
+# Días de mediciones conservados además del actual; 0 desactiva la retención
+RETENCION_DIAS = int(os.getenv("RETENCION_DIAS", "0"))
+# Particionar mediciones por mes (solo PostgreSQL)
+PARTICIONES_MENSUALES = os.getenv("PARTICIONES_MENSUALES", "false").lower() == "true"
+# Meses futuros con partición ya creada
+PARTICIONES_ADELANTADAS = int(os.getenv("PARTICIONES_ADELANTADAS", "3"))
+# Segundos entre ejecuciones del mantenimiento; con varios workers solo lo
+# ejecuta el primero que encuentra la última ejecución caducada
+INTERVALO_MANTENIMIENTO = int(os.getenv("MANTENIMIENTO_INTERVALO", "3600"))
+# Directorio de los ficheros de archivo mensuales (solo SQLite); por defecto,
+# "archivo" junto a la base de datos
+DIRECTORIO_ARCHIVO = os.getenv("ARCHIVO_MEDICIONES_DIR")
+# Filas por sentencia al borrar sin particiones
+TAMANO_BLOQUE_RETENCION = 10000
+# Intervalos acumulados antes de volcar al recalcular las series
+MAX_INTERVALOS_RESUMEN = 20000
+
+CLAVE_MANTENIMIENTO = "mantenimiento"
+FORMATO_MANTENIMIENTO = "%Y-%m-%dT%H:%M:%S"
+# Partición con las filas de la tabla sin particionar que se convirtió
+PARTICION_HISTORICO = "mediciones_historico"
+# Partición para las filas fuera de las particiones mensuales existentes
+PARTICION_DEFECTO = "mediciones_fuera_rango"
+# Clave de pg_advisory_xact_lock que serializa los cambios de particiones entre workers
+BLOQUEO_PARTICIONES = 0x52414441
+
+COLUMNAS_PARTICIONADA = """
+    id INTEGER NOT NULL DEFAULT nextval('mediciones_id_seq'),
+    "timestamp" TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+    velocidad_ms DOUBLE PRECISION,
+    velocidad_kmh DOUBLE PRECISION,
+    distancia DOUBLE PRECISION,
+    tiempo_recorrido DOUBLE PRECISION,
+    es_primera_medicion BOOLEAN,
+    medicion_completa BOOLEAN,
+    carril VARCHAR(50) NOT NULL DEFAULT 'principal',
+    PRIMARY KEY (id, "timestamp")
+"""
+
+Medicion = models.Medicion
+
+
+def inicio_mes(fecha: date) -> date:
+    return fecha.replace(day=1)
+
+
+def sumar_meses(mes: date, meses: int) -> date:
+    indice = mes.year * 12 + mes.month - 1 + meses
+    return date(indice // 12, indice % 12 + 1, 1)
+
+
+def nombre_particion(mes: date) -> str:
+    return f"mediciones_{mes:%Y_%m}"
+
+
+def fecha_corte(ahora: Optional[datetime] = None) -> datetime:
+    """Medianoche del día más antiguo que conserva la retención."""
+    hoy = (ahora or datetime.now()).date()
+    return datetime.combine(hoy - timedelta(days=RETENCION_DIAS), time.min)
+
+
+# --- Particiones (PostgreSQL) ---
+
+def _es_postgres(bind) -> bool:
+    return bind.dialect.name == "postgresql"
+
+
+def _tipo_tabla(conn: Connection) -> Optional[str]:
+    """relkind de mediciones: 'p' si está particionada, 'r' si no, None si no existe."""
+    return conn.execute(text(
+        "SELECT c.relkind FROM pg_class c "
+        "JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = 'mediciones' AND n.nspname = current_schema()"
+    )).scalar()
+
+
+def _limite(valor: str) -> Optional[datetime]:
+    valor = valor.strip()
+    if valor.upper() == "MINVALUE":
+        return None
+    return datetime.fromisoformat(valor.strip("'"))
+
+
+def _particiones(conn: Connection) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """
+    Particiones de mediciones con su rango [desde, hasta).
+
+    desde es None en la partición que empieza en MINVALUE; la partición por
+    defecto no se incluye.
+    """
+    filas = conn.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'mediciones'::regclass"
+    )).all()
+    particiones = []
+    for nombre, rango in filas:
+        limites = re.search(r"FROM \((.+?)\) TO \((.+?)\)", rango)
+        if limites:
+            particiones.append((nombre, _limite(limites.group(1)), _limite(limites.group(2))))
+    return sorted(particiones, key=lambda p: p[2])
+
+
+def _crear_particionada(conn: Connection) -> None:
+    conn.execute(text("CREATE SEQUENCE IF NOT EXISTS mediciones_id_seq"))
+    conn.execute(text(f'CREATE TABLE mediciones ({COLUMNAS_PARTICIONADA}) PARTITION BY RANGE ("timestamp")'))
+    conn.execute(text("ALTER SEQUENCE mediciones_id_seq OWNED BY mediciones.id"))
+
+
+def _convertir(conn: Connection) -> None:
+    """
+    Convierte la tabla mediciones existente en particionada sin copiar filas.
+
+    La tabla se renombra a PARTICION_HISTORICO y se adjunta como la partición
+    que va desde MINVALUE hasta el mes siguiente al de su última medición; sus
+    índices se renombran para no chocar con los de la nueva tabla, que al
+    crearse en aplicar_migraciones() adoptan los equivalentes de la partición.
+    La secuencia de id pasa a pertenecer a la nueva tabla, de modo que
+    eliminar la partición no la elimina.
+    """
+    ultima = conn.execute(text('SELECT max("timestamp") FROM mediciones')).scalar()
+    limite = sumar_meses(inicio_mes(max(ultima.date() if ultima else date.min, date.today())), 1)
+
+    for nombre in INDICES_OBSOLETOS:
+        conn.execute(text(f"DROP INDEX IF EXISTS {nombre}"))
+    # Sin hora no se sabe a qué partición pertenece; quedan como las más antiguas
+    conn.execute(text('UPDATE mediciones SET "timestamp" = \'1970-01-01\' WHERE "timestamp" IS NULL'))
+    conn.execute(text('ALTER TABLE mediciones ALTER COLUMN "timestamp" SET NOT NULL'))
+    conn.execute(text(f"ALTER TABLE mediciones RENAME TO {PARTICION_HISTORICO}"))
+    indices = conn.execute(text(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE tablename = :tabla AND schemaname = current_schema()"
+    ), {"tabla": PARTICION_HISTORICO}).scalars().all()
+    for indice in indices:
+        conn.execute(text(
+            f"ALTER INDEX {indice} RENAME TO {indice.replace('mediciones', PARTICION_HISTORICO, 1)}"
+        ))
+
+    _crear_particionada(conn)
+    conn.execute(text(
+        f"ALTER TABLE mediciones ATTACH PARTITION {PARTICION_HISTORICO} "
+        f"FOR VALUES FROM (MINVALUE) TO ('{limite.isoformat()}')"
+    ))
+
+
+def _crear_particion(conn: Connection, mes: date) -> None:
+    """
+    Crea la partición de un mes, moviendo a ella las filas del mes que estén en la partición por defecto.
+
+    Adjuntar la partición exige que la partición por defecto no tenga filas de
+    su rango, y crearla ya con ellas evita recorrerla dos veces.
+    """
+    nombre = nombre_particion(mes)
+    desde, hasta = mes.isoformat(), sumar_meses(mes, 1).isoformat()
+    conn.execute(text(f"CREATE TABLE {nombre} (LIKE mediciones INCLUDING DEFAULTS)"))
+    conn.execute(text(
+        f"WITH movidas AS ("
+        f'DELETE FROM {PARTICION_DEFECTO} WHERE "timestamp" >= :desde AND "timestamp" < :hasta '
+        f"RETURNING *) "
+        f"INSERT INTO {nombre} SELECT * FROM movidas"
+    ), {"desde": mes, "hasta": sumar_meses(mes, 1)})
+    conn.execute(text(
+        f"ALTER TABLE mediciones ATTACH PARTITION {nombre} FOR VALUES FROM ('{desde}') TO ('{hasta}')"
+    ))
+
+
+def asegurar_particiones(bind: Engine) -> int:
+    """
+    Crea las particiones del mes actual y de los PARTICIONES_ADELANTADAS siguientes que falten.
+
+    Parámetros:
+    - bind (Engine): Engine de SQLAlchemy.
+
+    Retorno:
+    - int: Número de particiones creadas.
+    """
+    if not (_es_postgres(bind) and PARTICIONES_MENSUALES):
+        return 0
+    creadas = 0
+    with bind.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": BLOQUEO_PARTICIONES})
+        if _tipo_tabla(conn) != "p":
+            return 0
+        particiones = _particiones(conn)
+        for n in range(PARTICIONES_ADELANTADAS + 1):
+            mes = sumar_meses(inicio_mes(date.today()), n)
+            # El mes ya tiene partición propia o está dentro de PARTICION_HISTORICO
+            if any((desde is None or desde.date() <= mes) and mes < hasta.date()
+                   for _, desde, hasta in particiones):
+                continue
+            _crear_particion(conn, mes)
+            creadas += 1
+    return creadas
+
+
+def preparar_particiones(bind: Engine) -> None:
+    """
+    Deja mediciones particionada por mes si PARTICIONES_MENSUALES está activado en PostgreSQL.
+
+    Debe ejecutarse al arrancar, antes de Base.metadata.create_all(): crea la
+    tabla particionada si no existe o convierte la existente (ver _convertir()),
+    añade la partición por defecto y las mensuales. Un bloqueo consultivo evita
+    que varios workers lo hagan a la vez.
+
+    Parámetros:
+    - bind (Engine): Engine de SQLAlchemy.
+    """
+    if not (_es_postgres(bind) and PARTICIONES_MENSUALES):
+        return
+    with bind.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": BLOQUEO_PARTICIONES})
+        tipo = _tipo_tabla(conn)
+        if tipo == "p":
+            pass
+        elif tipo is None:
+            _crear_particionada(conn)
+        else:
+            _convertir(conn)
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {PARTICION_DEFECTO} PARTITION OF mediciones DEFAULT"))
+    asegurar_particiones(bind)
+
+
+def _particionada(db: Session) -> bool:
+    return _es_postgres(db.get_bind()) and _tipo_tabla(db.connection()) == "p"
+
+
+# --- Retención ---
+
+def _resumir_series(db: Session, desde: Optional[datetime], hasta: datetime) -> None:
+    """
+    Recalcula desde mediciones las series por hora y por día de [desde, hasta) y descarta las de minuto.
+
+    Es idempotente: si se interrumpe, la siguiente ejecución vuelve a empezar
+    desde la misma frontera.
+    """
+    serie = models.SerieVelocidad
+    rango_series = [serie.inicio < hasta]
+    rango_mediciones = [Medicion.medicion_completa == True, Medicion.timestamp < hasta]
+    if desde is not None:
+        rango_series.append(serie.inicio >= desde)
+        rango_mediciones.append(Medicion.timestamp >= desde)
+
+    # Volcar antes el acumulado del proceso para que no se sume dos veces
+    volcar_series()
+    db.execute(delete(serie).where(*rango_series))
+    db.commit()
+
+    resumen = AcumuladorSeries()
+    filas = db.execute(
+        select(Medicion.timestamp, Medicion.velocidad_kmh)
+        .where(*rango_mediciones)
+        .execution_options(yield_per=5000)
+    )
+    with SessionLocal() as escritura:
+        for bloque in filas.partitions():
+            resumen.registrar([fila._mapping for fila in bloque], granularidades=("hora", "dia"))
+            if len(resumen) > MAX_INTERVALOS_RESUMEN:
+                resumen.volcar(escritura)
+        resumen.volcar(escritura)
+    filas.close()
+
+
+def _avanzar_frontera(db: Session, desde: Optional[datetime], hasta: datetime) -> None:
+    """
+    Recalcula los agregados diarios de [desde, hasta) y guarda la nueva frontera en una transacción.
+
+    Bloquea antes la fila del resumen, como los escritores, para que ninguno
+    lea la frontera antigua mientras cambia; reconciliar() comprueba por su
+    parte que la frontera no cambió durante su lectura.
+    """
+    db.execute(
+        update(models.EstadisticasResumen)
+        .where(models.EstadisticasResumen.id == ID_RESUMEN)
+        .values(reconciliado=models.EstadisticasResumen.reconciliado)
+    )
+    recalcular_diarias(db, desde, hasta)
+    fila = db.get(models.Estado, CLAVE_FRONTERA)
+    if fila is None:
+        db.add(models.Estado(clave=CLAVE_FRONTERA, valor=hasta.isoformat()))
+    else:
+        fila.valor = hasta.isoformat()
+    db.commit()
+
+
+def directorio_archivo() -> str:
+    if DIRECTORIO_ARCHIVO:
+        return DIRECTORIO_ARCHIVO
+    return os.path.join(os.path.dirname(os.path.abspath(engine.url.database or "")), "archivo")
+
+
+def _archivar_sqlite(frontera: datetime) -> int:
+    """
+    Mueve a los ficheros de archivo mensuales las mediciones anteriores a la frontera.
+
+    Cada mes se copia con INSERT OR IGNORE y se confirma antes de borrarlo de
+    la base principal: si el proceso se interrumpe entre ambos pasos, la
+    siguiente ejecución vuelve a copiar sin duplicar y completa el borrado.
+
+    Retorno:
+    - int: Número de filas eliminadas de la base principal.
+    """
+    tabla = Medicion.__table__
+    columnas = ", ".join(f'"{columna.name}"' for columna in tabla.columns)
+    crear_tabla = str(CreateTable(tabla).compile(dialect=engine.dialect)).replace(
+        "CREATE TABLE mediciones", "CREATE TABLE IF NOT EXISTS archivo.mediciones", 1
+    )
+    rango = bindparam("desde", type_=DateTime), bindparam("hasta", type_=DateTime)
+    copiar = text(
+        f"INSERT OR IGNORE INTO archivo.mediciones ({columnas}) "
+        f"SELECT {columnas} FROM main.mediciones "
+        f'WHERE "timestamp" >= :desde AND "timestamp" < :hasta'
+    ).bindparams(*rango)
+    borrar = text(
+        'DELETE FROM main.mediciones WHERE "timestamp" >= :desde AND "timestamp" < :hasta'
+    ).bindparams(*rango)
+
+    os.makedirs(directorio_archivo(), exist_ok=True)
+    eliminadas = 0
+    with engine.connect() as conn:
+        while True:
+            primera = conn.execute(
+                select(func.min(Medicion.timestamp)).where(Medicion.timestamp < frontera)
+            ).scalar()
+            conn.commit()
+            if primera is None:
+                break
+            mes = inicio_mes(primera.date())
+            desde = datetime.combine(mes, time.min)
+            hasta = min(datetime.combine(sumar_meses(mes, 1), time.min), frontera)
+            ruta = os.path.join(directorio_archivo(), f"{nombre_particion(mes)}.db")
+
+            conn.exec_driver_sql("ATTACH DATABASE ? AS archivo", (ruta,))
+            try:
+                conn.exec_driver_sql(crear_tabla)
+                conn.exec_driver_sql(
+                    'CREATE INDEX IF NOT EXISTS archivo.ix_mediciones_timestamp ON mediciones ("timestamp")'
+                )
+                conn.execute(copiar, {"desde": desde, "hasta": hasta})
+                conn.commit()
+                borradas = conn.execute(borrar, {"desde": desde, "hasta": hasta}).rowcount
+                conn.commit()
+            finally:
+                conn.rollback()
+                conn.exec_driver_sql("DETACH DATABASE archivo")
+            if not borradas:
+                # Ninguna fila del mes coincide con el rango: no avanzar en bucle
+                break
+            eliminadas += borradas
+    return eliminadas
+
+
+def _eliminar_particiones(db: Session, frontera: datetime) -> int:
+    """
+    Elimina las particiones que terminan antes de la frontera y las filas anteriores de la partición por defecto.
+
+    Retorno:
+    - int: Número de particiones eliminadas.
+    """
+    conn = db.connection()
+    conn.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": BLOQUEO_PARTICIONES})
+    caducadas = [nombre for nombre, _, hasta in _particiones(conn) if hasta <= frontera]
+    for nombre in caducadas:
+        conn.execute(text(f"DROP TABLE {nombre}"))
+    conn.execute(
+        text(f'DELETE FROM {PARTICION_DEFECTO} WHERE "timestamp" < :frontera'),
+        {"frontera": frontera}
+    )
+    db.commit()
+    return len(caducadas)
+
+
+def _eliminar_por_bloques(db: Session, frontera: datetime) -> int:
+    """Borra las mediciones anteriores a la frontera en bloques de TAMANO_BLOQUE_RETENCION filas."""
+    eliminadas = 0
+    while True:
+        ids = select(Medicion.id).where(Medicion.timestamp < frontera).limit(TAMANO_BLOQUE_RETENCION)
+        borradas = db.execute(delete(Medicion).where(Medicion.id.in_(ids))).rowcount
+        db.commit()
+        eliminadas += borradas
+        if borradas < TAMANO_BLOQUE_RETENCION:
+            return eliminadas
+
+
+def aplicar_retencion(db: Session, ahora: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Resume y elimina las mediciones anteriores a RETENCION_DIAS días (ver el docstring del módulo).
+
+    Parámetros:
+    - db (Session): Sesión de base de datos de SQLAlchemy.
+    - ahora (datetime, opcional): Instante de referencia; por defecto, el actual.
+
+    Retorno:
+    - datetime: La frontera si avanzó o se eliminaron filas, o None si no hubo cambios.
+    """
+    if RETENCION_DIAS <= 0:
+        return None
+    corte = fecha_corte(ahora)
+    frontera = leer_frontera(db)
+    cambios = False
+
+    if frontera is None or frontera < corte:
+        _resumir_series(db, frontera, corte)
+        _avanzar_frontera(db, frontera, corte)
+        frontera = corte
+        cambios = True
+
+    if _particionada(db):
+        cambios |= _eliminar_particiones(db, frontera) > 0
+    elif _es_postgres(db.get_bind()):
+        cambios |= _eliminar_por_bloques(db, frontera) > 0
+    else:
+        db.commit()
+        cambios |= _archivar_sqlite(frontera) > 0
+    return frontera if cambios else None
+
+
+# --- Tarea de fondo ---
+
+def _tomar_turno(db: Session, ahora: datetime) -> bool:
+    """
+    Marca en la tabla estado el inicio de un mantenimiento.
+
+    Retorno:
+    - bool: False si otro worker lo inició hace menos de INTERVALO_MANTENIMIENTO / 2 segundos.
+    """
+    valor = ahora.strftime(FORMATO_MANTENIMIENTO)
+    limite = (ahora - timedelta(seconds=INTERVALO_MANTENIMIENTO / 2)).strftime(FORMATO_MANTENIMIENTO)
+    Estado = models.Estado
+    if db.execute(
+        update(Estado).where(Estado.clave == CLAVE_MANTENIMIENTO, Estado.valor < limite).values(valor=valor)
+    ).rowcount:
+        db.commit()
+        return True
+    db.add(Estado(clave=CLAVE_MANTENIMIENTO, valor=valor))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return False
+    return True
+
+
+def mantener(forzar: bool = False) -> Optional[datetime]:
+    """
+    Crea las particiones que falten y aplica la retención.
+
+    Parámetros:
+    - forzar (bool): Si False, no hace nada cuando otro worker lo hizo hace
+      menos de INTERVALO_MANTENIMIENTO / 2 segundos.
+
+    Retorno:
+    - datetime: La frontera de retención si se eliminaron mediciones, o None.
+    """
+    if RETENCION_DIAS <= 0 and not PARTICIONES_MENSUALES:
+        return None
+    with SessionLocal() as db:
+        if not forzar and not _tomar_turno(db, datetime.now()):
+            return None
+        asegurar_particiones(engine)
+        return aplicar_retencion(db)
+
+
+async def mantener_periodicamente(tras_mantener: Optional[Callable[[datetime], None]] = None) -> None:
+    """
+    Tarea de fondo que ejecuta mantener() al arrancar y cada INTERVALO_MANTENIMIENTO segundos.
+
+    Parámetros:
+    - tras_mantener (Callable, opcional): Recibe la frontera de retención
+      cuando se eliminan mediciones, para descartar los pasos pendientes en
+      memoria e invalidar las respuestas cacheadas.
+    """
+    while True:
+        try:
+            frontera = await run_in_threadpool(mantener)
+            if frontera is not None and tras_mantener is not None:
+                # Puede escribir en el estado compartido: fuera del event loop
+                await run_in_threadpool(tras_mantener, frontera)
+        except Exception as e:
+            print("Error en el mantenimiento de mediciones:", e)
+        await asyncio.sleep(INTERVALO_MANTENIMIENTO)
@@ -0,0 +1,187 @@
+"""
+Versiones async de los endpoints de ingesta, listado y estadísticas.
+
+Se registran en main.py solo con DB_ASYNC=true. Usan AsyncSession (asyncpg o
+aiosqlite), por lo que cada petición espera a la base de datos en el event loop
+en lugar de ocupar un hilo del threadpool, y un worker puede atender muchos más
+detectores a la vez. La lógica es la misma que la de los endpoints síncronos:
+la ingesta usa ingesta.registrar_lote_async() y las consultas se construyen
+con las funciones de consultas.py.
+"""
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Body, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import get_async_db
+import models
+import schemas
+from consultas import (
+    sentencia_listado, sentencia_estadisticas, respuesta_estadisticas,
+    sentencia_series, respuesta_series, decodificar_cursor, paginar,
+    sentencia_hay_pendiente, sentencia_carriles_pendientes, respuesta_estado
+)
+from ingesta import (
+    estado, emparejador, MAX_EVENTOS_LOTE, get_distancia_sensores, normalizar_evento,
+    evento_no_valido, respuesta_evento, registrar_lote_async
+)
+from series import rango_series
+from respuestas import cache_respuestas
+
+router = APIRouter()
+
+
+@router.post("/mediciones/")
+async def registrar_medicion(
+    datos: Dict = Body(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Versión async de registrar_medicion: mismo contrato y mismas sentencias SQL.
+
+    Parámetros:
+    - datos: JSON con clave "detector1" o "detector2" y su timestamp como valor,
+      y opcionalmente "carril" (por defecto "principal")
+    - db (AsyncSession): Sesión async inyectada automáticamente por FastAPI.
+
+    Retorno:
+    - Medición registrada, completada o mensaje de estado
+    """
+    evento = normalizar_evento(datos)
+    if evento is None:
+        return evento_no_valido(datos)
+    return respuesta_evento((await registrar_lote_async(db, [evento]))[0])
+
+
+@router.post("/mediciones/batch")
+async def registrar_mediciones_lote(
+    eventos: List[Dict] = Body(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Versión async de registrar_mediciones_lote: mismo contrato y mismas sentencias SQL.
+
+    Excepciones:
+    - HTTPException (413): Si el lote supera MAX_EVENTOS_LOTE eventos.
+    - HTTPException (409): Si el estado pendiente cambió en la tabla durante el
+      procesamiento y no pudo resincronizarse.
+    """
+    if len(eventos) > MAX_EVENTOS_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote admite como máximo {MAX_EVENTOS_LOTE} eventos"
+        )
+
+    normalizados = [normalizar_evento(evento) for evento in eventos]
+    resultados = await registrar_lote_async(db, normalizados)
+    return {"procesados": len(resultados), "resultados": resultados}
+
+
+@router.get("/estado/", response_model=schemas.EstadoResponse)
+async def obtener_estado(db: AsyncSession = Depends(get_async_db)):
+    """Versión async de obtener_estado: memoria con un único proceso, índice parcial con varios."""
+    if estado.compartido:
+        filas = (await db.execute(sentencia_carriles_pendientes())).all()
+    else:
+        filas = emparejador.resumen_pendientes()
+    return respuesta_estado(
+        filas, get_distancia_sensores(), estado.config("limite_velocidad", 50.0)
+    )
+
+
+@router.get("/mediciones/", response_model=List[schemas.MedicionResponse])
+async def listar_mediciones(
+    request: Request,
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    solo_completas: bool = Query(True),
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    carril: Optional[str] = None,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Versión async de listar_mediciones: mismos filtros, orden y cursores."""
+    try:
+        posicion = decodificar_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    generacion = estado.generacion()
+    primera_pagina = posicion is None and skip == 0
+    if primera_pagina:
+        cacheada = cache_respuestas.responder(request, generacion)
+        if cacheada is not None:
+            return cacheada
+
+    filas = (await db.scalars(sentencia_listado(
+        skip, limit, solo_completas, fecha_inicio, fecha_fin, carril, posicion
+    ))).all()
+    mediciones, siguiente, anterior = paginar(filas, limit, posicion, skip)
+    cabeceras = {}
+    if siguiente:
+        cabeceras["X-Cursor-Siguiente"] = siguiente
+    if anterior:
+        cabeceras["X-Cursor-Anterior"] = anterior
+    if primera_pagina:
+        return cache_respuestas.guardar(
+            request, generacion,
+            [schemas.MedicionResponse.model_validate(medicion) for medicion in mediciones],
+            cabeceras
+        )
+    response.headers.update(cabeceras)
+    return mediciones
+
+
+@router.get("/estadisticas/", response_model=schemas.EstadisticasResponse)
+async def obtener_estadisticas(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Versión async de obtener_estadisticas: una única consulta agregada, con caché."""
+    generacion = estado.generacion()
+    cacheada = cache_respuestas.responder(request, generacion)
+    if cacheada is not None:
+        return cacheada
+
+    stats = (await db.execute(sentencia_estadisticas(date.today()))).first()
+    return cache_respuestas.guardar(request, generacion, respuesta_estadisticas(stats))
+
+
+@router.get("/estadisticas/series", response_model=List[schemas.PuntoSerieResponse])
+async def obtener_series(
+    granularidad: str = Query("hora"),
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Versión async de obtener_series: mismos parámetros y mismo resultado."""
+    fecha_inicio, fecha_fin = rango_series(granularidad, fecha_inicio, fecha_fin)
+    return respuesta_series(await db.scalars(sentencia_series(granularidad, fecha_inicio, fecha_fin)))
+
+
+@router.get("/dashboard/snapshot", response_model=schemas.DashboardSnapshotResponse)
+async def obtener_snapshot_dashboard(
+    request: Request,
+    limit: int = Query(10, ge=1, le=100),
+    desde: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Versión async de obtener_snapshot_dashboard: mismo contenido, caché y ETag."""
+    generacion = estado.generacion()
+    cacheada = cache_respuestas.responder(request, generacion)
+    if cacheada is not None:
+        return cacheada
+
+    sentencia = sentencia_listado(limit=limit)
+    if desde is not None:
+        sentencia = sentencia.where(models.Medicion.timestamp >= desde)
+    mediciones = (await db.scalars(sentencia)).all()[:limit]
+
+    snapshot = schemas.DashboardSnapshotResponse(
+        estadisticas=respuesta_estadisticas((await db.execute(sentencia_estadisticas(date.today()))).first()),
+        ultimas_mediciones=mediciones,
+        distancia_sensores=get_distancia_sensores(),
+        limite_velocidad=estado.config("limite_velocidad", 50.0),
+        hay_medicion_pendiente=await db.scalar(sentencia_hay_pendiente())
+    )
+    return cache_respuestas.guardar(request, generacion, snapshot)
@@ -0,0 +1,76 @@
+"""
+Endpoints de ingesta en modo de escritura diferida (INGESTA_DIFERIDA=true).
+
+Se registran en main.py antes que los síncronos y async equivalentes y tienen
+prioridad sobre ellos. Validan los eventos, los anotan en el diario de
+ingesta (diario.py) y responden 202 en cuanto están en disco; el emparejamiento
+y la escritura en la base de datos los hace después el escritor del diario.
+"""
+from typing import Dict, List
+
+from fastapi import APIRouter, Body, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+
+from diario import diario
+from ingesta import MAX_EVENTOS_LOTE, normalizar_evento, evento_no_valido
+from metricas import eventos_sensor
+
+router = APIRouter()
+
+
+@router.post("/mediciones/", status_code=202)
+async def registrar_medicion(response: Response, datos: Dict = Body(...)):
+    """
+    Versión diferida de registrar_medicion: anota el evento y responde sin esperar a la base de datos.
+
+    Parámetros:
+    - datos: JSON con clave "detector1" o "detector2" y su timestamp como valor,
+      y opcionalmente "carril" (por defecto "principal")
+
+    Retorno:
+    - Dict con "estado" "aceptado", el tipo de evento, el carril y el timestamp
+      interpretado, o el mismo mensaje de error que la versión síncrona.
+    """
+    evento = normalizar_evento(datos)
+    if evento is None:
+        # Los eventos válidos se cuentan al aplicarlos (registrar_lote)
+        response.status_code = 200
+        return evento_no_valido(datos)
+
+    await run_in_threadpool(diario.anotar, [evento])
+    return {
+        "estado": "aceptado",
+        "mensaje": "Evento registrado. La medición se procesará en segundo plano",
+        "evento": evento.tipo,
+        "carril": evento.carril,
+        "timestamp": evento.timestamp.isoformat()
+    }
+
+
+@router.post("/mediciones/batch", status_code=202)
+async def registrar_mediciones_lote(eventos: List[Dict] = Body(...)):
+    """
+    Versión diferida de registrar_mediciones_lote: anota los eventos válidos en el diario.
+
+    Los eventos no válidos no se anotan y se indican en "rechazados" con su
+    posición en el lote.
+
+    Excepciones:
+    - HTTPException (413): Si el lote supera MAX_EVENTOS_LOTE eventos.
+    """
+    if len(eventos) > MAX_EVENTOS_LOTE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"El lote admite como máximo {MAX_EVENTOS_LOTE} eventos"
+        )
+
+    normalizados = [normalizar_evento(evento) for evento in eventos]
+    validos = [evento for evento in normalizados if evento is not None]
+    eventos_sensor.inc("ninguno", "error", cantidad=len(normalizados) - len(validos))
+    if validos:
+        await run_in_threadpool(diario.anotar, validos)
+    return {
+        "estado": "aceptado",
+        "aceptados": len(validos),
+        "rechazados": [indice for indice, evento in enumerate(normalizados) if evento is None]
+    }
@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 
 class MedicionBase(BaseModel):
@@ -20,6 +20,7 @@ class MedicionResponse(BaseModel):
     tiempo_recorrido: Optional[float] = None
     es_primera_medicion: bool
     medicion_completa: bool
+    carril: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -49,3 +50,50 @@ class EstadisticasResponse(BaseModel):
     velocidad_minima_kmh: Optional[float] = None
     mediciones_hoy: int
     excesos_velocidad: int
+
+
+class PuntoSerieResponse(BaseModel):
+    inicio: datetime
+    total: int
+    velocidad_media_kmh: Optional[float] = None
+    p50_kmh: Optional[float] = None
+    p85_kmh: Optional[float] = None
+    p95_kmh: Optional[float] = None
+    excesos: int
+
+
+class CarrilPendienteResponse(BaseModel):
+    carril: str
+    pendientes: int
+    desde: datetime
+    antiguedad_segundos: float
+
+
+class EstadoResponse(BaseModel):
+    esperando_sensor2: bool
+    carriles: List[CarrilPendienteResponse]
+    distancia_sensores: float
+    limite_velocidad: float
+
+
+class DashboardSnapshotResponse(BaseModel):
+    estadisticas: EstadisticasResponse
+    ultimas_mediciones: List[MedicionResponse]
+    distancia_sensores: float
+    limite_velocidad: float
+    hay_medicion_pendiente: bool
+
+
+class LatidoCreate(BaseModel):
+    # El backend "notificado" guarda el modelo con la clave "reloj:<placa>" (50 caracteres)
+    placa: str = Field(..., max_length=40)
+    ticks: int
+    epoch: int
+
+
+class RelojResponse(BaseModel):
+    placa: str
+    latidos: int
+    ventana: int
+    desfase_ms: float
+    deriva_ppm: float
@@ -0,0 +1,362 @@
+"""
+Series temporales de velocidad agregadas por minuto, hora y día.
+
+Cada medición completada se suma en memoria a sus tres intervalos
+(AcumuladorSeries.registrar) y una tarea de fondo vuelca el acumulado a la
+tabla series_velocidad cada SERIES_INTERVALO segundos, fusionando los sketches
+de cuantiles con los ya guardados. GET /estadisticas/series lee así un año de
+datos diarios (o una semana de datos por hora) en una única consulta por
+clave primaria, sin recorrer la tabla mediciones.
+"""
+import asyncio
+import json
+import os
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, update, func, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, es_error_transitorio
+import models
+from emparejamiento import hora_local
+from estadisticas import UMBRAL_EXCESO, insertar_con_conflicto
+from sketch import SketchVelocidad
+
+# Duración de cada granularidad, usada para limitar el número de puntos por consulta
+GRANULARIDADES = {
+    "minuto": timedelta(minutes=1),
+    "hora": timedelta(hours=1),
+    "dia": timedelta(days=1),
+}
+# Máximo de puntos devueltos por GET /estadisticas/series
+MAX_PUNTOS_SERIE = 5000
+# Segundos entre volcados del acumulado en memoria a la base de datos
+INTERVALO_SERIES = float(os.getenv("SERIES_INTERVALO", "5"))
+# Intervalos por sentencia al volcar
+TAMANO_BLOQUE_SERIES = 500
+# Fila de la tabla estado con la frontera del relleno inicial y, al terminar, su fecha
+CLAVE_SERIES = "series_velocidad"
+
+Serie = models.SerieVelocidad
+
+
+def inicio_intervalo(timestamp: datetime, granularidad: str) -> datetime:
+    """Trunca un timestamp, en hora local naive, al inicio de su intervalo de la granularidad dada."""
+    timestamp = hora_local(timestamp)
+    if granularidad == "minuto":
+        return timestamp.replace(second=0, microsecond=0)
+    if granularidad == "hora":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def rango_series(
+    granularidad: str,
+    fecha_inicio: Optional[date],
+    fecha_fin: Optional[date]
+) -> Tuple[date, date]:
+    """
+    Completa y valida el rango de fechas pedido a GET /estadisticas/series.
+
+    Por defecto el rango termina hoy y empieza el mismo día de fin.
+
+    Excepciones:
+    - HTTPException (400): Si la granularidad no existe, el rango está invertido
+      o contiene más de MAX_PUNTOS_SERIE intervalos.
+    """
+    if granularidad not in GRANULARIDADES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Granularidad no válida. Opciones: {', '.join(GRANULARIDADES)}"
+        )
+    fecha_fin = fecha_fin or date.today()
+    fecha_inicio = fecha_inicio or fecha_fin
+    if fecha_inicio > fecha_fin:
+        raise HTTPException(status_code=400, detail="fecha_inicio es posterior a fecha_fin")
+    if (fecha_fin - fecha_inicio + timedelta(days=1)) / GRANULARIDADES[granularidad] > MAX_PUNTOS_SERIE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"El rango supera {MAX_PUNTOS_SERIE} puntos. Use una granularidad mayor"
+        )
+    return fecha_inicio, fecha_fin
+
+
+class Intervalo:
+    """Agregados de un intervalo todavía no volcados."""
+    __slots__ = ("total", "suma_kmh", "excesos", "sketch")
+
+    def __init__(self):
+        self.total = 0
+        self.suma_kmh = 0.0
+        self.excesos = 0
+        self.sketch = SketchVelocidad()
+
+    def agregar(self, velocidad_kmh: float) -> None:
+        self.total += 1
+        self.suma_kmh += velocidad_kmh
+        self.excesos += velocidad_kmh > UMBRAL_EXCESO
+        self.sketch.agregar(velocidad_kmh)
+
+    def fusionar(self, otro: "Intervalo") -> None:
+        self.total += otro.total
+        self.suma_kmh += otro.suma_kmh
+        self.excesos += otro.excesos
+        self.sketch.fusionar(otro.sketch)
+
+
+class AcumuladorSeries:
+    """
+    Acumulado en memoria de los intervalos de un proceso.
+
+    registrar() es O(1) por medición y no accede a la base de datos; volcar()
+    suma el acumulado a la tabla y, si falla, lo conserva para el siguiente
+    volcado. Lo no volcado se pierde si el proceso termina de forma abrupta.
+    """
+
+    def __init__(self):
+        self._intervalos: Dict[Tuple[str, datetime], Intervalo] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._intervalos)
+
+    def registrar(self, filas: List[dict], granularidades: Sequence[str] = tuple(GRANULARIDADES)) -> None:
+        """
+        Suma mediciones completadas a sus intervalos.
+
+        Parámetros:
+        - filas (List[dict]): Mediciones con "timestamp" y "velocidad_kmh".
+        - granularidades (Sequence[str], opcional): Granularidades a las que sumarlas;
+          por defecto, todas.
+        """
+        with self._lock:
+            for fila in filas:
+                for granularidad in granularidades:
+                    clave = (granularidad, inicio_intervalo(fila["timestamp"], granularidad))
+                    intervalo = self._intervalos.get(clave)
+                    if intervalo is None:
+                        intervalo = self._intervalos[clave] = Intervalo()
+                    intervalo.agregar(fila["velocidad_kmh"])
+
+    def volcar(self, db: Session, confirmar: bool = True) -> int:
+        """
+        Suma el acumulado a series_velocidad y lo vacía.
+
+        El upsert de los contadores bloquea las filas afectadas (o la base de
+        datos en SQLite) antes de leer los sketches guardados, de modo que dos
+        workers que vuelcan el mismo intervalo no pierden cuentas. Si un bloque
+        falla por un error transitorio (ver es_error_transitorio), él y los
+        siguientes vuelven al acumulado y el error se propaga; si el error es
+        permanente, el bloque se descarta para no reintentarlo indefinidamente.
+
+        Parámetros:
+        - db (Session): Sesión de base de datos de SQLAlchemy.
+        - confirmar (bool): Si False, los bloques se ejecutan en la transacción
+          de `db` sin confirmarla y cualquier error se propaga sin devolver
+          nada al acumulado (relleno de init_series).
+
+        Retorno:
+        - int: Número de intervalos volcados.
+        """
+        with self._lock:
+            pendientes, self._intervalos = self._intervalos, {}
+        if not pendientes:
+            return 0
+
+        claves = list(pendientes)
+        if not confirmar:
+            for inicio in range(0, len(claves), TAMANO_BLOQUE_SERIES):
+                self._volcar_bloque(db, claves[inicio:inicio + TAMANO_BLOQUE_SERIES], pendientes)
+            return len(claves)
+        volcados = 0
+        for inicio in range(0, len(claves), TAMANO_BLOQUE_SERIES):
+            bloque = claves[inicio:inicio + TAMANO_BLOQUE_SERIES]
+            try:
+                self._volcar_bloque(db, bloque, pendientes)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                if not es_error_transitorio(e):
+                    print(f"Descartados {len(bloque)} intervalos de series de velocidad:", e)
+                    continue
+                # Devolver al acumulado los bloques no confirmados para el siguiente volcado
+                with self._lock:
+                    for clave in claves[inicio:]:
+                        actual = self._intervalos.setdefault(clave, Intervalo())
+                        actual.fusionar(pendientes[clave])
+                raise
+            volcados += len(bloque)
+        return volcados
+
+    @staticmethod
+    def _volcar_bloque(db: Session, claves, pendientes) -> None:
+        upsert = insertar_con_conflicto(Serie).values([
+            {
+                "granularidad": granularidad,
+                "inicio": inicio,
+                "total": pendientes[(granularidad, inicio)].total,
+                "suma_kmh": pendientes[(granularidad, inicio)].suma_kmh,
+                "excesos": pendientes[(granularidad, inicio)].excesos,
+                # NULL distingue las filas nuevas, cuyo sketch es el acumulado
+                "sketch": None,
+            }
+            for granularidad, inicio in claves
+        ])
+        db.execute(upsert.on_conflict_do_update(
+            index_elements=[Serie.granularidad, Serie.inicio],
+            set_={
+                "total": Serie.total + upsert.excluded.total,
+                "suma_kmh": Serie.suma_kmh + upsert.excluded.suma_kmh,
+                "excesos": Serie.excesos + upsert.excluded.excesos,
+            }
+        ))
+
+        sketches = []
+        por_granularidad: Dict[str, List[datetime]] = {}
+        for granularidad, inicio in claves:
+            por_granularidad.setdefault(granularidad, []).append(inicio)
+        for granularidad, inicios in por_granularidad.items():
+            guardados = db.execute(
+                select(Serie.inicio, Serie.sketch).where(
+                    Serie.granularidad == granularidad,
+                    Serie.inicio.in_(inicios)
+                )
+            ).all()
+            for inicio, texto in guardados:
+                sketch = pendientes[(granularidad, inicio)].sketch
+                if texto is not None:
+                    guardado = SketchVelocidad.desde_json(texto)
+                    guardado.fusionar(sketch)
+                    sketch = guardado
+                sketches.append({"g": granularidad, "i": inicio, "s": sketch.a_json()})
+
+        tabla = Serie.__table__
+        db.execute(
+            tabla.update()
+            .where(tabla.c.granularidad == bindparam("g"), tabla.c.inicio == bindparam("i"))
+            .values(sketch=bindparam("s")),
+            sketches
+        )
+
+
+acumulador_series = AcumuladorSeries()
+
+
+def volcar_series() -> int:
+    with SessionLocal() as db:
+        return acumulador_series.volcar(db)
+
+
+async def volcar_periodicamente() -> None:
+    """Tarea de fondo que vuelca el acumulado cada INTERVALO_SERIES segundos."""
+    while True:
+        await asyncio.sleep(INTERVALO_SERIES)
+        try:
+            await run_in_threadpool(volcar_series)
+        except Exception as e:
+            print("Error volcando series de velocidad:", e)
+
+
+def _reservar_relleno(db: Session) -> str:
+    """
+    Inserta el marcador con la frontera del relleno y devuelve su valor.
+
+    La frontera es el id máximo y los ids de los pasos pendientes en ese
+    momento: los workers acumulan en memoria las mediciones que se completan
+    después, así que el relleno solo debe sumar las que ya estaban completas.
+    Si otro worker insertó antes el marcador, devuelve el suyo.
+    """
+    Medicion = models.Medicion
+    hasta = db.scalar(select(func.max(Medicion.id))) or 0
+    pendientes = db.scalars(select(Medicion.id).where(
+        Medicion.es_primera_medicion == True,
+        Medicion.medicion_completa == False
+    )).all()
+    valor = json.dumps({"hasta": hasta, "pendientes": list(pendientes)})
+    db.add(models.Estado(clave=CLAVE_SERIES, valor=valor))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return db.get(models.Estado, CLAVE_SERIES).valor
+    return valor
+
+
+def _frontera_relleno(valor: str) -> Optional[dict]:
+    """Frontera de un relleno sin terminar, o None si el marcador indica que ya se hizo."""
+    try:
+        frontera = json.loads(valor)
+    except ValueError:
+        # Fecha en que terminó el relleno
+        return None
+    return frontera if isinstance(frontera, dict) else None
+
+
+def init_series(db: Session) -> None:
+    """
+    Rellena series_velocidad con las mediciones existentes la primera vez.
+
+    El marcador CLAVE_SERIES de la tabla estado fija la frontera del relleno
+    (ver _reservar_relleno) y se actualiza a la fecha de terminación en la
+    misma transacción que el último volcado. Todo el relleno es una única
+    transacción: si el proceso muere a mitad, no queda nada sumado y el
+    siguiente arranque lo repite. Mientras dura, el marcador queda bloqueado
+    y otro worker que arranque lo omite sin esperar (en SQLite, tras el
+    timeout del lock de escritura). Las mediciones se leen en bloques y
+    se vuelcan (sin confirmar) cada pocos miles de intervalos para acotar la
+    memoria.
+    """
+    marcador = db.get(models.Estado, CLAVE_SERIES)
+    valor = marcador.valor if marcador is not None else _reservar_relleno(db)
+    frontera = _frontera_relleno(valor)
+    if frontera is None:
+        return
+
+    Estado = models.Estado
+    try:
+        # Tomar el marcador hasta el commit. En PostgreSQL, SKIP LOCKED no espera
+        # al worker que ya está rellenando; en SQLite el UPDATE toma el lock de
+        # escritura. Si otro worker terminó mientras tanto, el valor ya no coincide
+        actual = db.execute(
+            select(Estado.valor).where(Estado.clave == CLAVE_SERIES).with_for_update(skip_locked=True)
+        ).scalar()
+        tomado = actual == valor and db.execute(
+            update(Estado).where(Estado.clave == CLAVE_SERIES, Estado.valor == valor).values(valor=valor)
+        ).rowcount
+    except Exception as e:
+        db.rollback()
+        if not es_error_transitorio(e):
+            raise
+        print("Otro worker está rellenando las series de velocidad:", e)
+        return
+    if not tomado:
+        db.rollback()
+        return
+
+    try:
+        historico = AcumuladorSeries()
+        excluidos = set(frontera["pendientes"])
+        Medicion = models.Medicion
+        filas = db.execute(
+            select(Medicion.id, Medicion.timestamp, Medicion.velocidad_kmh)
+            .where(Medicion.medicion_completa == True, Medicion.id <= frontera["hasta"])
+            .execution_options(yield_per=5000)
+        )
+        for bloque in filas.partitions():
+            historico.registrar([fila._mapping for fila in bloque if fila.id not in excluidos])
+            if len(historico) > 20000:
+                historico.volcar(db, confirmar=False)
+        filas.close()
+        historico.volcar(db, confirmar=False)
+        db.execute(
+            update(Estado).where(Estado.clave == CLAVE_SERIES).values(valor=datetime.now().isoformat())
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
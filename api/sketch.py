@@ -0,0 +1,100 @@
+"""
+Sketch de cuantiles fusionable para las velocidades (al estilo de DDSketch).
+
+Cada valor positivo se cuenta en la cubeta ceil(log_gamma(valor)), con
+gamma = (1 + precision) / (1 - precision), de modo que cualquier cuantil se
+estima con un error relativo menor que la precisión (1 % por defecto). Dos
+sketches con la misma precisión se fusionan sumando sus cubetas, lo que
+permite guardar uno por minuto y combinarlos en horas, días o rangos
+arbitrarios sin volver a leer las mediciones.
+"""
+import json
+import math
+from typing import Dict, Optional
+
+# Error relativo máximo de los cuantiles estimados
+PRECISION_RELATIVA = 0.01
+# Número máximo de cubetas; al superarlo se unen las de los valores más bajos
+MAX_CUBETAS = 2048
+# Los valores por debajo de este umbral cuentan como cero
+VALOR_MINIMO = 1e-3
+
+
+class SketchVelocidad:
+    def __init__(self, precision: float = PRECISION_RELATIVA):
+        self.precision = precision
+        self._gamma = (1 + precision) / (1 - precision)
+        self._log_gamma = math.log(self._gamma)
+        self.cubetas: Dict[int, int] = {}
+        self.ceros = 0
+        self.total = 0
+
+    def _indice(self, valor: float) -> int:
+        return math.ceil(math.log(valor) / self._log_gamma)
+
+    def _valor(self, indice: int) -> float:
+        # Punto de la cubeta (gamma^(i-1), gamma^i] con el mismo error relativo a ambos extremos
+        return 2 * self._gamma ** indice / (self._gamma + 1)
+
+    def agregar(self, valor: float, veces: int = 1) -> None:
+        if valor <= VALOR_MINIMO:
+            self.ceros += veces
+        else:
+            indice = self._indice(valor)
+            self.cubetas[indice] = self.cubetas.get(indice, 0) + veces
+            if len(self.cubetas) > MAX_CUBETAS:
+                self._colapsar()
+        self.total += veces
+
+    def fusionar(self, otro: "SketchVelocidad") -> None:
+        """Suma a este sketch las cuentas de otro con la misma precisión."""
+        if otro.precision != self.precision:
+            raise ValueError("Solo se pueden fusionar sketches con la misma precisión")
+        for indice, cuenta in otro.cubetas.items():
+            self.cubetas[indice] = self.cubetas.get(indice, 0) + cuenta
+        self.ceros += otro.ceros
+        self.total += otro.total
+        if len(self.cubetas) > MAX_CUBETAS:
+            self._colapsar()
+
+    def _colapsar(self) -> None:
+        indices = sorted(self.cubetas)
+        sobrantes = len(indices) - MAX_CUBETAS
+        destino = indices[sobrantes]
+        for indice in indices[:sobrantes]:
+            self.cubetas[destino] += self.cubetas.pop(indice)
+
+    def cuantil(self, q: float) -> Optional[float]:
+        """
+        Estima el cuantil q (entre 0 y 1) de los valores agregados.
+
+        Retorno:
+        - float: Valor estimado, o None si el sketch está vacío.
+        """
+        if self.total == 0:
+            return None
+        # Posición (desde 0) del valor más cercano al cuantil
+        rango = int(q * (self.total - 1) + 0.5)
+        acumulado = self.ceros
+        if rango < acumulado:
+            return 0.0
+        for indice in sorted(self.cubetas):
+            acumulado += self.cubetas[indice]
+            if rango < acumulado:
+                return self._valor(indice)
+        return self._valor(max(self.cubetas))
+
+    def a_json(self) -> str:
+        return json.dumps(
+            {"p": self.precision, "z": self.ceros, "c": sorted(self.cubetas.items())},
+            separators=(",", ":")
+        )
+
+    @classmethod
+    def desde_json(cls, texto: str) -> "SketchVelocidad":
+        datos = json.loads(texto)
+        sketch = cls(datos["p"])
+        sketch.ceros = datos["z"]
+        sketch.cubetas = {indice: cuenta for indice, cuenta in datos["c"]}
+        sketch.total = sketch.ceros + sum(sketch.cubetas.values())
+        return sketch
@@ -5,11 +5,13 @@ Inicializa la base de datos y arranca el servidor uvicorn.
 import os
 import uvicorn
 from database import engine, Base, get_db
+from migraciones import aplicar_migraciones
 import models
 
 # Crear todas las tablas
 print("Inicializando base de datos...")
 Base.metadata.create_all(bind=engine)
+aplicar_migraciones(engine)
 print("Base de datos inicializada correctamente")
 
 # Obtener puerto de la variable de entorno (Render usa PORT)
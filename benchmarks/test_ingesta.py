@@ -0,0 +1,70 @@
+"""
+Benchmarks de ingesta: POST /mediciones/ (detector1 y detector2) y POST /mediciones/batch.
+
+Cada benchmark usa su propio carril (prefijo PREFIJO_CARRIL_INGESTA) para que
+los pasos pendientes de uno no afecten al emparejamiento de los demás.
+"""
+
+from datetime import datetime, timedelta
+
+from conftest import PREFIJO_CARRIL_INGESTA
+
+EVENTOS_LOTE = 100
+
+
+def _ahora() -> str:
+    return datetime.now().isoformat()
+
+
+def test_detector1(benchmark, cliente):
+    carril = f"{PREFIJO_CARRIL_INGESTA}detector1"
+
+    respuesta = benchmark(lambda: cliente.post("/mediciones/", json={"detector1": _ahora(), "carril": carril}))
+
+    assert respuesta.json()["es_primera_medicion"] is True
+
+
+def test_detector2(benchmark, cliente):
+    """Completa un paso pendiente; el detector1 se registra fuera de la medición."""
+    carril = f"{PREFIJO_CARRIL_INGESTA}detector2"
+
+    def iniciar_paso():
+        cliente.post("/mediciones/", json={"detector1": _ahora(), "carril": carril})
+        return (), {}
+
+    respuesta = benchmark.pedantic(
+        lambda: cliente.post("/mediciones/", json={"detector2": _ahora(), "carril": carril}),
+        setup=iniciar_paso, rounds=200, warmup_rounds=5
+    )
+
+    assert respuesta.json()["medicion_completa"] is True
+
+
+def test_paso_completo(benchmark, cliente):
+    """Un vehículo: detector1 y detector2 en dos peticiones."""
+    carril = f"{PREFIJO_CARRIL_INGESTA}paso"
+
+    def paso():
+        cliente.post("/mediciones/", json={"detector1": _ahora(), "carril": carril})
+        return cliente.post("/mediciones/", json={"detector2": _ahora(), "carril": carril})
+
+    assert benchmark(paso).json()["medicion_completa"] is True
+
+
+def test_lote(benchmark, cliente):
+    """Lote de EVENTOS_LOTE eventos: EVENTOS_LOTE / 2 pasos completos en una petición."""
+    carril = f"{PREFIJO_CARRIL_INGESTA}lote"
+
+    def lote():
+        inicio = datetime.now()
+        eventos = []
+        for n in range(EVENTOS_LOTE // 2):
+            paso = inicio + timedelta(milliseconds=n)
+            eventos.append({"detector1": paso.isoformat(), "carril": carril})
+            eventos.append({"detector2": (paso + timedelta(microseconds=500)).isoformat(), "carril": carril})
+        return cliente.post("/mediciones/batch", json=eventos)
+
+    respuesta = benchmark(lote).json()
+
+    assert respuesta["procesados"] == EVENTOS_LOTE
+    assert all(r["estado"] in ("pendiente", "completada") for r in respuesta["resultados"])
@@ -0,0 +1,103 @@
+"""
+Benchmarks de lectura: GET /mediciones/, /estadisticas/ y /configuracion/.
+
+Los que dependen del tamaño de la tabla se ejecutan con cada valor de
+BENCH_FILAS (fixture filas); los nombres llevan el tamaño, p. ej.
+test_estadisticas[10000filas].
+"""
+
+from datetime import timedelta
+
+import pytest
+
+from conftest import ORIGEN
+
+
+@pytest.fixture
+def sin_cache():
+    from respuestas import cache_respuestas
+    assert cache_respuestas.ttl == 0
+
+
+def test_listar_primera_pagina(benchmark, cliente, filas, sin_cache):
+    respuesta = benchmark(cliente.get, "/mediciones/", params={"limit": 20})
+
+    assert len(respuesta.json()) == 20
+
+
+@pytest.mark.parametrize("profundidad", [0.1, 0.5, 0.9], ids=lambda p: f"skip{int(p * 100)}%")
+def test_listar_skip(benchmark, cliente, filas, sin_cache, profundidad):
+    """Paginación por skip/limit a una fracción de la tabla."""
+    params = {"limit": 20, "skip": int(filas * profundidad)}
+
+    respuesta = benchmark(cliente.get, "/mediciones/", params=params)
+
+    assert respuesta.status_code == 200
+
+
+@pytest.mark.parametrize("profundidad", [0.1, 0.5, 0.9], ids=lambda p: f"cursor{int(p * 100)}%")
+def test_listar_cursor(benchmark, cliente, filas, sin_cache, profundidad):
+    """Paginación por cursor desde la medición situada a la fracción indicada de la tabla."""
+    from sqlalchemy import select
+    from database import SessionLocal
+    import models
+    from consultas import codificar_cursor
+
+    frontera = ORIGEN + timedelta(seconds=int(filas * (1 - profundidad)) * 2)
+    with SessionLocal() as db:
+        medicion = db.scalars(
+            select(models.Medicion).where(models.Medicion.timestamp >= frontera)
+            .order_by(models.Medicion.timestamp, models.Medicion.id).limit(1)
+        ).one()
+    params = {"limit": 20, "cursor": codificar_cursor(medicion, "siguiente")}
+
+    respuesta = benchmark(cliente.get, "/mediciones/", params=params)
+
+    assert respuesta.status_code == 200
+
+
+@pytest.mark.parametrize("filtro", ["fecha", "carril", "todas", "fecha_carril"])
+def test_listar_filtros(benchmark, cliente, filas, sin_cache, filtro):
+    """Listado con filtros: un día a mitad de la tabla, un carril, o incluyendo pendientes."""
+    dia = (ORIGEN + timedelta(seconds=filas)).date().isoformat()
+    params = {
+        "fecha": {"fecha_inicio": dia, "fecha_fin": dia},
+        "carril": {"carril": "norte"},
+        "todas": {"solo_completas": False},
+        "fecha_carril": {"fecha_inicio": dia, "fecha_fin": dia, "carril": "norte"},
+    }[filtro]
+
+    respuesta = benchmark(cliente.get, "/mediciones/", params=dict(params, limit=20))
+
+    assert len(respuesta.json()) == 20
+
+
+def test_estadisticas(benchmark, cliente, filas, sin_cache):
+    respuesta = benchmark(cliente.get, "/estadisticas/")
+
+    assert respuesta.json()["total_mediciones"] > 0
+
+
+def test_estadisticas_cacheada(benchmark, cliente, filas):
+    """Misma consulta servida desde la caché de respuestas (CACHE_RESPUESTAS_TTL activo)."""
+    from respuestas import cache_respuestas
+
+    cache_respuestas.ttl = 30
+    try:
+        respuesta = benchmark(cliente.get, "/estadisticas/")
+    finally:
+        cache_respuestas.ttl = 0
+
+    assert respuesta.status_code == 200
+
+
+def test_configuracion(benchmark, cliente, sin_cache):
+    respuesta = benchmark(cliente.get, "/configuracion/")
+
+    assert len(respuesta.json()) >= 2
+
+
+def test_configuracion_clave(benchmark, cliente, sin_cache):
+    respuesta = benchmark(cliente.get, "/configuracion/distancia_sensores")
+
+    assert respuesta.json()["clave"] == "distancia_sensores"
@@ -1,28 +1,147 @@
+import copy
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from django.conf import settings
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+# Conexiones keep-alive reutilizables hacia FastAPI por proceso
+TAMANO_POOL = 16
+# Llamadas simultáneas máximas de en_paralelo() por proceso
+HILOS_PARALELO = 8
+# Respuestas GET con ETag guardadas por proceso para peticiones condicionales
+MAX_CONDICIONALES = 64
+
+_sesion: Optional[requests.Session] = None
+_ejecutor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+# Última respuesta con ETag de cada consulta GET: (ETag, datos)
+_condicionales: "OrderedDict[Tuple, Tuple[str, Any]]" = OrderedDict()
+
+
+def _crear_sesion() -> requests.Session:
+    """
+    Sesión HTTP compartida por todas las instancias de RadarAPIClient del proceso.
+
+    Mantiene un pool de conexiones keep-alive, de modo que las peticiones no
+    abren una conexión TCP (y TLS) nueva cada vez. Los errores de conexión y
+    las respuestas 502/503/504 se reintentan con espera exponencial, salvo en
+    POST, que no es idempotente.
+    """
+    reintentos = Retry(
+        total=2,
+        backoff_factor=0.2,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "PUT"}),
+        raise_on_status=False
+    )
+    adaptador = HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=TAMANO_POOL,
+        max_retries=reintentos
+    )
+    sesion = requests.Session()
+    sesion.mount("http://", adaptador)
+    sesion.mount("https://", adaptador)
+    return sesion
+
+
+def obtener_sesion() -> requests.Session:
+    global _sesion
+    if _sesion is None:
+        with _lock:
+            if _sesion is None:
+                _sesion = _crear_sesion()
+    return _sesion
+
+
+def _obtener_ejecutor() -> ThreadPoolExecutor:
+    global _ejecutor
+    if _ejecutor is None:
+        with _lock:
+            if _ejecutor is None:
+                _ejecutor = ThreadPoolExecutor(
+                    max_workers=HILOS_PARALELO, thread_name_prefix="radar-api"
+                )
+    return _ejecutor
 
 
 class RadarAPIClient:
     def __init__(self):
         self.base_url = getattr(settings, 'FASTAPI_BASE_URL', 'http://localhost:8080')
         self.timeout = 10
+        self.sesion = obtener_sesion()
+
+    def en_paralelo(self, **llamadas: Callable[[], Any]) -> Dict[str, Any]:
+        """
+        Ejecuta a la vez varias llamadas independientes a la API.
+
+        El tiempo total es el de la llamada más lenta en lugar de la suma de todas.
+        Cada llamada mantiene su propio manejo de errores, así que un fallo en una
+        no impide obtener las demás.
+
+        Ejemplo:
+            datos = client.en_paralelo(
+                estadisticas=client.obtener_estadisticas,
+                limite=client.obtener_limite_velocidad,
+            )
 
-    def _get(self, endpoint: str, params: Optional[Dict] = None) -> Dict[str, Any]:
+        Retorna un dict con el resultado de cada llamada bajo su mismo nombre.
+        """
+        ejecutor = _obtener_ejecutor()
+        futuros = {nombre: ejecutor.submit(llamada) for nombre, llamada in llamadas.items()}
+        return {nombre: futuro.result() for nombre, futuro in futuros.items()}
+
+    def _get(
+        self,
+        endpoint: str,
+        params: Optional[Dict] = None,
+        clave: Optional[Tuple] = None
+    ) -> Dict[str, Any]:
+        """
+        GET condicional: si la respuesta anterior traía ETag, se envía en
+        If-None-Match y, cuando la API responde 304, se reutiliza sin volver a
+        transferirla ni decodificarla.
+
+        `clave` identifica la consulta en la copia guardada; por defecto son el
+        endpoint y los parámetros.
+        """
+        if clave is None:
+            clave = (endpoint, tuple(sorted((params or {}).items())))
+        guardada = _condicionales.get(clave)
+        cabeceras = {"If-None-Match": guardada[0]} if guardada else {}
         try:
-            response = requests.get(
+            response = self.sesion.get(
                 f"{self.base_url}{endpoint}",
                 params=params,
+                headers=cabeceras,
                 timeout=self.timeout
             )
+            if response.status_code == 304 and guardada:
+                # Copia: las vistas anotan los resultados
+                return copy.deepcopy(guardada[1])
             response.raise_for_status()
-            return response.json()
+            datos = response.json()
         except requests.RequestException as e:
             return {"error": str(e)}
 
+        etag = response.headers.get("ETag")
+        if etag:
+            with _lock:
+                _condicionales[clave] = (etag, datos)
+                _condicionales.move_to_end(clave)
+                while len(_condicionales) > MAX_CONDICIONALES:
+                    _condicionales.popitem(last=False)
+            return copy.deepcopy(datos)
+        return datos
+
     def _post(self, endpoint: str, data: Optional[Dict] = None) -> Dict[str, Any]:
         try:
-            response = requests.post(
+            response = self.sesion.post(
                 f"{self.base_url}{endpoint}",
                 json=data,
                 timeout=self.timeout
@@ -34,7 +153,7 @@ class RadarAPIClient:
 
     def _put(self, endpoint: str, data: Dict) -> Dict[str, Any]:
         try:
-            response = requests.put(
+            response = self.sesion.put(
                 f"{self.base_url}{endpoint}",
                 json=data,
                 timeout=self.timeout
@@ -49,15 +168,51 @@ class RadarAPIClient:
         skip: int = 0,
         limit: int = 20,
         fecha_inicio: Optional[str] = None,
-        fecha_fin: Optional[str] = None
+        fecha_fin: Optional[str] = None,
+        cursor: Optional[str] = None
     ) -> List[Dict[str, Any]]:
-        params = {"skip": skip, "limit": limit, "solo_completas": True}
+        return self.obtener_pagina_mediciones(
+            limit=limit, fecha_inicio=fecha_inicio, fecha_fin=fecha_fin, cursor=cursor, skip=skip
+        )["mediciones"]
+
+    def obtener_pagina_mediciones(
+        self,
+        limit: int = 20,
+        fecha_inicio: Optional[str] = None,
+        fecha_fin: Optional[str] = None,
+        cursor: Optional[str] = None,
+        skip: int = 0
+    ) -> Dict[str, Any]:
+        """
+        Obtiene una página de mediciones completas y los cursores de las páginas vecinas.
+
+        Retorna un dict con "mediciones", "siguiente" y "anterior"; los cursores son
+        None si no hay página en ese sentido.
+        """
+        params = {"limit": limit, "solo_completas": True}
+        if cursor:
+            params["cursor"] = cursor
+        elif skip:
+            params["skip"] = skip
         if fecha_inicio:
             params["fecha_inicio"] = fecha_inicio
         if fecha_fin:
             params["fecha_fin"] = fecha_fin
-        result = self._get("/mediciones/", params)
-        return result if isinstance(result, list) else []
+        try:
+            response = self.sesion.get(
+                f"{self.base_url}/mediciones/",
+                params=params,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+            mediciones = response.json()
+        except (requests.RequestException, ValueError):
+            return {"mediciones": [], "siguiente": None, "anterior": None}
+        return {
+            "mediciones": mediciones if isinstance(mediciones, list) else [],
+            "siguiente": response.headers.get("X-Cursor-Siguiente"),
+            "anterior": response.headers.get("X-Cursor-Anterior"),
+        }
 
     def obtener_medicion(self, medicion_id: int) -> Dict[str, Any]:
         return self._get(f"/mediciones/{medicion_id}")
@@ -65,6 +220,54 @@ class RadarAPIClient:
     def obtener_estadisticas(self) -> Dict[str, Any]:
         return self._get("/estadisticas/")
 
+    def obtener_series(
+        self,
+        granularidad: str = "hora",
+        fecha_inicio: Optional[str] = None,
+        fecha_fin: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Obtiene la serie agregada (media, percentiles y excesos) por minuto, hora o día."""
+        params = {"granularidad": granularidad}
+        if fecha_inicio:
+            params["fecha_inicio"] = fecha_inicio
+        if fecha_fin:
+            params["fecha_fin"] = fecha_fin
+        result = self._get("/estadisticas/series", params)
+        return result if isinstance(result, list) else []
+
+    def obtener_snapshot(self, limit: int = 10, desde: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Obtiene en una sola petición lo que muestra el dashboard.
+
+        Usa GET /dashboard/snapshot, que la API sirve desde su caché con ETag:
+        si nada ha cambiado desde la última vez, responde 304 y se reutiliza la
+        copia guardada. Si la API no tiene ese endpoint (API simple), compone el
+        mismo resultado con las llamadas individuales en paralelo.
+
+        Retorna un dict con estadisticas, ultimas_mediciones, distancia_sensores,
+        limite_velocidad y hay_medicion_pendiente.
+        """
+        params = {"limit": limit}
+        if desde:
+            params["desde"] = desde
+        # El ETag depende del contenido, así que basta una copia por tipo de
+        # consulta aunque `desde` cambie en cada llamada
+        result = self._get(
+            "/dashboard/snapshot", params, clave=("/dashboard/snapshot", limit, desde is not None)
+        )
+        if "error" not in result:
+            return result
+
+        return self.en_paralelo(
+            estadisticas=self.obtener_estadisticas,
+            ultimas_mediciones=lambda: self.obtener_mediciones(
+                limit=limit, fecha_inicio=desde
+            ),
+            distancia_sensores=self.obtener_distancia,
+            limite_velocidad=self.obtener_limite_velocidad,
+            hay_medicion_pendiente=self.hay_medicion_pendiente,
+        )
+
     def obtener_configuracion(self) -> List[Dict[str, Any]]:
         result = self._get("/configuracion/")
         return result if isinstance(result, list) else []
@@ -110,9 +313,29 @@ class RadarAPIClient:
 
         return self._post("/mediciones/", data=data)
 
+    def obtener_estado(self) -> Dict[str, Any]:
+        """
+        Obtiene en una sola petición si hay una medición pendiente y la configuración.
+
+        Ambas APIs devuelven esperando_sensor2, distancia_sensores y
+        limite_velocidad en /estado/; la API completa añade "carriles" con los
+        pasos pendientes por carril y su antigüedad.
+        """
+        result = self._get("/estado/")
+        if "error" not in result:
+            result.setdefault("carriles", [])
+            return result
+        datos = self.en_paralelo(
+            esperando_sensor2=self.hay_medicion_pendiente,
+            distancia_sensores=self.obtener_distancia,
+            limite_velocidad=self.obtener_limite_velocidad,
+        )
+        datos["carriles"] = []
+        return datos
+
     def hay_medicion_pendiente(self) -> bool:
         """Verifica si hay una medición esperando el segundo sensor."""
-        # Primero intentar con /estado/ (API simple)
+        # /estado/ existe en ambas APIs (en la completa, sin consultar la tabla)
         result = self._get("/estado/")
         if "error" not in result:
             return result.get('esperando_sensor2', False)
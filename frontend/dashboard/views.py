@@ -1,3 +1,6 @@
+import json
+from datetime import date, timedelta
+
 from django.shortcuts import render, redirect
 from django.views import View
 from django.contrib import messages
@@ -12,10 +15,11 @@ class DashboardView(View):
     def get(self, request):
         client = RadarAPIClient()
 
-        estadisticas = client.obtener_estadisticas()
-        ultimas_mediciones = client.obtener_mediciones(limit=10)
-        distancia = client.obtener_distancia()
-        limite_velocidad = client.obtener_limite_velocidad()
+        datos = client.obtener_snapshot(limit=10)
+        estadisticas = datos['estadisticas']
+        ultimas_mediciones = datos['ultimas_mediciones']
+        distancia = datos['distancia_sensores']
+        limite_velocidad = datos['limite_velocidad']
 
         for medicion in ultimas_mediciones:
             velocidad = medicion.get('velocidad_kmh')
@@ -36,21 +40,28 @@ class MedicionesListView(View):
     def get(self, request):
         client = RadarAPIClient()
 
-        page = int(request.GET.get('page', 1))
-        limit = 20
-        skip = (page - 1) * limit
+        # El número de página solo se muestra; la posición la da el cursor
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        cursor = request.GET.get('cursor')
 
         fecha_inicio = request.GET.get('fecha_inicio')
         fecha_fin = request.GET.get('fecha_fin')
 
-        mediciones = client.obtener_mediciones(
-            skip=skip,
-            limit=limit,
-            fecha_inicio=fecha_inicio,
-            fecha_fin=fecha_fin
+        datos = client.en_paralelo(
+            pagina=lambda: client.obtener_pagina_mediciones(
+                limit=20,
+                fecha_inicio=fecha_inicio,
+                fecha_fin=fecha_fin,
+                cursor=cursor
+            ),
+            limite_velocidad=client.obtener_limite_velocidad,
         )
-
-        limite_velocidad = client.obtener_limite_velocidad()
+        pagina = datos['pagina']
+        mediciones = pagina['mediciones']
+        limite_velocidad = datos['limite_velocidad']
 
         for medicion in mediciones:
             velocidad = medicion.get('velocidad_kmh')
@@ -59,8 +70,10 @@ class MedicionesListView(View):
         context = {
             'mediciones': mediciones,
             'page': page,
-            'has_prev': page > 1,
-            'has_next': len(mediciones) == limit,
+            'has_prev': bool(pagina['anterior']),
+            'has_next': bool(pagina['siguiente']),
+            'cursor_anterior': pagina['anterior'] or '',
+            'cursor_siguiente': pagina['siguiente'] or '',
             'fecha_inicio': fecha_inicio or '',
             'fecha_fin': fecha_fin or '',
             'limite_velocidad': limite_velocidad,
@@ -73,13 +86,17 @@ class MedicionDetailView(View):
 
     def get(self, request, pk):
         client = RadarAPIClient()
-        medicion = client.obtener_medicion(pk)
+        datos = client.en_paralelo(
+            medicion=lambda: client.obtener_medicion(pk),
+            limite_velocidad=client.obtener_limite_velocidad,
+        )
+        medicion = datos['medicion']
 
         if 'error' in medicion:
             messages.error(request, 'Medicion no encontrada')
             return redirect('dashboard:mediciones')
 
-        limite_velocidad = client.obtener_limite_velocidad()
+        limite_velocidad = datos['limite_velocidad']
         velocidad = medicion.get('velocidad_kmh')
         medicion['exceso'] = velocidad and velocidad > limite_velocidad
 
@@ -93,24 +110,43 @@ class MedicionDetailView(View):
 class ReportesView(View):
     template_name = 'dashboard/reportes.html'
 
+    # Días mostrados por defecto según la granularidad elegida
+    DIAS_POR_GRANULARIDAD = {'minuto': 1, 'hora': 7, 'dia': 365}
+
     def get(self, request):
         client = RadarAPIClient()
 
-        estadisticas = client.obtener_estadisticas()
-        mediciones = client.obtener_mediciones(limit=50)
-
-        velocidades = []
-        timestamps = []
-        for m in reversed(mediciones):
-            if m.get('velocidad_kmh'):
-                velocidades.append(m['velocidad_kmh'])
-                timestamps.append(m['timestamp'][:16].replace('T', ' '))
+        granularidad = request.GET.get('granularidad', 'hora')
+        if granularidad not in self.DIAS_POR_GRANULARIDAD:
+            granularidad = 'hora'
+        try:
+            fin = date.fromisoformat(request.GET.get('fecha_fin') or '')
+        except ValueError:
+            fin = date.today()
+        fecha_fin = fin.isoformat()
+        fecha_inicio = request.GET.get('fecha_inicio') or (
+            fin - timedelta(days=self.DIAS_POR_GRANULARIDAD[granularidad] - 1)
+        ).isoformat()
+
+        datos = client.en_paralelo(
+            estadisticas=client.obtener_estadisticas,
+            serie=lambda: client.obtener_series(granularidad, fecha_inicio, fecha_fin),
+        )
+        estadisticas = datos['estadisticas']
+        serie = datos['serie']
 
+        formato = {'minuto': 16, 'hora': 16, 'dia': 10}[granularidad]
         context = {
             'estadisticas': estadisticas,
-            'velocidades_json': velocidades,
-            'timestamps_json': timestamps,
-            'total_mediciones': len(mediciones),
+            'etiquetas_json': json.dumps([p['inicio'][:formato].replace('T', ' ') for p in serie]),
+            'media_json': json.dumps([p['velocidad_media_kmh'] for p in serie]),
+            'p50_json': json.dumps([p['p50_kmh'] for p in serie]),
+            'p85_json': json.dumps([p['p85_kmh'] for p in serie]),
+            'p95_json': json.dumps([p['p95_kmh'] for p in serie]),
+            'num_puntos': len(serie),
+            'granularidad': granularidad,
+            'fecha_inicio': fecha_inicio,
+            'fecha_fin': fecha_fin,
         }
         return render(request, self.template_name, context)
 
@@ -120,12 +156,14 @@ class ConfiguracionView(View):
 
     def get(self, request):
         client = RadarAPIClient()
-        distancia = client.obtener_distancia()
-        limite_velocidad = client.obtener_limite_velocidad()
+        datos = client.en_paralelo(
+            distancia=client.obtener_distancia,
+            limite_velocidad=client.obtener_limite_velocidad,
+        )
 
         context = {
-            'distancia_actual': distancia,
-            'limite_velocidad': limite_velocidad,
+            'distancia_actual': datos['distancia'],
+            'limite_velocidad': datos['limite_velocidad'],
         }
         return render(request, self.template_name, context)
 
@@ -170,17 +208,16 @@ class NuevaMedicionView(View):
 
     def get(self, request):
         client = RadarAPIClient()
-        distancia = client.obtener_distancia()
-        limite_velocidad = client.obtener_limite_velocidad()
-        hay_pendiente = client.hay_medicion_pendiente()
+        datos = client.obtener_estado()
 
         # Estado: 'esperando_sensor1' (azul), 'esperando_sensor2' (naranja)
-        estado = 'esperando_sensor2' if hay_pendiente else 'esperando_sensor1'
+        estado = 'esperando_sensor2' if datos['esperando_sensor2'] else 'esperando_sensor1'
 
         context = {
-            'distancia_actual': distancia,
-            'limite_velocidad': limite_velocidad,
+            'distancia_actual': datos['distancia_sensores'],
+            'limite_velocidad': datos['limite_velocidad'],
             'estado': estado,
+            'carriles_pendientes': datos['carriles'],
         }
         return render(request, self.template_name, context)
 
@@ -223,18 +260,19 @@ class MedicionesAutoView(View):
 
     def get(self, request):
         client = RadarAPIClient()
-        distancia = client.obtener_distancia()
-        limite_velocidad = client.obtener_limite_velocidad()
-        hay_pendiente = client.hay_medicion_pendiente()
+        datos = client.obtener_snapshot(limit=5)
+        distancia = datos['distancia_sensores']
+        limite_velocidad = datos['limite_velocidad']
 
-        estado = 'esperando_sensor2' if hay_pendiente else 'esperando_sensor1'
+        estado = 'esperando_sensor2' if datos['hay_medicion_pendiente'] else 'esperando_sensor1'
 
-        ultimas_mediciones = client.obtener_mediciones(limit=5)
+        ultimas_mediciones = datos['ultimas_mediciones']
         for medicion in ultimas_mediciones:
             velocidad = medicion.get('velocidad_kmh')
             medicion['exceso'] = velocidad and velocidad > limite_velocidad
 
         api_url = getattr(settings, 'FASTAPI_BASE_URL', 'http://localhost:8080')
+        stream_url = getattr(settings, 'FASTAPI_PUBLIC_URL', api_url) + '/stream/mediciones'
 
         context = {
             'distancia_actual': distancia,
@@ -242,6 +280,7 @@ class MedicionesAutoView(View):
             'estado': estado,
             'ultimas_mediciones': ultimas_mediciones,
             'api_url': api_url,
+            'stream_url': stream_url,
         }
         return render(request, self.template_name, context)
 
@@ -253,18 +292,16 @@ class MedicionesAutoAPIView(View):
         from datetime import datetime, timedelta
 
         client = RadarAPIClient()
-        hay_pendiente = client.hay_medicion_pendiente()
-        limite_velocidad = client.obtener_limite_velocidad()
 
         # Solo obtener mediciones de los últimos 10 segundos (tiempo real)
         ahora = datetime.now()
         hace_10_segundos = ahora - timedelta(seconds=10)
         fecha_inicio = hace_10_segundos.strftime('%Y-%m-%dT%H:%M:%S')
 
-        ultimas_mediciones = client.obtener_mediciones(
-            limit=5,
-            fecha_inicio=fecha_inicio
-        )
+        datos = client.obtener_snapshot(limit=5, desde=fecha_inicio)
+        hay_pendiente = datos['hay_medicion_pendiente']
+        limite_velocidad = datos['limite_velocidad']
+        ultimas_mediciones = datos['ultimas_mediciones']
         for medicion in ultimas_mediciones:
             velocidad = medicion.get('velocidad_kmh')
             medicion['exceso'] = velocidad and velocidad > limite_velocidad
@@ -282,9 +319,11 @@ class AutoView(View):
 
     def get(self, request):
         api_url = getattr(settings, 'FASTAPI_BASE_URL', 'http://localhost:8080')
-        
+        stream_url = getattr(settings, 'FASTAPI_PUBLIC_URL', api_url) + '/stream/mediciones'
+
         context = {
             'api_url': api_url,
+            'stream_url': stream_url,
         }
         return render(request, self.template_name, context)
 
@@ -77,3 +77,6 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # API Configuration - Use environment variable for API URL (important for Render deployment)
 FASTAPI_BASE_URL = os.getenv('API_URL', 'http://localhost:8080')
+# URL de la API accesible desde el navegador (stream de mediciones en tiempo real).
+# En Docker Compose API_URL apunta al nombre interno del servicio.
+FASTAPI_PUBLIC_URL = os.getenv('API_PUBLIC_URL', FASTAPI_BASE_URL)
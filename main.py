@@ -1,10 +1,14 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
-from datetime import datetime
+from typing import List, Optional
+from datetime import date, datetime, time, timedelta
+import base64
+import binascii
 import json
 
+from almacen import AlmacenEstado, RegistroMediciones, MedicionRegistrada
+
 app = FastAPI(title="Radar de Velocidad API")
 
 app.add_middleware(
@@ -16,6 +20,8 @@ app.add_middleware(
 
 ARCHIVO_MEDICIONES = "mediciones.json"
 ARCHIVO_CONFIG = "config.json"
+ARCHIVO_ESTADO = "radar_estado.bin"
+ARCHIVO_REGISTRO = "mediciones.bin"
 DISTANCIA_SENSORES = 100  # metros
 LIMITE_VELOCIDAD = 50  # km/h
 
@@ -29,20 +35,30 @@ def cargar_config():
         return {}
 
 
-def guardar_config(config: dict):
-    """Guarda la configuración en el archivo JSON."""
-    with open(ARCHIVO_CONFIG, "w") as f:
-        json.dump(config, f, indent=2)
+def cargar_pendiente() -> Optional[float]:
+    """Timestamp pendiente del sensor 1 guardado en el archivo JSON de mediciones."""
+    try:
+        with open(ARCHIVO_MEDICIONES, "r") as f:
+            return json.load(f).get("medicion1")
+    except (FileNotFoundError, json.JSONDecodeError, AttributeError):
+        return None
+
+
+# Estado y mediciones en almacen.py: la configuración y el paso pendiente se
+# leen de memoria en cada petición. Al crear el almacén se importan los JSON
+# que usaban las versiones anteriores.
+almacen = AlmacenEstado(ARCHIVO_ESTADO)
+if almacen.nuevo:
+    almacen.iniciar(cargar_config(), cargar_pendiente())
+registro = RegistroMediciones(ARCHIVO_REGISTRO)
 
 
 def obtener_distancia() -> float:
-    config = cargar_config()
-    return config.get("distancia_sensores", DISTANCIA_SENSORES)
+    return almacen.config("distancia_sensores", DISTANCIA_SENSORES)
 
 
 def obtener_limite() -> float:
-    config = cargar_config()
-    return config.get("limite_velocidad", LIMITE_VELOCIDAD)
+    return almacen.config("limite_velocidad", LIMITE_VELOCIDAD)
 
 
 class MedicionRequest(BaseModel):
@@ -66,27 +82,15 @@ def registrar_medicion(data: MedicionRequest = MedicionRequest()):
     else:
         medicion = datetime.now().timestamp()
 
-    try:
-        with open(ARCHIVO_MEDICIONES, "r") as f:
-            datos = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        datos = {}
-
-    medicion1 = datos.get("medicion1")
+    # Guarda el paso como pendiente, o retira el pendiente, en una sola operación atómica
+    medicion1 = almacen.registrar_paso(medicion)
 
     if medicion1 is None:
-        # Primera medición - guardar timestamp
-        datos["medicion1"] = medicion
-        with open(ARCHIVO_MEDICIONES, "w") as f:
-            json.dump(datos, f, indent=2)
+        # Primera medición - timestamp guardado
         return MedicionResponse(mensaje="Sensor 1 activado. Esperando sensor 2...")
     else:
         # Segunda medición - calcular velocidad
-        resultado = calcular_velocidad(medicion1, medicion)
-        # Limpiar para siguiente medición
-        with open(ARCHIVO_MEDICIONES, "w") as f:
-            json.dump({}, f, indent=2)
-        return resultado
+        return calcular_velocidad(medicion1, medicion)
 
 
 def calcular_velocidad(medicion1: float, medicion2: float) -> MedicionResponse:
@@ -102,6 +106,7 @@ def calcular_velocidad(medicion1: float, medicion2: float) -> MedicionResponse:
     limite = obtener_limite()
     exceso = " - EXCESO" if velocidad_kmh > limite else ""
     print(f"Velocidad: {velocidad_kmh:.2f} km/h ({velocidad_ms:.2f} m/s) en {segundos:.2f}s{exceso}")
+    registro.anotar(float(medicion1), velocidad_ms, velocidad_kmh, distancia, segundos)
 
     return MedicionResponse(
         mensaje=f"Velocidad: {velocidad_kmh:.2f} km/h",
@@ -111,17 +116,166 @@ def calcular_velocidad(medicion1: float, medicion2: float) -> MedicionResponse:
     )
 
 
-@app.get("/estado/")
-def obtener_estado():
+class MedicionRegistradaResponse(BaseModel):
+    """Medición completa con los campos de MedicionResponse de la API con base de datos (api/)."""
+    id: int
+    timestamp: datetime
+    velocidad_ms: Optional[float] = None
+    velocidad_kmh: Optional[float] = None
+    distancia: float
+    tiempo_recorrido: Optional[float] = None
+    es_primera_medicion: bool = True
+    medicion_completa: bool = True
+    carril: Optional[str] = "principal"
+
+
+class EstadisticasResponse(BaseModel):
+    total_mediciones: int
+    velocidad_promedio_kmh: Optional[float] = None
+    velocidad_maxima_kmh: Optional[float] = None
+    velocidad_minima_kmh: Optional[float] = None
+    mediciones_hoy: int
+    excesos_velocidad: int
+
+
+# Esta API mide un único carril, con el nombre por defecto de api/
+CARRIL = "principal"
+
+
+def respuesta_medicion(medicion: MedicionRegistrada) -> MedicionRegistradaResponse:
+    return MedicionRegistradaResponse(
+        id=medicion.id,
+        timestamp=datetime.fromtimestamp(medicion.timestamp),
+        velocidad_ms=medicion.velocidad_ms,
+        velocidad_kmh=medicion.velocidad_kmh,
+        distancia=medicion.distancia,
+        tiempo_recorrido=medicion.tiempo_recorrido
+    )
+
+
+def inicio_dia(dia: date) -> float:
+    return datetime.combine(dia, time.min).timestamp()
+
+
+def codificar_cursor(medicion: MedicionRegistrada, direccion: str) -> str:
+    """Token de página vecina con el mismo formato que el de api/consultas.py."""
+    datos = json.dumps(
+        [datetime.fromtimestamp(medicion.timestamp).isoformat(), medicion.id, direccion],
+        separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip("=")
+
+
+def decodificar_cursor(token: str):
+    """(id, dirección) de un token de codificar_cursor(). Lanza ValueError si no es válido."""
     try:
-        with open(ARCHIVO_MEDICIONES, "r") as f:
-            datos = json.load(f)
-            hay_pendiente = datos.get("medicion1") is not None
-    except (FileNotFoundError, json.JSONDecodeError):
-        hay_pendiente = False
+        relleno = "=" * (-len(token) % 4)
+        _, medicion_id, direccion = json.loads(base64.urlsafe_b64decode(token + relleno))
+        medicion_id = int(medicion_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError("Cursor no válido")
+    if direccion not in ("siguiente", "anterior"):
+        raise ValueError("Cursor no válido")
+    return medicion_id, direccion
+
+
+@app.get("/mediciones/", response_model=List[MedicionRegistradaResponse])
+def listar_mediciones(
+    response: Response,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    solo_completas: bool = Query(True),
+    fecha_inicio: Optional[date] = None,
+    fecha_fin: Optional[date] = None,
+    carril: Optional[str] = None,
+    cursor: Optional[str] = None
+):
+    """
+    Lista las mediciones completas, más recientes primero, como GET /mediciones/ de api/.
+
+    Las mediciones se leen del registro binario: el rango de fechas se localiza
+    con búsqueda binaria y solo se leen los registros de la página, así que
+    skip no recorre las mediciones saltadas. Los cursores de las páginas
+    vecinas se devuelven en las cabeceras X-Cursor-Siguiente y X-Cursor-Anterior.
+
+    Parámetros de consulta:
+    - skip (int): Número de registros a saltar. Solo se usa sin cursor.
+    - limit (int): Número máximo de registros a retornar (1 a 100). Por defecto 20.
+    - solo_completas (bool): Se acepta por compatibilidad; el registro solo guarda
+      mediciones completas (el paso pendiente se consulta en GET /estado/).
+    - fecha_inicio, fecha_fin (date, opcional): Rango de fechas, ambos inclusive.
+    - carril (str, opcional): Esta API solo tiene el carril "principal".
+    - cursor (str, opcional): Token de X-Cursor-Siguiente o X-Cursor-Anterior.
+
+    Excepciones:
+    - HTTPException (400): Si el cursor no es válido.
+    """
+    try:
+        posicion = decodificar_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if carril is not None and carril != CARRIL:
+        return []
+
+    inicio, fin = registro.rango(
+        inicio_dia(fecha_inicio) if fecha_inicio else None,
+        inicio_dia(fecha_fin + timedelta(days=1)) if fecha_fin else None
+    )
+    # Página [bajo, alto) de índices del registro, que se devuelve en orden inverso
+    if posicion is None:
+        alto = max(inicio, fin - skip)
+        bajo = max(inicio, alto - limit)
+    elif posicion[1] == "siguiente":
+        alto = max(inicio, min(fin, posicion[0] - 1))
+        bajo = max(inicio, alto - limit)
+    else:
+        bajo = min(fin, max(inicio, posicion[0]))
+        alto = min(fin, bajo + limit)
+
+    mediciones = list(registro.iterar(bajo, alto, inverso=True))
+    if mediciones and bajo > inicio:
+        response.headers["X-Cursor-Siguiente"] = codificar_cursor(mediciones[-1], "siguiente")
+    if mediciones and alto < fin:
+        response.headers["X-Cursor-Anterior"] = codificar_cursor(mediciones[0], "anterior")
+    return [respuesta_medicion(medicion) for medicion in mediciones]
+
+
+@app.get("/mediciones/{medicion_id}", response_model=MedicionRegistradaResponse)
+def obtener_medicion(medicion_id: int):
+    medicion = registro.obtener(medicion_id)
+    if medicion is None:
+        raise HTTPException(status_code=404, detail="Medicion no encontrada")
+    return respuesta_medicion(medicion)
+
+
+@app.get("/estadisticas/", response_model=EstadisticasResponse)
+def obtener_estadisticas():
+    """
+    Estadísticas de las mediciones completas, como GET /estadisticas/ de api/.
+
+    Los agregados se mantienen en memoria y cada petición solo lee las
+    mediciones registradas desde la anterior; las de hoy se cuentan con el
+    rango de fechas del registro (búsqueda binaria). Los excesos son las
+    mediciones por encima de LIMITE_VELOCIDAD, como UMBRAL_EXCESO en api/.
+    """
+    agregados = registro.estadisticas(LIMITE_VELOCIDAD)
+    total = agregados["total"]
+    hoy = date.today()
+    inicio, fin = registro.rango(inicio_dia(hoy), inicio_dia(hoy + timedelta(days=1)))
+    return EstadisticasResponse(
+        total_mediciones=total,
+        velocidad_promedio_kmh=round(agregados["suma_kmh"] / total, 2) if total else None,
+        velocidad_maxima_kmh=round(agregados["maxima_kmh"], 2) if total else None,
+        velocidad_minima_kmh=round(agregados["minima_kmh"], 2) if total else None,
+        mediciones_hoy=fin - inicio,
+        excesos_velocidad=agregados["excesos"]
+    )
 
+
+@app.get("/estado/")
+def obtener_estado():
     return {
-        "esperando_sensor2": hay_pendiente,
+        "esperando_sensor2": almacen.pendiente() is not None,
         "distancia_sensores": obtener_distancia(),
         "limite_velocidad": obtener_limite()
     }
@@ -129,8 +283,7 @@ def obtener_estado():
 
 @app.delete("/reset/")
 def reset_medicion():
-    with open(ARCHIVO_MEDICIONES, "w") as f:
-        json.dump({}, f, indent=2)
+    almacen.reiniciar()
     return {"mensaje": "Medición reiniciada"}
 
 
@@ -149,9 +302,7 @@ def set_distancia(data: ConfigUpdate):
         nueva_distancia = float(data.valor)
         if nueva_distancia <= 0:
             return {"error": "La distancia debe ser mayor a 0"}
-        config = cargar_config()
-        config["distancia_sensores"] = nueva_distancia
-        guardar_config(config)
+        almacen.guardar_config("distancia_sensores", nueva_distancia)
         return {"clave": "distancia_sensores", "valor": str(nueva_distancia)}
     except ValueError:
         return {"error": "Valor de distancia inválido"}
@@ -168,9 +319,7 @@ def set_limite(data: ConfigUpdate):
         nuevo_limite = float(data.valor)
         if nuevo_limite <= 0:
             return {"error": "El límite debe ser mayor a 0"}
-        config = cargar_config()
-        config["limite_velocidad"] = nuevo_limite
-        guardar_config(config)
+        almacen.guardar_config("limite_velocidad", nuevo_limite)
         return {"clave": "limite_velocidad", "valor": str(nuevo_limite)}
     except ValueError:
         return {"error": "Valor de límite inválido"}
\ No newline at end of file
@@ -0,0 +1,150 @@
+#--------BUFFER DE EVENTOS----------------------
+# Cola de eventos de la placa en dos niveles:
+# - ColaIRQ: cola circular en RAM, preasignada, donde el handler de la
+#   interrupción del sensor apunta el ticks_ms (o ticks_us) del flanco, sin
+#   reservar memoria.
+# - BufferEventos: cola circular persistida en la flash con los eventos ya
+#   confirmados y su timestamp Unix en ms, pendientes de enviar. Sobrevive a
+#   reinicios y cortes: al arrancar se recuperan los eventos no enviados.
+#
+# Formato del fichero de eventos: `capacidad` registros de tamaño fijo
+# (secuencia, tipo, timestamp ms, dato, comprobación). El dato es 0 salvo en
+# las mediciones completas de radar_doble.py (TIPO_MEDICION), donde es el
+# tiempo recorrido en microsegundos. El registro de secuencia n va
+# en la posición (n - 1) % capacidad. La última secuencia enviada se guarda en
+# un fichero aparte. Si el buffer se llena se descartan los eventos más antiguos.
+import struct
+import array
+
+REGISTRO = "<IBqiH"
+TAM_REGISTRO = struct.calcsize(REGISTRO)
+# Tipos de evento: 1 y 2 son el detector1 y el detector2
+TIPO_MEDICION = 3
+
+
+def _comprobacion(secuencia, tipo, ms, dato):
+    return (secuencia + tipo * 7 + ms + dato * 3) & 0xFFFF
+
+
+class ColaIRQ:
+    """Cola circular de flancos (tipo, ticks) que se puede llenar desde una interrupción."""
+
+    def __init__(self, capacidad=32):
+        self.capacidad = capacidad
+        self._ticks = array.array("i", [0] * capacidad)
+        self._tipos = bytearray(capacidad)
+        self._cabeza = 0
+        self._cola = 0
+        self.perdidos = 0
+
+    def poner(self, tipo, ticks):
+        # Se llama desde el handler de la IRQ: solo enteros pequeños, sin reservar memoria
+        siguiente = (self._cabeza + 1) % self.capacidad
+        if siguiente == self._cola:
+            self.perdidos += 1
+            return
+        self._ticks[self._cabeza] = ticks
+        self._tipos[self._cabeza] = tipo
+        self._cabeza = siguiente
+
+    def primero(self):
+        """(tipo, ticks) del flanco más antiguo, o None si la cola está vacía."""
+        if self._cola == self._cabeza:
+            return None
+        return self._tipos[self._cola], self._ticks[self._cola]
+
+    def quitar(self):
+        if self._cola != self._cabeza:
+            self._cola = (self._cola + 1) % self.capacidad
+
+
+class BufferEventos:
+    """
+    Eventos (tipo, timestamp ms, dato) persistidos en la flash hasta que se envían.
+
+    Uso:
+
+        buffer = BufferEventos("eventos.bin")
+        buffer.anotar(1, epoch_ms)          # detector1
+        lote = buffer.pendientes(20)         # [(tipo, ms, dato), ...] sin sacarlos
+        buffer.confirmar(len(lote))          # tras enviarlos
+    """
+
+    def __init__(self, ruta="eventos.bin", capacidad=256):
+        self.ruta = ruta
+        self.ruta_enviado = ruta + ".env"
+        self.capacidad = capacidad
+        self.perdidos = 0
+        self._abrir()
+        self.escrito = self._recuperar_escrito()
+        self.enviado = self._leer_enviado()
+        # Registros sobrescritos o fichero de eventos perdido
+        self.enviado = max(self.enviado, self.escrito - capacidad)
+        self.escrito = max(self.escrito, self.enviado)
+
+    def __len__(self):
+        return self.escrito - self.enviado
+
+    def _abrir(self):
+        tamano = TAM_REGISTRO * self.capacidad
+        try:
+            self._fichero = open(self.ruta, "r+b")
+            self._fichero.seek(0, 2)
+            if self._fichero.tell() == tamano:
+                return
+            self._fichero.close()
+        except OSError:
+            pass
+        # Fichero nuevo o de otra capacidad: empezar vacío
+        self._fichero = open(self.ruta, "w+b")
+        self._fichero.write(bytes(tamano))
+        self._fichero.flush()
+
+    def _recuperar_escrito(self):
+        """Mayor secuencia válida del fichero (0 si no hay eventos)."""
+        escrito = 0
+        self._fichero.seek(0)
+        for posicion in range(self.capacidad):
+            secuencia, tipo, ms, dato, comprobacion = struct.unpack(REGISTRO, self._fichero.read(TAM_REGISTRO))
+            if (
+                secuencia
+                and (secuencia - 1) % self.capacidad == posicion
+                and comprobacion == _comprobacion(secuencia, tipo, ms, dato)
+            ):
+                escrito = max(escrito, secuencia)
+        return escrito
+
+    def _leer_enviado(self):
+        try:
+            with open(self.ruta_enviado, "rb") as f:
+                return struct.unpack("<I", f.read(4))[0]
+        except (OSError, ValueError, struct.error):
+            return 0
+
+    def anotar(self, tipo, ms, dato=0):
+        """Guarda un evento en la flash; si el buffer está lleno descarta el más antiguo."""
+        secuencia = self.escrito + 1
+        self._fichero.seek(((secuencia - 1) % self.capacidad) * TAM_REGISTRO)
+        self._fichero.write(struct.pack(
+            REGISTRO, secuencia, tipo, ms, dato, _comprobacion(secuencia, tipo, ms, dato)
+        ))
+        self._fichero.flush()
+        self.escrito = secuencia
+        if len(self) > self.capacidad:
+            self.enviado = self.escrito - self.capacidad
+            self.perdidos += 1
+
+    def pendientes(self, maximo):
+        """Hasta `maximo` eventos no enviados, del más antiguo al más reciente: [(tipo, ms, dato), ...]."""
+        eventos = []
+        for secuencia in range(self.enviado + 1, min(self.enviado + maximo, self.escrito) + 1):
+            self._fichero.seek(((secuencia - 1) % self.capacidad) * TAM_REGISTRO)
+            _, tipo, ms, dato, _ = struct.unpack(REGISTRO, self._fichero.read(TAM_REGISTRO))
+            eventos.append((tipo, ms, dato))
+        return eventos
+
+    def confirmar(self, cantidad):
+        """Marca como enviados los `cantidad` eventos más antiguos."""
+        self.enviado = min(self.enviado + cantidad, self.escrito)
+        with open(self.ruta_enviado, "wb") as f:
+            f.write(struct.pack("<I", self.enviado))
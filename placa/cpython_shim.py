@@ -0,0 +1,234 @@
+"""
+Sustitutos en CPython de los módulos de MicroPython que usa el firmware.
+
+Permiten ejecutar y probar en el PC buffer_eventos.py, enviador.py y los
+handlers de interrupción sin placa:
+
+    import sys
+    sys.path.insert(0, "placa")
+    import cpython_shim
+    cpython_shim.instalar()
+
+    from buffer_eventos import BufferEventos
+    from enviador import EnviadorLotes
+    import urequests
+    urequests.transporte = lambda url, datos, cabeceras: 503   # simular caída de la API
+
+instalar() registra en sys.modules los módulos machine, micropython, network,
+ntptime, urequests y ujson, y añade a time las funciones ticks_ms, ticks_us,
+ticks_add, ticks_diff y sleep_ms. Como en MicroPython, time.time() pasa a
+devolver segundos enteros desde el 1 de enero de 2000; la hora Unix de CPython
+sigue disponible en cpython_shim.time_unix(). desinstalar() lo deshace, y
+instalado() hace ambas cosas como contexto, para usarlo en pruebas que
+comparten proceso con código que usa time.time():
+
+    with cpython_shim.instalado():
+        ...
+
+avanzar(ms) adelanta los ticks y time.time() sin esperar, para probar
+esperas y reintentos.
+
+- machine.Pin guarda su valor; pin.simular(1) cambia el valor y llama al
+  handler registrado con irq() si hay un flanco del tipo indicado. Pin.pines
+  guarda el último Pin creado con cada número, para simular los sensores de
+  un programa de la placa que se ejecuta en otro hilo.
+- urequests.post() envía la petición con urllib, o llama a
+  urequests.transporte(url, datos, cabeceras) si se asigna: debe devolver el
+  código HTTP o lanzar una excepción.
+"""
+import json
+import sys
+import time
+import types
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from json import dumps
+
+# Segundos entre el epoch Unix y el de MicroPython (2000-01-01)
+UNIX_OFFSET = 946684800
+time_unix = time.time
+
+# ticks_ms y ticks_us de MicroPython (ESP32) son de 30 bits y dan la vuelta
+PERIODO_TICKS = 1 << 30
+FUNCIONES_TIME = ("time", "ticks_ms", "ticks_us", "ticks_add", "ticks_diff", "sleep_ms")
+MODULOS = ("machine", "micropython", "network", "ntptime", "urequests", "ujson")
+
+# Segundos que avanzar() ha adelantado el reloj simulado
+_adelanto = 0.0
+# Valores de time y sys.modules anteriores a instalar(), para desinstalar()
+_originales = {}
+_AUSENTE = object()
+
+
+def avanzar(ms):
+    """Adelanta los ticks y time.time() simulados `ms` milisegundos."""
+    global _adelanto
+    _adelanto += ms / 1000
+
+
+def _monotonic():
+    return time.monotonic() + _adelanto
+
+
+def _ticks_ms():
+    return int(_monotonic() * 1000) & (PERIODO_TICKS - 1)
+
+
+def _ticks_us():
+    return int(_monotonic() * 1000000) & (PERIODO_TICKS - 1)
+
+
+def _ticks_add(ticks, delta):
+    return (ticks + delta) & (PERIODO_TICKS - 1)
+
+
+def _ticks_diff(fin, inicio):
+    mitad = PERIODO_TICKS // 2
+    return ((fin - inicio + mitad) & (PERIODO_TICKS - 1)) - mitad
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+    pines = {}
+
+    def __init__(self, numero, modo=IN, pull=None, value=0):
+        Pin.pines[numero] = self
+        self.numero = numero
+        self.modo = modo
+        self._valor = value
+        self._handler = None
+        self._trigger = 0
+
+    def value(self, valor=None):
+        if valor is None:
+            return self._valor
+        self._valor = 1 if valor else 0
+
+    def irq(self, trigger=IRQ_RISING | IRQ_FALLING, handler=None):
+        self._trigger = trigger
+        self._handler = handler
+
+    def simular(self, valor):
+        """Cambia el valor de la entrada y ejecuta el handler si el flanco lo dispara."""
+        anterior, self._valor = self._valor, 1 if valor else 0
+        if self._handler is None or anterior == self._valor:
+            return
+        flanco = self.IRQ_RISING if self._valor else self.IRQ_FALLING
+        if self._trigger & flanco:
+            self._handler(self)
+
+
+class Respuesta:
+    def __init__(self, status_code, contenido=b""):
+        self.status_code = status_code
+        self.content = contenido
+        self.text = contenido.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+
+def _post(url, data=None, json=None, headers=None):
+    modulo = sys.modules["urequests"]
+    if json is not None:
+        data = dumps(json)
+    if isinstance(data, str):
+        data = data.encode()
+    cabeceras = headers or {}
+    if modulo.transporte is not None:
+        return Respuesta(modulo.transporte(url, data, cabeceras))
+    peticion = urllib.request.Request(url, data=data, headers=cabeceras, method="POST")
+    try:
+        with urllib.request.urlopen(peticion, timeout=10) as r:
+            return Respuesta(r.status, r.read())
+    except urllib.error.HTTPError as e:
+        return Respuesta(e.code, e.read())
+
+
+class _WLAN:
+    def __init__(self, interfaz):
+        self.interfaz = interfaz
+        self._activa = False
+
+    def active(self, activa=None):
+        if activa is None:
+            return self._activa
+        self._activa = activa
+
+    def connect(self, ssid, clave):
+        pass
+
+    def isconnected(self):
+        return True
+
+
+def _modulo(nombre, **atributos):
+    modulo = types.ModuleType(nombre)
+    modulo.__dict__.update(atributos)
+    sys.modules[nombre] = modulo
+    return modulo
+
+
+def instalar():
+    """Registra los módulos de MicroPython sustitutos y extiende time."""
+    if _originales:
+        return
+    for nombre in FUNCIONES_TIME:
+        _originales["time." + nombre] = getattr(time, nombre, _AUSENTE)
+    for nombre in MODULOS:
+        _originales[nombre] = sys.modules.get(nombre, _AUSENTE)
+
+    time.time = lambda: int(time_unix() + _adelanto) - UNIX_OFFSET
+    time.ticks_ms = _ticks_ms
+    time.ticks_us = _ticks_us
+    time.ticks_add = _ticks_add
+    time.ticks_diff = _ticks_diff
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+
+    _modulo("machine", Pin=Pin)
+    _modulo(
+        "micropython",
+        alloc_emergency_exception_buf=lambda tamano: None,
+        schedule=lambda funcion, argumento: funcion(argumento),
+        const=lambda valor: valor
+    )
+    _modulo("network", STA_IF=0, AP_IF=1, WLAN=_WLAN)
+    _modulo("ntptime", settime=lambda: None)
+    _modulo("urequests", post=_post, Response=Respuesta, transporte=None)
+    sys.modules["ujson"] = json
+
+
+def desinstalar():
+    """Deshace instalar(): restaura time y los módulos de sys.modules."""
+    global _adelanto
+    for clave, valor in _originales.items():
+        if clave.startswith("time."):
+            if valor is _AUSENTE:
+                delattr(time, clave[5:])
+            else:
+                setattr(time, clave[5:], valor)
+        elif valor is _AUSENTE:
+            sys.modules.pop(clave, None)
+        else:
+            sys.modules[clave] = valor
+    _originales.clear()
+    _adelanto = 0.0
+
+
+@contextmanager
+def instalado():
+    """Contexto con los sustitutos instalados; al salir se deshace instalar()."""
+    instalar()
+    try:
+        yield
+    finally:
+        desinstalar()
@@ -1,13 +1,27 @@
 #--------DETECTOR 2----------------------
+# Requiere en la placa buffer_eventos.py y enviador.py.
+#
+# El flanco del sensor se captura por interrupción (ColaIRQ), de modo que un
+# POST lento no hace perder vehículos. El bucle confirma cada flanco, lo guarda
+# con su timestamp en la flash (BufferEventos) y EnviadorLotes lo envía en lotes
+# a /mediciones/batch, con reintentos y espera creciente si falla la red.
+# Los eventos llevan el nombre de la placa (PLACA) y EnviadorLatidos envía
+# latidos a /relojes/latido para que la API corrija el desfase de su reloj.
 from machine import Pin
 import time
+import micropython
 import network
-import ujson
-import urequests
 import ntptime
 
-url_servicio="https://radarpythonapi.onrender.com/mediciones/"
+from buffer_eventos import ColaIRQ, BufferEventos
+from enviador import EnviadorLotes, EnviadorLatidos
+
+url_servicio="https://radarpythonapi.onrender.com/mediciones/batch"
+url_latido="https://radarpythonapi.onrender.com/relojes/latido"
 UNIX_OFFSET = 946684800
+DETECTOR = 2
+PLACA = "detector2"
+micropython.alloc_emergency_exception_buf(100)
 
 print("Conectando a la wifi", end="")
 sta_if = network.WLAN(network.STA_IF)
@@ -23,9 +37,11 @@ ntptime.settime()
 epoch_base = time.time() + UNIX_OFFSET
 ticks_base = time.ticks_ms()
 
-def epoch_unix_ms():
-    """Timestamp Unix en milisegundos (entero, sin pérdida de precisión)."""
-    return (epoch_base * 1000) + time.ticks_diff(time.ticks_ms(), ticks_base)
+def epoch_unix_ms(ticks=None):
+    """Timestamp Unix en milisegundos (entero) del instante `ticks` (por defecto, ahora)."""
+    if ticks is None:
+        ticks = time.ticks_ms()
+    return (epoch_base * 1000) + time.ticks_diff(ticks, ticks_base)
 
 
 # ---------------- SENSOR ----------------
@@ -35,37 +51,39 @@ sensor = Pin(motion_pin, Pin.IN)   # SIN PULL_UP
 COOLDOWN_MS = 4000      # tiempo mínimo entre eventos
 CONFIRM_MS = 50         # validación anti-ruido
 
-last_event = 0
-armed = True
-# ---------------------------------------
-
-while True:
-    val = sensor.value()
+last_event = time.ticks_add(time.ticks_ms(), -COOLDOWN_MS)
+flancos = ColaIRQ()
+buffer = BufferEventos("eventos.bin")
+enviador = EnviadorLotes(url_servicio, buffer, placa=PLACA)
+latidos = EnviadorLatidos(url_latido, PLACA, epoch_unix_ms)
 
-    # Detección
-    if val == 1 and armed:
-        time.sleep_ms(CONFIRM_MS)
-        if sensor.value() == 1:
-            now = time.ticks_ms()
-            if time.ticks_diff(now, last_event) > COOLDOWN_MS:
-                last_event = now
-                armed = False
+def motion_handler(pin):
+    global last_event
+    now = time.ticks_ms()
+    if time.ticks_diff(now, last_event) > COOLDOWN_MS:
+        last_event = now
+        flancos.poner(DETECTOR, now)
 
-                datos = {"detector2": epoch_unix_ms()}
-                print("Medición válida:", datos["detector2"])
+sensor.irq(trigger=Pin.IRQ_RISING, handler=motion_handler)
+# ---------------------------------------
 
-                try:
-                    r = urequests.post(
-                        url_servicio,
-                        data=ujson.dumps(datos),
-                        headers={"Content-Type": "application/json"}
-                    )
-                    r.close()
-                except Exception as e:
-                    print("Error enviando:", e)
+if len(buffer):
+    print("Eventos pendientes de enviar:", len(buffer))
 
-    # Rearme cuando el sensor vuelve a reposo
-    if val == 0:
-        armed = True
+while True:
+    flanco = flancos.primero()
+    if flanco is not None:
+        tipo, ticks = flanco
+        retraso = time.ticks_diff(time.ticks_ms(), ticks)
+        if retraso >= CONFIRM_MS:
+            flancos.quitar()
+            # Validación anti-ruido: el sensor sigue activo tras CONFIRM_MS. Si el
+            # bucle llegó tarde (estaba enviando) ya no se puede comprobar y se acepta
+            if sensor.value() == 1 or retraso > 2 * CONFIRM_MS:
+                ms = epoch_unix_ms(ticks)
+                buffer.anotar(tipo, ms)
+                print("Medición válida:", ms)
 
-    time.sleep_ms(20)
\ No newline at end of file
+    enviador.atender()
+    latidos.atender()
+    time.sleep_ms(10)
@@ -0,0 +1,139 @@
+#--------ENVIADOR DE LOTES----------------------
+# Vacía el BufferEventos hacia POST /mediciones/batch de la API.
+#
+# atender() se llama en cada vuelta del bucle principal y solo envía cuando
+# toca: cuando hay un lote completo o el evento más antiguo lleva ESPERA_LOTE_MS
+# esperando, y no se está en la espera tras un fallo. Tras cada fallo la espera
+# se duplica (hasta BACKOFF_MAX_MS); los eventos siguen en la flash y se
+# reenvían en el siguiente intento.
+#
+# EnviadorLatidos envía cada INTERVALO_LATIDO_MS a POST /relojes/latido el
+# ticks_ms y la hora de la placa, con los que la API estima el desfase de su
+# reloj y corrige los eventos que llevan "placa". Los latidos no se guardan: si
+# uno falla, se envía el siguiente.
+import time
+import ujson
+import urequests
+
+from buffer_eventos import TIPO_MEDICION
+
+TAMANO_LOTE = 20
+ESPERA_LOTE_MS = 1000
+BACKOFF_MIN_MS = 1000
+BACKOFF_MAX_MS = 60000
+INTERVALO_LATIDO_MS = 30000
+
+
+class EnviadorLotes:
+    def __init__(
+        self,
+        url,
+        buffer,
+        carril=None,
+        placa=None,
+        tamano_lote=TAMANO_LOTE,
+        espera_lote_ms=ESPERA_LOTE_MS,
+        backoff_min_ms=BACKOFF_MIN_MS,
+        backoff_max_ms=BACKOFF_MAX_MS
+    ):
+        self.url = url
+        self.buffer = buffer
+        self.carril = carril
+        self.placa = placa
+        self.tamano_lote = tamano_lote
+        self.espera_lote_ms = espera_lote_ms
+        self.backoff_min_ms = backoff_min_ms
+        self.backoff_max_ms = backoff_max_ms
+        self.backoff_ms = 0
+        self._proximo_intento = time.ticks_ms()
+        self._pendiente_desde = None
+        self.enviados = 0
+        self.fallos = 0
+
+    def _cuerpo(self, eventos):
+        cuerpo = []
+        for tipo, ms, dato in eventos:
+            if tipo == TIPO_MEDICION:
+                # Medición completa: instante del detector1 y tiempo recorrido en segundos
+                evento = {"detector1": ms, "tiempo_recorrido": dato / 1000000}
+            else:
+                evento = {"detector%d" % tipo: ms}
+            if self.carril:
+                evento["carril"] = self.carril
+            if self.placa:
+                evento["placa"] = self.placa
+            cuerpo.append(evento)
+        return ujson.dumps(cuerpo)
+
+    def atender(self):
+        """Envía un lote si toca. Devuelve True si se envió alguno."""
+        if not len(self.buffer):
+            self._pendiente_desde = None
+            return False
+
+        ahora = time.ticks_ms()
+        if self._pendiente_desde is None:
+            self._pendiente_desde = ahora
+        if time.ticks_diff(self._proximo_intento, ahora) > 0:
+            return False
+        if (
+            len(self.buffer) < self.tamano_lote
+            and time.ticks_diff(ahora, self._pendiente_desde) < self.espera_lote_ms
+        ):
+            return False
+
+        eventos = self.buffer.pendientes(self.tamano_lote)
+        try:
+            r = urequests.post(
+                self.url,
+                data=self._cuerpo(eventos),
+                headers={"Content-Type": "application/json"}
+            )
+            codigo = r.status_code
+            r.close()
+        except Exception as e:
+            print("Error enviando:", e)
+            codigo = None
+
+        if codigo is not None and 200 <= codigo < 300:
+            self.buffer.confirmar(len(eventos))
+            self.enviados += len(eventos)
+            self.backoff_ms = 0
+            self._pendiente_desde = time.ticks_ms() if len(self.buffer) else None
+            return True
+
+        if codigo is not None:
+            print("Lote rechazado:", codigo)
+        self.fallos += 1
+        self.backoff_ms = min(max(self.backoff_ms * 2, self.backoff_min_ms), self.backoff_max_ms)
+        self._proximo_intento = time.ticks_add(time.ticks_ms(), self.backoff_ms)
+        return False
+
+
+class EnviadorLatidos:
+    def __init__(self, url, placa, epoch_ms, intervalo_ms=INTERVALO_LATIDO_MS):
+        # epoch_ms(ticks): hora Unix en ms de la placa en el instante ticks_ms
+        self.url = url
+        self.placa = placa
+        self.epoch_ms = epoch_ms
+        self.intervalo_ms = intervalo_ms
+        self._proximo = time.ticks_ms()
+
+    def atender(self):
+        """Envía un latido si toca. Devuelve True si la API lo recibió."""
+        ahora = time.ticks_ms()
+        if time.ticks_diff(self._proximo, ahora) > 0:
+            return False
+        self._proximo = time.ticks_add(ahora, self.intervalo_ms)
+        try:
+            r = urequests.post(
+                self.url,
+                data=ujson.dumps({"placa": self.placa, "ticks": ahora, "epoch": self.epoch_ms(ahora)}),
+                headers={"Content-Type": "application/json"}
+            )
+            codigo = r.status_code
+            r.close()
+        except Exception as e:
+            print("Error enviando latido:", e)
+            return False
+        return 200 <= codigo < 300
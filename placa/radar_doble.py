@@ -0,0 +1,137 @@
+#--------RADAR DE UNA PLACA (DOS SENSORES)----------------------
+# Requiere en la placa buffer_eventos.py y enviador.py.
+#
+# Una sola placa lee los dos sensores por interrupción (como motion_handler en
+# main.py) y mide el paso entre ellos con ticks_us y time.ticks_diff, sin
+# depender de la hora de dos placas distintas ni de la red. Cada vehículo se
+# envía como una única medición completa ({"detector1": ms, "tiempo_recorrido":
+# segundos}) a /mediciones/batch, que la registra sin emparejar eventos.
+# La velocidad la calcula la API con la distancia_sensores configurada, que
+# debe ser la separación real entre los dos sensores de la placa.
+#
+# Varios vehículos pueden estar entre los sensores a la vez: cada flanco del
+# sensor 2 se empareja con el paso más antiguo del sensor 1 (FIFO). Los pasos
+# del sensor 1 sin sensor 2 en TIEMPO_MAX_MS se descartan en cada vuelta del
+# bucle. Su antigüedad se mide con ticks_ms: las diferencias de ticks_us solo
+# son válidas durante unos 537 s, y un paso suelto tras un rato sin tráfico
+# se emparejaría con el siguiente vehículo y desplazaría todos los pares.
+from machine import Pin
+import time
+import micropython
+import network
+import ntptime
+
+from buffer_eventos import ColaIRQ, BufferEventos, TIPO_MEDICION
+from enviador import EnviadorLotes
+
+url_servicio="https://radarpythonapi.onrender.com/mediciones/batch"
+UNIX_OFFSET = 946684800
+micropython.alloc_emergency_exception_buf(100)
+
+print("Conectando a la wifi", end="")
+sta_if = network.WLAN(network.STA_IF)
+sta_if.active(True)
+sta_if.connect('Wokwi-GUEST', '')
+while not sta_if.isconnected():
+    print(".", end="")
+    time.sleep(0.1)
+print(" Conectada!")
+
+ntptime.settime()
+
+epoch_base = time.time() + UNIX_OFFSET
+ticks_base = time.ticks_ms()
+
+def epoch_unix_ms():
+    """Timestamp Unix en milisegundos (entero, sin pérdida de precisión)."""
+    return (epoch_base * 1000) + time.ticks_diff(time.ticks_ms(), ticks_base)
+
+
+# ---------------- SENSORES ----------------
+sensor1 = Pin(12, Pin.IN)   # SIN PULL_UP
+sensor2 = Pin(14, Pin.IN)
+
+COOLDOWN_MS = 1500      # tiempo mínimo entre eventos del mismo sensor
+CONFIRM_MS = 50         # validación anti-ruido
+TIEMPO_MAX_MS = 60000   # paso del sensor 1 sin sensor 2: se descarta
+
+flancos = {1: ColaIRQ(), 2: ColaIRQ()}
+ultimo_flanco = {
+    1: time.ticks_add(time.ticks_us(), -COOLDOWN_MS * 1000),
+    2: time.ticks_add(time.ticks_us(), -COOLDOWN_MS * 1000),
+}
+sensores = {1: sensor1, 2: sensor2}
+pasos = []    # (ticks_us, ticks_ms) de los pasos por el sensor 1 que esperan al sensor 2
+buffer = BufferEventos("mediciones.bin")
+enviador = EnviadorLotes(url_servicio, buffer)
+
+def apuntar(numero):
+    now = time.ticks_us()
+    if time.ticks_diff(now, ultimo_flanco[numero]) > COOLDOWN_MS * 1000:
+        ultimo_flanco[numero] = now
+        flancos[numero].poner(numero, now)
+
+def motion_handler1(pin):
+    apuntar(1)
+
+def motion_handler2(pin):
+    apuntar(2)
+
+sensor1.irq(trigger=Pin.IRQ_RISING, handler=motion_handler1)
+sensor2.irq(trigger=Pin.IRQ_RISING, handler=motion_handler2)
+# ------------------------------------------
+
+def siguiente_flanco():
+    """(sensor, ticks_us) del flanco más antiguo de los dos sensores, o None."""
+    primero = None
+    for numero in (1, 2):
+        flanco = flancos[numero].primero()
+        if flanco is not None and (primero is None or time.ticks_diff(flanco[1], primero[1]) < 0):
+            primero = flanco
+    return primero
+
+def descartar_antiguos():
+    """Descarta los pasos del sensor 1 que llevan más de TIEMPO_MAX_MS sin sensor 2."""
+    ahora = time.ticks_ms()
+    while pasos and time.ticks_diff(ahora, pasos[0][1]) > TIEMPO_MAX_MS:
+        pasos.pop(0)
+        print("Paso por el sensor 1 sin sensor 2: descartado")
+
+def procesar(numero, ticks):
+    if numero == 1:
+        # El flanco tiene como mucho unos segundos: su diferencia en ticks_us es válida
+        ticks_ms = time.ticks_add(time.ticks_ms(), -(time.ticks_diff(time.ticks_us(), ticks) // 1000))
+        pasos.append((ticks, ticks_ms))
+        return
+    descartar_antiguos()
+    if not pasos:
+        print("Sensor 2 sin paso por el sensor 1: ignorado")
+        return
+    inicio, inicio_ms = pasos.pop(0)
+    tiempo_us = time.ticks_diff(ticks, inicio)
+    if tiempo_us <= 0:
+        print("Tiempo entre sensores no válido: ignorado")
+        return
+    # Instante del sensor 1 en epoch ms, a partir de lo que ha pasado desde entonces
+    ms = epoch_unix_ms() - time.ticks_diff(time.ticks_ms(), inicio_ms)
+    buffer.anotar(TIPO_MEDICION, ms, tiempo_us)
+    print("Medición válida:", ms, tiempo_us / 1000000, "s")
+
+if len(buffer):
+    print("Mediciones pendientes de enviar:", len(buffer))
+
+while True:
+    flanco = siguiente_flanco()
+    if flanco is not None:
+        numero, ticks = flanco
+        retraso = time.ticks_diff(time.ticks_us(), ticks)
+        if retraso >= CONFIRM_MS * 1000:
+            flancos[numero].quitar()
+            # Validación anti-ruido como en detector1.py: el sensor sigue activo
+            # tras CONFIRM_MS, salvo que el bucle llegara tarde (estaba enviando)
+            if sensores[numero].value() == 1 or retraso > 2 * CONFIRM_MS * 1000:
+                procesar(numero, ticks)
+
+    descartar_antiguos()
+    enviador.atender()
+    time.sleep_ms(5)
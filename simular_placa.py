@@ -1,24 +1,49 @@
 """
-Simulador de placa ESP32 para pruebas locales.
-Envia mediciones automaticas a la API simulando el paso de objetos por los sensores.
+Simulador de placa ESP32 y generador de carga para la API.
+
+Modo demostracion (por defecto): envia mediciones de una en una, como la placa,
+con una espera real entre el sensor 1 y el sensor 2.
+
+Modo carga (--carga): simula muchos carriles a la vez. Los vehiculos de cada
+carril llegan segun un proceso de Poisson (--tasa vehiculos/s por carril) con
+velocidades de una distribucion normal, y cada paso genera su detector1 y su
+detector2 con los timestamps correspondientes. Los eventos se envian en su
+instante programado sin esperar a las respuestas anteriores (carga de lazo
+abierto), de uno en uno (POST /mediciones/) o agrupados como una pasarela
+(--modo lote, POST /mediciones/batch). La latencia se mide desde el instante
+programado, de modo que incluye las esperas si la API no da abasto. Al
+terminar escribe en la salida estandar un JSON con el rendimiento, las
+latencias p50/p95/p99 y las tasas de error: de peticiones (fallidas entre
+enviadas) y de eventos (rechazados por la API entre enviados).
 
 Uso:
     python simular_placa.py [--url URL] [--intervalo SEGUNDOS] [--cantidad N]
+    python simular_placa.py --carga [--carriles N] [--tasa V] [--duracion S] [--modo unico|lote]
 
 Ejemplos:
     python simular_placa.py                          # Simula 5 mediciones con intervalos aleatorios
     python simular_placa.py --cantidad 10            # Simula 10 mediciones
     python simular_placa.py --intervalo 3            # Intervalo fijo de 3 segundos entre sensores
     python simular_placa.py --url http://localhost:8081/mediciones/  # URL personalizada
+    python simular_placa.py --carga --carriles 50 --tasa 0.5 --duracion 60
+    python simular_placa.py --carga --modo lote --tamano-lote 200 --salida carga.json
 """
 
-import requests
-import time
-import random
 import argparse
+import asyncio
+import heapq
+import json
+import math
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import httpx
 
 
-def simular_medicion(api_url: str, intervalo: float = None):
+def simular_medicion(cliente: httpx.Client, api_url: str, intervalo: float = None, carril: str = "principal"):
     """Simula una medicion completa (sensor 1 + sensor 2)."""
 
     print("\n" + "=" * 50)
@@ -26,7 +51,7 @@ def simular_medicion(api_url: str, intervalo: float = None):
     # Sensor 1
     print("Sensor 1 activado...")
     try:
-        response = requests.post(api_url, timeout=10)
+        response = cliente.post(api_url, json={"detector1": datetime.now().isoformat(), "carril": carril})
         data = response.json()
         print(f"  -> {data.get('mensaje', 'OK')}")
     except Exception as e:
@@ -43,12 +68,12 @@ def simular_medicion(api_url: str, intervalo: float = None):
     # Sensor 2
     print("Sensor 2 activado...")
     try:
-        response = requests.post(api_url, timeout=10)
+        response = cliente.post(api_url, json={"detector2": datetime.now().isoformat(), "carril": carril})
         data = response.json()
 
-        if 'velocidad_kmh' in data and data['velocidad_kmh']:
+        if data.get('velocidad_kmh'):
             velocidad = data['velocidad_kmh']
-            tiempo = data.get('tiempo_segundos', intervalo)
+            tiempo = data.get('tiempo_recorrido', intervalo)
 
             # Determinar si es exceso (asumiendo limite de 50 km/h por defecto)
             exceso = " ** EXCESO **" if velocidad > 50 else ""
@@ -64,9 +89,214 @@ def simular_medicion(api_url: str, intervalo: float = None):
         return False
 
 
-def main():
+def ejecutar_demostracion(args):
+    print("=" * 50)
+    print("SIMULADOR DE PLACA ESP32")
+    print("=" * 50)
+    print(f"URL API: {args.url}")
+    print(f"Mediciones a simular: {args.cantidad}")
+    print(f"Intervalo entre sensores: {'aleatorio' if args.intervalo is None else f'{args.intervalo}s'}")
+    print(f"Pausa entre mediciones: {args.pausa}s")
+    print("\nPresiona Ctrl+C para detener\n")
+
+    try:
+        exitosas = 0
+        with httpx.Client(timeout=args.timeout) as cliente:
+            for i in range(args.cantidad):
+                print(f"\n--- Medicion {i + 1}/{args.cantidad} ---")
+
+                if simular_medicion(cliente, args.url, args.intervalo, args.carril):
+                    exitosas += 1
+
+                if i < args.cantidad - 1:
+                    print(f"\nEsperando {args.pausa}s antes de siguiente medicion...")
+                    time.sleep(args.pausa)
+
+        print("\n" + "=" * 50)
+        print(f"RESUMEN: {exitosas}/{args.cantidad} mediciones exitosas")
+        print("=" * 50)
+
+    except KeyboardInterrupt:
+        print("\n\nSimulacion detenida por el usuario")
+
+
+# --- Generador de carga ---
+
+def generar_eventos(args) -> list:
+    """
+    Programa los eventos de todos los carriles durante la duracion de la prueba.
+
+    Retorno:
+    - list: Tuplas (segundos desde el inicio, carril, "detector1"|"detector2"),
+      ordenadas por tiempo.
+    """
+    carriles = []
+    for numero in range(args.carriles):
+        carril = f"carril-{numero + 1}"
+        llegadas, salidas = [], []
+        t = random.expovariate(args.tasa)
+        ultima_salida = 0.0
+        while t < args.duracion:
+            velocidad = max(random.gauss(args.velocidad_media, args.velocidad_desviacion), args.velocidad_minima)
+            # Sin adelantamientos: el orden de salida es el de llegada (emparejamiento FIFO)
+            salida = max(t + args.distancia / (velocidad / 3.6), ultima_salida + 0.001)
+            llegadas.append((t, carril, "detector1"))
+            salidas.append((salida, carril, "detector2"))
+            ultima_salida = salida
+            t += random.expovariate(args.tasa)
+        carriles.append(heapq.merge(llegadas, salidas))
+    return list(heapq.merge(*carriles))
+
+
+def percentil(valores: list, q: float):
+    """Percentil por el metodo del rango mas cercano sobre una lista ordenada."""
+    if not valores:
+        return None
+    return valores[min(len(valores) - 1, max(0, math.ceil(q * len(valores)) - 1))]
+
+
+class Metricas:
+    """Latencias, estados y errores de las peticiones de la prueba."""
+
+    def __init__(self):
+        self.latencias = []
+        self.peticiones = 0
+        self.eventos = 0
+        self.estados = Counter()
+        self.errores = Counter()
+
+    def registrar(self, programado: float, eventos: int, respuesta=None, error: str = None):
+        self.latencias.append((time.perf_counter() - programado) * 1000)
+        self.peticiones += 1
+        self.eventos += eventos
+        if error is not None:
+            self.errores[error] += 1
+            return
+        if respuesta.status_code >= 400:
+            self.errores[f"http_{respuesta.status_code}"] += 1
+            return
+        try:
+            datos = respuesta.json()
+        except ValueError:
+            self.errores["respuesta_no_json"] += 1
+            return
+
+        if "resultados" in datos:
+            estados = [resultado.get("estado") for resultado in datos["resultados"]]
+        elif "aceptados" in datos:
+            estados = ["aceptado"] * datos["aceptados"] + ["error"] * len(datos.get("rechazados", []))
+        elif "estado" in datos:
+            estados = [datos["estado"]]
+        else:
+            estados = ["completada" if datos.get("medicion_completa") else "pendiente"]
+        self.estados.update(estados)
+        if "error" in estados:
+            self.errores["api"] += estados.count("error")
+
+    def informe(self, args, duracion: float) -> dict:
+        latencias = sorted(self.latencias)
+        # Las peticiones fallidas (timeout, conexión, HTTP >= 400, respuesta no
+        # JSON) cuentan una vez cada una; "api" cuenta eventos rechazados
+        peticiones_fallidas = sum(n for error, n in self.errores.items() if error != "api")
+        return {
+            "configuracion": {
+                "url": args.url,
+                "modo": args.modo,
+                "carriles": args.carriles,
+                "tasa_por_carril": args.tasa,
+                "duracion_s": args.duracion,
+                "tamano_lote": args.tamano_lote if args.modo == "lote" else None,
+                "semilla": args.semilla,
+            },
+            "duracion_real_s": round(duracion, 3),
+            "peticiones": self.peticiones,
+            "eventos": self.eventos,
+            "rendimiento": {
+                "peticiones_s": round(self.peticiones / duracion, 2) if duracion else None,
+                "eventos_s": round(self.eventos / duracion, 2) if duracion else None,
+            },
+            "latencia_ms": {
+                "p50": percentil(latencias, 0.50),
+                "p95": percentil(latencias, 0.95),
+                "p99": percentil(latencias, 0.99),
+                "media": sum(latencias) / len(latencias) if latencias else None,
+                "max": latencias[-1] if latencias else None,
+            },
+            "estados": dict(self.estados),
+            "errores": dict(self.errores),
+            "tasa_error_peticiones": round(peticiones_fallidas / self.peticiones, 6) if self.peticiones else 0.0,
+            "tasa_error_eventos": round(self.errores["api"] / self.eventos, 6) if self.eventos else 0.0,
+        }
+
+
+async def enviar(cliente: httpx.AsyncClient, url: str, cuerpo, eventos: int, programado: float,
+                 metricas: Metricas, orden: asyncio.Lock):
+    """Envia una peticion respetando el orden de su carril (o de la pasarela) y la registra."""
+    async with orden:
+        try:
+            respuesta = await cliente.post(url, json=cuerpo)
+        except httpx.TimeoutException:
+            metricas.registrar(programado, eventos, error="timeout")
+        except httpx.HTTPError:
+            metricas.registrar(programado, eventos, error="conexion")
+        else:
+            metricas.registrar(programado, eventos, respuesta)
+
+
+async def ejecutar_carga(args) -> dict:
+    eventos = generar_eventos(args)
+    print(
+        f"Carga: {args.carriles} carriles, {len(eventos)} eventos en {args.duracion}s, modo {args.modo}",
+        file=sys.stderr
+    )
+    url_lote = args.url.rstrip("/") + "/batch"
+    metricas = Metricas()
+    tareas = set()
+    # Cada carril (o la pasarela en modo lote) envia sus eventos en orden
+    ordenes = {}
+    lote, limite_lote = [], None
+
+    def lanzar(url, cuerpo, n, programado, clave):
+        orden = ordenes.setdefault(clave, asyncio.Lock())
+        tarea = asyncio.create_task(enviar(cliente, url, cuerpo, n, programado, metricas, orden))
+        tareas.add(tarea)
+        tarea.add_done_callback(tareas.discard)
+
+    limites = httpx.Limits(max_connections=args.conexiones, max_keepalive_connections=args.conexiones)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limites) as cliente:
+        inicio_reloj = time.perf_counter()
+        inicio = datetime.now()
+        for segundo, carril, tipo in eventos:
+            # En modo lote, enviar el lote acumulado si vence antes del siguiente evento
+            if lote and limite_lote <= segundo:
+                await asyncio.sleep(max(0.0, inicio_reloj + limite_lote - time.perf_counter()))
+                lanzar(url_lote, lote, len(lote), inicio_reloj + limite_lote, "pasarela")
+                lote = []
+
+            await asyncio.sleep(max(0.0, inicio_reloj + segundo - time.perf_counter()))
+            evento = {tipo: (inicio + timedelta(seconds=segundo)).isoformat(), "carril": carril}
+            if args.modo == "unico":
+                lanzar(args.url, evento, 1, inicio_reloj + segundo, carril)
+                continue
+            if not lote:
+                limite_lote = segundo + args.intervalo_lote
+            lote.append(evento)
+            if len(lote) >= args.tamano_lote:
+                lanzar(url_lote, lote, len(lote), inicio_reloj + segundo, "pasarela")
+                lote = []
+
+        if lote:
+            lanzar(url_lote, lote, len(lote), time.perf_counter(), "pasarela")
+        if tareas:
+            await asyncio.wait(tareas)
+        duracion = time.perf_counter() - inicio_reloj
+
+    return metricas.informe(args, duracion)
+
+
+def parsear_argumentos():
     parser = argparse.ArgumentParser(
-        description="Simulador de placa ESP32 para pruebas"
+        description="Simulador de placa ESP32 y generador de carga para la API"
     )
     parser.add_argument(
         "--url",
@@ -91,36 +321,46 @@ def main():
         default=2.0,
         help="Pausa entre mediciones completas en segundos (default: 2)"
     )
+    parser.add_argument("--carril", default="principal", help="Carril del modo demostracion")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Timeout de cada peticion en segundos")
 
-    args = parser.parse_args()
-
-    print("=" * 50)
-    print("SIMULADOR DE PLACA ESP32")
-    print("=" * 50)
-    print(f"URL API: {args.url}")
-    print(f"Mediciones a simular: {args.cantidad}")
-    print(f"Intervalo entre sensores: {'aleatorio' if args.intervalo is None else f'{args.intervalo}s'}")
-    print(f"Pausa entre mediciones: {args.pausa}s")
-    print("\nPresiona Ctrl+C para detener\n")
-
-    try:
-        exitosas = 0
-        for i in range(args.cantidad):
-            print(f"\n--- Medicion {i + 1}/{args.cantidad} ---")
-
-            if simular_medicion(args.url, args.intervalo):
-                exitosas += 1
+    carga = parser.add_argument_group("modo carga")
+    carga.add_argument("--carga", action="store_true", help="Ejecutar la prueba de carga")
+    carga.add_argument("--carriles", type=int, default=20, help="Carriles simulados (default: 20)")
+    carga.add_argument("--tasa", type=float, default=0.5, help="Vehiculos por segundo y carril (default: 0.5)")
+    carga.add_argument("--duracion", type=float, default=30.0, help="Segundos de llegadas simuladas (default: 30)")
+    carga.add_argument("--distancia", type=float, default=100.0, help="Metros entre sensores (default: 100)")
+    carga.add_argument("--velocidad-media", type=float, default=50.0, help="km/h (default: 50)")
+    carga.add_argument("--velocidad-desviacion", type=float, default=12.0, help="km/h (default: 12)")
+    carga.add_argument("--velocidad-minima", type=float, default=5.0, help="km/h (default: 5)")
+    carga.add_argument(
+        "--modo", choices=("unico", "lote"), default="unico",
+        help="unico: un POST por evento; lote: POST /mediciones/batch (default: unico)"
+    )
+    carga.add_argument("--tamano-lote", type=int, default=100, help="Eventos maximos por lote (default: 100)")
+    carga.add_argument(
+        "--intervalo-lote", type=float, default=1.0,
+        help="Segundos maximos que un evento espera en el lote (default: 1)"
+    )
+    carga.add_argument("--conexiones", type=int, default=100, help="Conexiones HTTP simultaneas (default: 100)")
+    carga.add_argument("--semilla", type=int, default=None, help="Semilla aleatoria para repetir la prueba")
+    carga.add_argument("--salida", help="Fichero donde guardar tambien el informe JSON")
+    return parser.parse_args()
 
-            if i < args.cantidad - 1:
-                print(f"\nEsperando {args.pausa}s antes de siguiente medicion...")
-                time.sleep(args.pausa)
 
-        print("\n" + "=" * 50)
-        print(f"RESUMEN: {exitosas}/{args.cantidad} mediciones exitosas")
-        print("=" * 50)
+def main():
+    args = parsear_argumentos()
+    if not args.carga:
+        ejecutar_demostracion(args)
+        return
 
-    except KeyboardInterrupt:
-        print("\n\nSimulacion detenida por el usuario")
+    random.seed(args.semilla)
+    informe = asyncio.run(ejecutar_carga(args))
+    texto = json.dumps(informe, indent=2)
+    print(texto)
+    if args.salida:
+        with open(args.salida, "w") as fichero:
+            fichero.write(texto + "\n")
 
 
 if __name__ == "__main__":
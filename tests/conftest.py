@@ -0,0 +1,63 @@
+"""
+Pruebas de comportamiento de la API.
+
+Ejecutan api/main.py en el propio proceso con TestClient contra SQLite en un
+fichero temporal. Cada prueba parte de las tablas de mediciones y estadísticas
+vacías y del estado en memoria reconstruido como al arrancar.
+
+Uso (desde la raíz del repositorio):
+    pytest tests
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+pytest.importorskip("httpx")
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Los módulos de la API crean el engine al importarse: fijar el entorno antes
+_ruta = os.path.join(tempfile.mkdtemp(prefix="radar_tests_"), "tests.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_ruta}"
+os.environ["DB_ASYNC"] = "false"
+os.environ["INGESTA_DIFERIDA"] = "false"
+os.environ["ESTADO_COMPARTIDO"] = "memoria"
+os.environ["CACHE_RESPUESTAS_TTL"] = "0"
+os.environ["RETENCION_DIAS"] = "0"
+sys.path.insert(0, os.path.join(RAIZ, "api"))
+# almacen.py de la API ligera (main.py de la raíz), detrás de api/ para no tapar su main
+sys.path.append(RAIZ)
+
+
+@pytest.fixture(scope="session")
+def cliente():
+    """TestClient de la API sobre una base de datos vacía; ejecuta el arranque y el cierre de main.py."""
+    from fastapi.testclient import TestClient
+    from database import Base, engine
+
+    Base.metadata.drop_all(engine)
+    import main
+
+    with TestClient(main.app) as cliente:
+        yield cliente
+
+
+@pytest.fixture(autouse=True)
+def tablas_vacias(cliente):
+    """Vacía mediciones, estadísticas y series, y reconstruye el estado en memoria."""
+    from sqlalchemy import delete
+    from database import SessionLocal, engine
+    import models
+    from estadisticas import reconciliar
+    from ingesta import emparejador, estado
+
+    with engine.begin() as conn:
+        for modelo in (models.Medicion, models.EstadisticasDiarias, models.SerieVelocidad):
+            conn.execute(delete(modelo))
+    with SessionLocal() as db:
+        reconciliar(db, forzar=True)
+        emparejador.reconstruir(db)
+    estado.invalidar_lecturas()
@@ -0,0 +1,105 @@
+"""Almacén de la API ligera (almacen.py): estado proyectado en memoria y registro de mediciones."""
+
+import os
+
+import pytest
+
+from almacen import AlmacenEstado, RegistroMediciones
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "estado.bin")
+
+
+def test_estado_se_comparte_entre_procesos_y_persiste(ruta):
+    uno, otro = AlmacenEstado(ruta), AlmacenEstado(ruta)
+    try:
+        assert uno.nuevo
+        assert not otro.nuevo
+        uno.iniciar({"distancia_sensores": 50.0}, pendiente=None)
+        assert otro.config("distancia_sensores", 100.0) == 50.0
+        assert otro.config("limite_velocidad", 60.0) == 60.0
+
+        # El primer paso queda pendiente; el segundo, venga de quien venga, lo retira
+        assert uno.registrar_paso(1000.0) is None
+        assert otro.pendiente() == 1000.0
+        assert otro.registrar_paso(1002.5) == 1000.0
+        assert uno.pendiente() is None
+        otro.registrar_paso(2000.0)
+    finally:
+        uno.cerrar()
+        otro.cerrar()
+
+    reabierto = AlmacenEstado(ruta)
+    try:
+        assert not reabierto.nuevo
+        assert reabierto.pendiente() == 2000.0
+        reabierto.reiniciar()
+        assert reabierto.pendiente() is None
+    finally:
+        reabierto.cerrar()
+
+
+def test_escritura_interrumpida_no_bloquea_a_los_lectores(ruta):
+    almacen = AlmacenEstado(ruta)
+    try:
+        almacen.guardar_config("limite_velocidad", 40.0)
+        # Secuencia impar: un escritor murió a mitad de una escritura
+        secuencia = almacen.CABECERA.unpack_from(almacen._mm, 0)[1]
+        almacen.CABECERA.pack_into(almacen._mm, 0, almacen.MAGIC, secuencia + 1)
+        assert almacen.config("limite_velocidad", 50.0) == 40.0
+    finally:
+        almacen.cerrar()
+
+
+@pytest.fixture
+def registro(tmp_path):
+    registro = RegistroMediciones(str(tmp_path / "mediciones.bin"))
+    yield registro
+    registro.cerrar()
+
+
+def _anotar(registro: RegistroMediciones, timestamp: float, kmh: float) -> int:
+    return registro.anotar(timestamp, kmh / 3.6, kmh, 100.0, 360.0 / kmh)
+
+
+def test_registro_busca_por_fecha_y_recorre_en_ambos_sentidos(registro, monkeypatch):
+    monkeypatch.setattr(RegistroMediciones, "BLOQUE", 3)
+    ids = [_anotar(registro, 1000.0 + i * 10, 40.0 + i) for i in range(10)]
+    assert ids == list(range(1, 11))
+    assert registro.obtener(4).timestamp == 1030.0
+    assert registro.obtener(0) is None
+    assert registro.obtener(11) is None
+
+    inicio, fin = registro.rango(desde=1025.0, hasta=1060.0)
+    assert [m.id for m in registro.iterar(inicio, fin)] == [4, 5, 6]
+    assert [m.id for m in registro.iterar(0, len(registro), inverso=True)] == list(range(10, 0, -1))
+    assert registro.rango(desde=5000.0) == (10, 10)
+
+
+def test_registro_descarta_un_registro_incompleto_al_abrir(registro):
+    _anotar(registro, 1000.0, 50.0)
+    _anotar(registro, 1010.0, 70.0)
+    with open(registro.ruta, "ab") as fichero:
+        fichero.write(b"\x00" * (RegistroMediciones.REGISTRO.size // 2))
+
+    reabierto = RegistroMediciones(registro.ruta)
+    try:
+        assert len(reabierto) == 2
+        assert os.path.getsize(registro.ruta) == 2 * RegistroMediciones.REGISTRO.size
+        assert _anotar(reabierto, 1020.0, 90.0) == 3
+    finally:
+        reabierto.cerrar()
+
+
+def test_estadisticas_incrementales_del_registro(registro):
+    for kmh in (30.0, 50.0, 70.0):
+        _anotar(registro, 1000.0, kmh)
+    assert registro.estadisticas(umbral_exceso=60.0)["excesos"] == 1
+    _anotar(registro, 1030.0, 90.0)
+    assert registro.estadisticas(umbral_exceso=60.0) == {
+        "total": 4, "suma_kmh": 240.0, "maxima_kmh": 90.0, "minima_kmh": 30.0, "excesos": 2
+    }
+    # Otro umbral recalcula los excesos desde el principio
+    assert registro.estadisticas(umbral_exceso=80.0)["excesos"] == 1
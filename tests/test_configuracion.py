@@ -0,0 +1,22 @@
+"""Cambios de configuración y su visibilidad en las lecturas cacheadas."""
+
+from ingesta import estado
+
+
+def test_configuracion_se_guarda_antes_de_invalidar(cliente, monkeypatch):
+    vistos = []
+    invalidar = estado.invalidar_lecturas
+
+    def invalidar_anotando():
+        vistos.append(estado.config("limite_velocidad", None))
+        invalidar()
+
+    monkeypatch.setattr(estado, "invalidar_lecturas", invalidar_anotando)
+    original = cliente.get("/configuracion/limite_velocidad").json()["valor"]
+    try:
+        respuesta = cliente.put("/configuracion/limite_velocidad", json={"valor": "80"})
+        assert respuesta.status_code == 200
+        assert vistos == [80.0]
+        assert cliente.get("/dashboard/snapshot").json()["limite_velocidad"] == 80.0
+    finally:
+        cliente.put("/configuracion/limite_velocidad", json={"valor": original})
@@ -0,0 +1,54 @@
+"""GET /dashboard/snapshot: ETag, 304 y cambios tras escrituras."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from respuestas import CacheRespuestas
+
+INICIO = datetime(2026, 10, 18, 11, 0, 0)
+
+
+@pytest.fixture(params=[0, 30], ids=["sin_cache", "con_cache"])
+def snapshot(request, cliente, monkeypatch):
+    """GET /dashboard/snapshot con la caché de respuestas desactivada o con TTL de 30 s."""
+    monkeypatch.setattr(main, "cache_respuestas", CacheRespuestas(ttl=request.param))
+    return lambda **cabeceras: cliente.get("/dashboard/snapshot", headers=cabeceras)
+
+
+def test_etag_coincidente_responde_304(snapshot):
+    primera = snapshot()
+    assert primera.status_code == 200
+    etag = primera.headers["ETag"]
+
+    repetida = snapshot(**{"If-None-Match": etag})
+    assert repetida.status_code == 304
+    assert repetida.content == b""
+    assert repetida.headers["ETag"] == etag
+
+
+def test_ingesta_cambia_el_etag(cliente, snapshot):
+    etag = snapshot().headers["ETag"]
+    cliente.post("/mediciones/batch", json=[
+        {"detector1": INICIO.isoformat()},
+        {"detector2": (INICIO + timedelta(seconds=2)).isoformat()},
+    ])
+
+    despues = snapshot(**{"If-None-Match": etag})
+    assert despues.status_code == 200
+    assert despues.headers["ETag"] != etag
+    assert len(despues.json()["ultimas_mediciones"]) == 1
+
+
+def test_cambio_de_configuracion_cambia_el_etag(cliente, snapshot):
+    etag = snapshot().headers["ETag"]
+    original = cliente.get("/configuracion/limite_velocidad").json()["valor"]
+    try:
+        cliente.put("/configuracion/limite_velocidad", json={"valor": "75"})
+        despues = snapshot(**{"If-None-Match": etag})
+        assert despues.status_code == 200
+        assert despues.headers["ETag"] != etag
+        assert despues.json()["limite_velocidad"] == 75.0
+    finally:
+        cliente.put("/configuracion/limite_velocidad", json={"valor": original})
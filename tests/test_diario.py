@@ -0,0 +1,149 @@
+"""Diario de ingesta diferida: aplicación en segundo plano y eventos rechazados."""
+
+import json
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from database import SessionLocal
+import models
+import diario as modulo_diario
+from diario import DiarioIngesta
+from emparejamiento import Evento
+
+ORIGEN = datetime(2026, 10, 18, 11, 0, 0)
+
+
+def _paso(carril: str, segundo: int, tiempo: float = 2.0):
+    inicio = ORIGEN + timedelta(seconds=segundo)
+    return [
+        Evento("detector1", carril, inicio),
+        Evento("detector2", carril, inicio + timedelta(seconds=tiempo)),
+    ]
+
+
+def _completadas(carril: str) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(models.Medicion).where(
+            models.Medicion.carril == carril, models.Medicion.medicion_completa == True
+        ))
+
+
+def _esperar_aplicado(diario: DiarioIngesta, segundos: float = 5.0) -> None:
+    limite = time.monotonic() + segundos
+    while len(diario) and time.monotonic() < limite:
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def prefijo(tmp_path, monkeypatch):
+    monkeypatch.setattr(modulo_diario, "ESPERA_REINTENTO", 0.01)
+    return str(tmp_path / "ingesta")
+
+
+def test_evento_defectuoso_se_aparta_y_el_diario_sigue(cliente, prefijo, monkeypatch):
+    registrar_lote = modulo_diario.registrar_lote
+
+    def registrar_salvo_defectuosos(db, normalizados, sentencias_extra=()):
+        if any(evento.carril == "defectuoso" for evento in normalizados):
+            raise ValueError("evento defectuoso")
+        return registrar_lote(db, normalizados, sentencias_extra)
+
+    monkeypatch.setattr(modulo_diario, "registrar_lote", registrar_salvo_defectuosos)
+    diario = DiarioIngesta(prefijo)
+    diario.iniciar()
+    diario.anotar(_paso("norte", 0) + [Evento("detector1", "defectuoso", ORIGEN)] + _paso("norte", 10))
+    diario.detener()
+
+    assert _completadas("norte") == 2
+    assert diario.rechazados == 1
+    with open(f"{diario.ruta}.rechazados") as fichero:
+        rechazados = [json.loads(linea) for linea in fichero]
+    assert [r["evento"][:2] for r in rechazados] == [["detector1", "defectuoso"]]
+    assert "evento defectuoso" in rechazados[0]["error"]
+
+    # La posición aplicada incluye el evento rechazado: al reabrir no queda nada pendiente
+    reabierto = DiarioIngesta(prefijo)
+    reabierto.iniciar()
+    assert len(reabierto) == 0
+    reabierto.detener()
+
+
+def test_error_transitorio_reintenta_el_grupo(cliente, prefijo, monkeypatch):
+    from sqlalchemy.exc import OperationalError
+
+    registrar_lote = modulo_diario.registrar_lote
+    fallos = []
+
+    def registrar_tras_un_fallo(db, normalizados, sentencias_extra=()):
+        if not fallos:
+            fallos.append(len(normalizados))
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return registrar_lote(db, normalizados, sentencias_extra)
+
+    monkeypatch.setattr(modulo_diario, "registrar_lote", registrar_tras_un_fallo)
+    diario = DiarioIngesta(prefijo)
+    diario.iniciar()
+    diario.anotar(_paso("sur", 0))
+    _esperar_aplicado(diario)
+    diario.detener()
+
+    assert fallos
+    assert diario.rechazados == 0
+    assert _completadas("sur") == 1
+
+
+def test_timestamps_con_zona_del_diario_se_leen_en_hora_local():
+    evento = modulo_diario._decodificar(b'["detector1", "principal", "2026-10-18T11:00:00+00:00"]')
+    assert evento.timestamp.tzinfo is None
+    assert evento.timestamp == datetime.fromisoformat("2026-10-18T11:00:00+00:00").astimezone().replace(tzinfo=None)
+
+
+def test_eventos_sin_aplicar_se_recuperan_al_reabrir(cliente, prefijo, monkeypatch):
+    from sqlalchemy.exc import OperationalError
+
+    def sin_base_de_datos(db, normalizados, sentencias_extra=()):
+        raise OperationalError("INSERT", {}, Exception("database is locked"))
+
+    # Proceso que anota los eventos y se detiene sin llegar a aplicarlos
+    registrar_lote = modulo_diario.registrar_lote
+    monkeypatch.setattr(modulo_diario, "registrar_lote", sin_base_de_datos)
+    diario = DiarioIngesta(prefijo)
+    diario.iniciar()
+    diario.anotar(_paso("este", 0) + _paso("este", 10))
+    ruta = diario.ruta
+    diario.detener()
+    # ... y con una línea a medio escribir, que nunca se confirmó al cliente
+    with open(ruta, "ab") as fichero:
+        fichero.write(b'["detector1", "este", "2026-10-18T11:0')
+    assert _completadas("este") == 0
+
+    monkeypatch.setattr(modulo_diario, "registrar_lote", registrar_lote)
+    reabierto = DiarioIngesta(prefijo)
+    reabierto.iniciar()
+    assert reabierto.ruta == ruta
+    _esperar_aplicado(reabierto)
+    reabierto.detener()
+    assert _completadas("este") == 2
+    assert reabierto.rechazados == 0
+
+    # Una vez aplicados no se vuelven a aplicar
+    otra_vez = DiarioIngesta(prefijo)
+    otra_vez.iniciar()
+    assert len(otra_vez) == 0
+    otra_vez.detener()
+    assert _completadas("este") == 2
+
+
+def test_ruta_diferida_responde_el_mismo_error_que_la_sincrona(cliente):
+    import asyncio
+    from fastapi import Response
+    import rutas_diferidas
+
+    for datos in ({"detector1": "2026-10-18T11:00:00", "tiempo_recorrido": -1}, {"otro": 1}):
+        respuesta = Response()
+        diferida = asyncio.run(rutas_diferidas.registrar_medicion(respuesta, datos))
+        assert respuesta.status_code == 200
+        assert diferida == cliente.post("/mediciones/", json=datos).json()
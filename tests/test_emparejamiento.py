@@ -0,0 +1,104 @@
+"""Ingesta de eventos: emparejamiento FIFO, resultados y las versiones síncrona y async."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import DATABASE_URL, url_async
+from emparejamiento import Evento
+from ingesta import registrar_lote_async
+
+ORIGEN = datetime(2026, 10, 18, 11, 0, 0)
+
+
+def _ts(segundos: float) -> str:
+    return (ORIGEN + timedelta(seconds=segundos)).isoformat()
+
+
+def test_evento_unico_devuelve_medicion_o_mensaje(cliente):
+    pendiente = cliente.post("/mediciones/", json={"detector1": _ts(0)}).json()
+    assert pendiente["medicion_completa"] is False
+
+    invalido = cliente.post("/mediciones/", json={"detector2": _ts(-1)}).json()
+    assert invalido == {"mensaje": "Tiempo recorrido inválido", "estado": "error"}
+
+    completada = cliente.post("/mediciones/", json={"detector2": _ts(2)}).json()
+    assert completada["id"] == pendiente["id"]
+    assert completada["tiempo_recorrido"] == pytest.approx(2.0)
+
+    ignorado = cliente.post("/mediciones/", json={"detector2": _ts(3)}).json()
+    assert ignorado["estado"] == "ignorado"
+    assert cliente.post("/mediciones/", json={"otro": 1}).json()["estado"] == "error"
+    assert cliente.post("/mediciones/", json={"detector1": _ts(4), "tiempo_recorrido": -1}).json() == {
+        "mensaje": "Tiempo recorrido inválido", "estado": "error"
+    }
+
+
+def test_lote_async_usa_la_misma_logica(cliente):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+    async def registrar():
+        motor = create_async_engine(url_async(DATABASE_URL))
+        try:
+            async with AsyncSession(motor, expire_on_commit=False) as db:
+                return await registrar_lote_async(db, [
+                    Evento("detector1", "async", ORIGEN),
+                    Evento("detector2", "async", ORIGEN + timedelta(seconds=4)),
+                ])
+        finally:
+            await motor.dispose()
+
+    resultados = asyncio.run(registrar())
+    assert [r["estado"] for r in resultados] == ["pendiente", "completada"]
+    medicion = cliente.get(f"/mediciones/{resultados[1]['medicion'].id}").json()
+    assert medicion["tiempo_recorrido"] == pytest.approx(4.0)
+
+
+def test_varios_workers_completan_el_paso_mas_antiguo(cliente, monkeypatch):
+    from sqlalchemy import insert
+    from database import engine
+    import models
+    from ingesta import emparejador, estado
+
+    monkeypatch.setattr(estado, "compartido", True)
+    propio = cliente.post("/mediciones/", json={"detector1": _ts(10), "carril": "norte"}).json()
+    # Paso más antiguo iniciado por otro worker: está en la tabla, no en la memoria de este
+    with engine.begin() as conn:
+        ajeno = conn.execute(insert(models.Medicion).values(
+            timestamp=ORIGEN, distancia=100.0, carril="norte",
+            es_primera_medicion=True, medicion_completa=False
+        )).inserted_primary_key[0]
+    assert [p.id for p in emparejador.pendientes("norte")] == [propio["id"]]
+
+    primera = cliente.post("/mediciones/", json={"detector2": _ts(12), "carril": "norte"}).json()
+    segunda = cliente.post("/mediciones/", json={"detector2": _ts(13), "carril": "norte"}).json()
+    assert [primera["id"], segunda["id"]] == [ajeno, propio["id"]]
+    assert primera["tiempo_recorrido"] == pytest.approx(12.0)
+    assert segunda["tiempo_recorrido"] == pytest.approx(3.0)
+
+
+def test_fifo_por_carril_con_lotes_y_eventos_sueltos(cliente):
+    lote = cliente.post("/mediciones/batch", json=[
+        {"detector1": _ts(0), "carril": "norte"},
+        {"detector1": _ts(1), "carril": "sur"},
+        {"detector1": _ts(2), "carril": "norte"},
+        {"detector2": _ts(3), "carril": "sur"},
+    ]).json()
+    assert [r["estado"] for r in lote["resultados"]] == ["pendiente", "pendiente", "pendiente", "completada"]
+    norte_1, sur, norte_2 = (r["medicion"]["id"] for r in lote["resultados"][:3])
+    assert lote["resultados"][3]["medicion"]["id"] == sur
+
+    # Un evento suelto y otro lote completan los pasos del norte en orden de llegada
+    suelto = cliente.post("/mediciones/", json={"detector2": _ts(4), "carril": "norte"}).json()
+    assert suelto["id"] == norte_1
+    assert suelto["tiempo_recorrido"] == pytest.approx(4.0)
+
+    resto = cliente.post("/mediciones/batch", json=[
+        {"detector2": _ts(6), "carril": "sur"},
+        {"detector2": _ts(7), "carril": "norte"},
+    ]).json()["resultados"]
+    assert resto[0]["estado"] == "ignorado"
+    assert resto[1]["medicion"]["id"] == norte_2
+    assert resto[1]["medicion"]["tiempo_recorrido"] == pytest.approx(5.0)
@@ -0,0 +1,78 @@
+"""Estadísticas materializadas: acumulación en la ingesta y reconciliación por diferencias."""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, insert, update
+
+from database import SessionLocal, engine
+import models
+from estadisticas import ID_RESUMEN, leer_desviaciones, reconciliar, sentencias_corregir
+
+ORIGEN = datetime(2026, 10, 17, 11, 0, 0)
+
+
+def _paso(cliente, inicio: datetime, segundos: float):
+    cliente.post("/mediciones/batch", json=[
+        {"detector1": inicio.isoformat()},
+        {"detector2": (inicio + timedelta(seconds=segundos)).isoformat()},
+    ])
+
+
+def _sin_desviaciones() -> bool:
+    with SessionLocal() as db:
+        desviaciones = leer_desviaciones(db)
+    return all(calculado.coincide(guardado) for calculado, guardado in
+               [desviaciones.resumen, *desviaciones.dias.values()])
+
+
+def test_reconciliar_corrige_y_conserva_lo_acumulado_despues_de_leer(cliente):
+    _paso(cliente, ORIGEN, 2.0)
+    _paso(cliente, ORIGEN + timedelta(days=1), 4.0)
+    assert _sin_desviaciones()
+
+    # Desviaciones: resumen y un día alterados, un día que no existe en mediciones
+    with engine.begin() as conn:
+        conn.execute(update(models.EstadisticasResumen).where(models.EstadisticasResumen.id == ID_RESUMEN)
+                     .values(total=0, suma_kmh=0.0, maxima_kmh=1.0, excesos=7))
+        conn.execute(delete(models.EstadisticasDiarias).where(models.EstadisticasDiarias.fecha == ORIGEN.date()))
+        conn.execute(insert(models.EstadisticasDiarias).values(
+            fecha=(ORIGEN - timedelta(days=5)).date(), total=3, suma_kmh=30.0,
+            maxima_kmh=10.0, minima_kmh=10.0, excesos=0
+        ))
+    assert not _sin_desviaciones()
+
+    with SessionLocal() as db:
+        desviaciones = leer_desviaciones(db)
+        db.commit()
+        # Una medición completada entre la lectura y la corrección no se pierde
+        _paso(cliente, ORIGEN + timedelta(days=1, hours=1), 1.0)
+        for sentencia in sentencias_corregir(desviaciones):
+            db.execute(sentencia)
+        db.commit()
+
+    assert _sin_desviaciones()
+    with SessionLocal() as db:
+        resumen = db.get(models.EstadisticasResumen, ID_RESUMEN)
+        assert resumen.total == 3
+        assert resumen.maxima_kmh == pytest.approx(360.0)
+        assert db.get(models.EstadisticasDiarias, (ORIGEN - timedelta(days=5)).date()) is None
+
+
+def test_reconciliar_sin_forzar_respeta_el_intervalo(cliente):
+    _paso(cliente, ORIGEN, 2.0)
+    with SessionLocal() as db:
+        assert reconciliar(db, forzar=True)
+        assert not reconciliar(db)
+
+
+def test_reconciliar_sustituye_extremos_sin_escrituras_concurrentes(cliente):
+    _paso(cliente, ORIGEN, 2.0)
+    with engine.begin() as conn:
+        conn.execute(update(models.EstadisticasResumen).where(models.EstadisticasResumen.id == ID_RESUMEN)
+                     .values(maxima_kmh=999.0, minima_kmh=0.5))
+    with SessionLocal() as db:
+        assert reconciliar(db, forzar=True)
+        resumen = db.get(models.EstadisticasResumen, ID_RESUMEN)
+        assert (resumen.maxima_kmh, resumen.minima_kmh) == (pytest.approx(180.0), pytest.approx(180.0))
+    assert _sin_desviaciones()
@@ -0,0 +1,69 @@
+"""Backends de estado compartido: publicación de la ingesta y modelos de reloj."""
+
+import json
+from datetime import datetime
+
+from sqlalchemy import event
+
+from database import SessionLocal, engine
+import models
+import ingesta
+from estado_compartido import EstadoMmap, EstadoNotificado
+
+
+def test_notificado_publica_en_la_transaccion_de_la_ingesta(cliente, monkeypatch):
+    notificado = EstadoNotificado(engine)
+    monkeypatch.setattr(ingesta, "estado", notificado)
+    commits = []
+    escuchar = lambda conexion: commits.append(conexion)
+    event.listen(engine, "commit", escuchar)
+    try:
+        medicion = cliente.post("/mediciones/", json={"detector1": "2026-10-18T11:00:00"}).json()
+    finally:
+        event.remove(engine, "commit", escuchar)
+
+    assert len(commits) == 1
+    with SessionLocal() as db:
+        guardado = json.loads(db.get(models.Estado, "ultimo_post").valor)
+    assert guardado["data"]["id"] == medicion["id"]
+    assert notificado.ultimo_post() == guardado
+    assert notificado.generacion() == 1
+
+
+def anotar_latidos(estado, placa, desfase_ms):
+    """Diez latidos, uno por segundo, de una placa adelantada `desfase_ms` respecto a la API."""
+    inicio = 1_792_000_000_000
+    for i in range(10):
+        epoch = inicio + i * 1000
+        estado.anotar_latido(placa, ticks=i * 1000, epoch_ms=epoch, recibido_ms=epoch - desfase_ms)
+
+
+def test_mmap_comparte_los_modelos_de_reloj_entre_procesos(tmp_path):
+    ruta = str(tmp_path / "estado.bin")
+    uno, otro = EstadoMmap(ruta), EstadoMmap(ruta)
+    try:
+        anotar_latidos(uno, "detector1", 250)
+        hora = datetime(2026, 10, 18, 12, 0, 0)
+        corregida = otro.relojes().corregir("detector1", hora)
+        assert abs((hora - corregida).total_seconds() - 0.25) < 1e-6
+        # Los latidos que recibe el otro proceso amplían el mismo modelo
+        otro.anotar_latido("detector1", ticks=10_000, epoch_ms=1_792_000_010_000, recibido_ms=1_792_000_009_750)
+        assert uno.relojes().describir("detector1")["latidos"] == 11
+    finally:
+        uno.cerrar()
+        otro.cerrar()
+
+
+def test_notificado_recarga_los_modelos_de_reloj(cliente):
+    uno, otro = EstadoNotificado(engine), EstadoNotificado(engine)
+    try:
+        anotar_latidos(uno, "detector2", -100)
+        assert otro.relojes().describir("detector2") is None
+        otro._recargar()
+        descripcion = otro.relojes().describir("detector2")
+        assert descripcion["latidos"] == 10
+        assert descripcion == uno.relojes().describir("detector2")
+    finally:
+        with SessionLocal() as db:
+            db.query(models.Estado).delete()
+            db.commit()
@@ -0,0 +1,95 @@
+"""GET /mediciones/export: formatos, filtros y formatos columnares sin pyarrow."""
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import exportacion
+
+INICIO = datetime(2026, 10, 17, 11, 0, 0)
+
+
+@pytest.fixture
+def mediciones(cliente, monkeypatch):
+    """Tres mediciones completas en dos días y dos carriles, y un paso pendiente."""
+    # Bloques pequeños para que la respuesta tenga varios fragmentos
+    monkeypatch.setattr(exportacion, "TAMANO_BLOQUE_EXPORTACION", 2)
+    eventos = []
+    for dias, carril in ((0, "norte"), (1, "norte"), (1, "sur")):
+        inicio = INICIO + timedelta(days=dias)
+        eventos += [
+            {"detector1": inicio.isoformat(), "carril": carril},
+            {"detector2": (inicio + timedelta(seconds=2)).isoformat(), "carril": carril},
+        ]
+    eventos.append({"detector1": (INICIO + timedelta(days=1, hours=1)).isoformat(), "carril": "sur"})
+    resultados = cliente.post("/mediciones/batch", json=eventos).json()["resultados"]
+    return [r["medicion"]["id"] for r in resultados[1:6:2]]
+
+
+def _exportar(cliente, **parametros):
+    respuesta = cliente.get("/mediciones/export", params=parametros)
+    assert respuesta.status_code == 200
+    return respuesta
+
+
+def test_csv_con_cabecera_en_orden_cronologico(cliente, mediciones):
+    respuesta = _exportar(cliente)
+    assert respuesta.headers["content-type"].startswith("text/csv")
+    assert 'filename="mediciones.csv"' in respuesta.headers["content-disposition"]
+    filas = list(csv.DictReader(io.StringIO(respuesta.text)))
+    assert [int(fila["id"]) for fila in filas] == mediciones
+    assert list(filas[0]) == exportacion.COLUMNAS
+    assert filas[0]["timestamp"] == INICIO.isoformat()
+    assert float(filas[0]["tiempo_recorrido"]) == pytest.approx(2.0)
+
+
+def test_csv_sin_filas_solo_tiene_la_cabecera(cliente):
+    assert _exportar(cliente).text.strip() == ",".join(exportacion.COLUMNAS)
+
+
+def test_ndjson_un_objeto_por_linea(cliente, mediciones):
+    respuesta = _exportar(cliente, formato="ndjson", solo_completas=False)
+    assert respuesta.headers["content-type"].startswith("application/x-ndjson")
+    filas = [json.loads(linea) for linea in respuesta.text.splitlines()]
+    assert len(filas) == 4
+    assert [fila["medicion_completa"] for fila in filas] == [True, True, True, False]
+    assert filas[-1]["velocidad_kmh"] is None
+
+
+@pytest.mark.parametrize("parametros, indices", [
+    ({"carril": "sur"}, [2]),
+    ({"fecha_inicio": "2026-10-18"}, [1, 2]),
+    ({"fecha_fin": "2026-10-17"}, [0]),
+    ({"fecha_inicio": "2026-10-18", "fecha_fin": "2026-10-18", "carril": "norte"}, [1]),
+])
+def test_filtros_de_fecha_y_carril(cliente, mediciones, parametros, indices):
+    filas = _exportar(cliente, formato="ndjson", **parametros).text.splitlines()
+    assert [json.loads(fila)["id"] for fila in filas] == [mediciones[i] for i in indices]
+
+
+def test_formato_desconocido(cliente):
+    assert cliente.get("/mediciones/export", params={"formato": "xml"}).status_code == 400
+
+
+@pytest.mark.parametrize("formato", ["parquet", "arrow"])
+def test_formatos_columnares_sin_pyarrow(cliente, monkeypatch, formato):
+    monkeypatch.setattr(exportacion, "pa", None)
+    respuesta = cliente.get("/mediciones/export", params={"formato": formato})
+    assert respuesta.status_code == 501
+    assert "pyarrow" in respuesta.json()["detail"]
+
+
+@pytest.mark.parametrize("formato", ["parquet", "arrow"])
+def test_formatos_columnares_con_pyarrow(cliente, mediciones, formato):
+    pa = pytest.importorskip("pyarrow")
+    contenido = io.BytesIO(_exportar(cliente, formato=formato).content)
+    if formato == "parquet":
+        import pyarrow.parquet as pq
+        tabla = pq.read_table(contenido)
+    else:
+        tabla = pa.ipc.open_stream(contenido).read_all()
+    assert tabla.column_names == exportacion.COLUMNAS
+    assert tabla.column("id").to_pylist() == mediciones
@@ -0,0 +1,146 @@
+"""Firmware de la placa (placa/) en CPython: buffer en flash, cola de interrupciones y envío por lotes."""
+
+import importlib
+import json
+import os
+import sys
+import time
+
+import pytest
+
+# Detrás de api/: placa/ tiene su propio main.py
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "placa"))
+import cpython_shim  # noqa: E402
+
+MODULOS_FIRMWARE = ("buffer_eventos", "enviador")
+
+
+@pytest.fixture
+def firmware():
+    """Módulos del firmware importados con los sustitutos de MicroPython; al terminar se deshace todo."""
+    with cpython_shim.instalado():
+        for nombre in MODULOS_FIRMWARE:
+            sys.modules.pop(nombre, None)
+        yield {nombre: importlib.import_module(nombre) for nombre in MODULOS_FIRMWARE}
+        for nombre in MODULOS_FIRMWARE:
+            sys.modules.pop(nombre, None)
+
+
+@pytest.fixture
+def ruta(tmp_path):
+    return str(tmp_path / "eventos.bin")
+
+
+def test_instalado_restaura_time_al_salir():
+    with cpython_shim.instalado():
+        assert time.time() < cpython_shim.time_unix() - cpython_shim.UNIX_OFFSET + 1
+        assert "urequests" in sys.modules
+    assert time.time() == pytest.approx(cpython_shim.time_unix(), abs=1)
+    assert not hasattr(time, "ticks_ms")
+    assert "urequests" not in sys.modules
+
+
+def test_buffer_lleno_descarta_los_mas_antiguos(firmware, ruta):
+    buffer = firmware["buffer_eventos"].BufferEventos(ruta, capacidad=4)
+    for i in range(1, 7):
+        buffer.anotar(1, 1000 * i)
+    assert len(buffer) == 4
+    assert buffer.perdidos == 2
+    assert [ms for _, ms, _ in buffer.pendientes(10)] == [3000, 4000, 5000, 6000]
+
+
+def test_buffer_recupera_lo_no_enviado_al_reabrir(firmware, ruta):
+    BufferEventos = firmware["buffer_eventos"].BufferEventos
+    buffer = BufferEventos(ruta, capacidad=4)
+    for i in range(1, 6):
+        buffer.anotar(2, 1000 * i, dato=i)
+    # El primero se sobrescribió al dar la vuelta; se confirman los dos siguientes
+    buffer.confirmar(2)
+
+    reabierto = BufferEventos(ruta, capacidad=4)
+    assert len(reabierto) == 2
+    assert reabierto.pendientes(10) == [(2, 4000, 4), (2, 5000, 5)]
+    # Un registro dañado (corte a mitad de escritura) no se recupera: el quinto
+    # ocupa la primera posición del fichero
+    with open(ruta, "r+b") as fichero:
+        fichero.write(b"\xff")
+    assert BufferEventos(ruta, capacidad=4).pendientes(10) == [(2, 4000, 4)]
+
+
+def test_cola_irq_apunta_flancos_sin_pasarse_de_capacidad(firmware):
+    from machine import Pin
+
+    cola = firmware["buffer_eventos"].ColaIRQ(capacidad=3)
+    sensor = Pin(12, Pin.IN)
+    sensor.irq(trigger=Pin.IRQ_RISING, handler=lambda pin: cola.poner(1, time.ticks_ms()))
+    for _ in range(3):
+        sensor.simular(1)
+        sensor.simular(0)
+    # Una posición queda libre para distinguir la cola llena de la vacía
+    assert cola.perdidos == 1
+    assert cola.primero()[0] == 1
+    cola.quitar()
+    cola.quitar()
+    assert cola.primero() is None
+
+
+def _enviador(firmware, ruta, respuestas):
+    """EnviadorLotes cuyo transporte devuelve (o lanza) cada elemento de `respuestas` por orden."""
+    modulo = firmware["enviador"]
+    buffer = firmware["buffer_eventos"].BufferEventos(ruta, capacidad=8)
+    enviador = modulo.EnviadorLotes(
+        "http://api/mediciones/batch", buffer, carril="norte",
+        tamano_lote=2, backoff_min_ms=1000, backoff_max_ms=3000
+    )
+    cuerpos = []
+
+    def transporte(url, datos, cabeceras):
+        cuerpos.append(json.loads(datos))
+        respuesta = respuestas.pop(0)
+        if isinstance(respuesta, Exception):
+            raise respuesta
+        return respuesta
+
+    modulo.urequests.transporte = transporte
+    return enviador, buffer, cuerpos
+
+
+def test_enviador_solo_confirma_con_respuesta_2xx(firmware, ruta):
+    TIPO_MEDICION = firmware["buffer_eventos"].TIPO_MEDICION
+    enviador, buffer, cuerpos = _enviador(firmware, ruta, [503, OSError("sin red"), 201])
+    buffer.anotar(1, 1000)
+    buffer.anotar(TIPO_MEDICION, 2000, 1500000)
+
+    assert not enviador.atender()
+    cpython_shim.avanzar(1000)
+    assert not enviador.atender()
+    assert len(buffer) == 2
+    assert enviador.fallos == 2
+
+    cpython_shim.avanzar(2000)
+    assert enviador.atender()
+    assert len(buffer) == 0
+    assert enviador.enviados == 2
+    assert cuerpos[-1] == [
+        {"detector1": 1000, "carril": "norte"},
+        {"detector1": 2000, "tiempo_recorrido": 1.5, "carril": "norte"},
+    ]
+
+
+def test_enviador_espera_con_backoff_exponencial_tras_un_fallo(firmware, ruta):
+    enviador, buffer, cuerpos = _enviador(firmware, ruta, [500, 500, 500, 500, 200])
+    buffer.anotar(1, 1000)
+    buffer.anotar(2, 2000)
+
+    esperas = []
+    for _ in range(4):
+        assert not enviador.atender()
+        esperas.append(enviador.backoff_ms)
+        # Durante la espera no se reintenta
+        assert not enviador.atender()
+        cpython_shim.avanzar(enviador.backoff_ms)
+    assert esperas == [1000, 2000, 3000, 3000]
+    assert len(cuerpos) == 4
+
+    assert enviador.atender()
+    assert enviador.backoff_ms == 0
@@ -0,0 +1,78 @@
+"""Métricas de /metrics: pasos pendientes por carril y duración de las peticiones."""
+
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, update
+
+from database import engine
+import models
+
+ORIGEN = datetime(2026, 10, 18, 11, 0, 0)
+
+
+def _metricas(cliente, nombre: str) -> dict:
+    """Valores de una métrica de /metrics por línea de etiquetas."""
+    valores = {}
+    for linea in cliente.get("/metrics").text.splitlines():
+        if linea.startswith(nombre + "{"):
+            etiquetas, valor = linea.rsplit(" ", 1)
+            valores[etiquetas[len(nombre):]] = float(valor)
+    return valores
+
+
+def test_pendientes_con_varios_workers_se_leen_de_la_tabla(cliente, monkeypatch):
+    from ingesta import estado
+
+    monkeypatch.setattr(estado, "compartido", True)
+    propio = cliente.post("/mediciones/", json={"detector1": ORIGEN.isoformat(), "carril": "norte"}).json()
+    with engine.begin() as conn:
+        # Otro worker completa el paso de este e inicia uno en otro carril
+        conn.execute(update(models.Medicion).where(models.Medicion.id == propio["id"]).values(
+            medicion_completa=True, es_primera_medicion=False
+        ))
+        conn.execute(insert(models.Medicion).values(
+            timestamp=ORIGEN, distancia=100.0, carril="sur",
+            es_primera_medicion=True, medicion_completa=False
+        ))
+
+    assert _metricas(cliente, "radar_pasos_pendientes") == {'{carril="sur"}': 1.0}
+    assert list(_metricas(cliente, "radar_paso_pendiente_antiguedad_segundos")) == ['{carril="sur"}']
+
+
+def _atender(app, ruta: str):
+    """Pasa una petición GET por MiddlewareMetricas sobre la app ASGI `app`."""
+    from types import SimpleNamespace
+
+    from metricas import MiddlewareMetricas
+
+    scope = {"type": "http", "method": "GET", "path": ruta, "route": SimpleNamespace(path=ruta)}
+
+    async def recibir():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def enviar(mensaje):
+        pass
+
+    asyncio.run(MiddlewareMetricas(app)(scope, recibir, enviar))
+
+
+@pytest.mark.parametrize("tipo, maximo", [(b"text/event-stream", 0.05), (b"text/csv", None)])
+def test_los_streams_sse_se_miden_hasta_las_cabeceras(tipo, maximo):
+    from metricas import peticiones_http
+
+    ruta = "/prueba/" + tipo.decode()
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", tipo)]})
+        await asyncio.sleep(0.2)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    _atender(app, ruta)
+    cubos = peticiones_http.valores()[("GET", ruta, "200")]
+    assert sum(cubos[:-1]) == 1
+    if maximo is None:
+        assert cubos[-1] >= 0.2
+    else:
+        assert cubos[-1] < maximo
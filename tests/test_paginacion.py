@@ -0,0 +1,54 @@
+"""Paginación por cursor de GET /mediciones/."""
+
+from datetime import datetime, timedelta
+
+ORIGEN = datetime(2026, 10, 18, 11, 0, 0)
+
+
+def _crear_mediciones(cliente, cantidad: int, desde: int = 0) -> list:
+    """Mediciones completas, una por minuto a partir de ORIGEN + `desde` minutos; devuelve sus ids."""
+    eventos = []
+    for i in range(desde, desde + cantidad):
+        inicio = ORIGEN + timedelta(minutes=i)
+        eventos += [
+            {"detector1": inicio.isoformat()},
+            {"detector2": (inicio + timedelta(seconds=2)).isoformat()},
+        ]
+    resultados = cliente.post("/mediciones/batch", json=eventos).json()["resultados"]
+    return [r["medicion"]["id"] for r in resultados[1::2]]
+
+
+def _ids(respuesta) -> list:
+    return [medicion["id"] for medicion in respuesta.json()]
+
+
+def test_cursores_recorren_las_paginas_en_ambos_sentidos(cliente):
+    ids = _crear_mediciones(cliente, 5)[::-1]  # más recientes primero
+
+    primera = cliente.get("/mediciones/", params={"limit": 2})
+    assert _ids(primera) == ids[:2]
+    assert "X-Cursor-Anterior" not in primera.headers
+
+    segunda = cliente.get("/mediciones/", params={"limit": 2, "cursor": primera.headers["X-Cursor-Siguiente"]})
+    assert _ids(segunda) == ids[2:4]
+
+    tercera = cliente.get("/mediciones/", params={"limit": 2, "cursor": segunda.headers["X-Cursor-Siguiente"]})
+    assert _ids(tercera) == ids[4:]
+    assert "X-Cursor-Siguiente" not in tercera.headers
+
+    vuelta = cliente.get("/mediciones/", params={"limit": 2, "cursor": tercera.headers["X-Cursor-Anterior"]})
+    assert _ids(vuelta) == ids[2:4]
+    assert vuelta.headers["X-Cursor-Siguiente"] == segunda.headers["X-Cursor-Siguiente"]
+
+
+def test_cursor_no_se_salta_mediciones_nuevas(cliente):
+    ids = _crear_mediciones(cliente, 3)[::-1]
+    primera = cliente.get("/mediciones/", params={"limit": 2})
+    # Una medición más reciente no desplaza la página siguiente, a diferencia de skip
+    _crear_mediciones(cliente, 1, desde=10)
+    segunda = cliente.get("/mediciones/", params={"limit": 2, "cursor": primera.headers["X-Cursor-Siguiente"]})
+    assert _ids(segunda) == ids[2:]
+
+
+def test_cursor_no_valido(cliente):
+    assert cliente.get("/mediciones/", params={"cursor": "no-es-un-cursor"}).status_code == 400
@@ -0,0 +1,72 @@
+"""Modelos de reloj de las placas: desfase, deriva y corrección de los eventos."""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from relojes import ModeloReloj, Relojes
+
+INICIO_MS = 1_792_000_000_000
+
+
+def _latidos(modelo: ModeloReloj, cantidad: int, desfase_ms: float, deriva: float, base: int = 0) -> None:
+    """Latidos cada 10 s de una placa cuyo desfase es desfase_ms + deriva (ms/s) · t."""
+    for i in range(cantidad):
+        epoch = INICIO_MS + i * 10_000
+        modelo.anotar(ticks=epoch - INICIO_MS - base, epoch_ms=epoch, recibido_ms=epoch + desfase_ms + deriva * i * 10)
+
+
+def test_modelo_estima_desfase_y_deriva():
+    modelo = ModeloReloj(ventana=60)
+    _latidos(modelo, 20, desfase_ms=200.0, deriva=0.05)
+    assert modelo.deriva == pytest.approx(0.05)
+    assert modelo.desfase(INICIO_MS) == pytest.approx(200.0)
+    # Una hora después del primer latido el desfase creció 180 ms
+    assert modelo.desfase(INICIO_MS + 3_600_000) == pytest.approx(380.0)
+
+
+def test_modelo_sin_latidos_suficientes_no_estima_deriva():
+    modelo = ModeloReloj()
+    assert modelo.desfase(INICIO_MS) == 0.0
+    _latidos(modelo, 2, desfase_ms=-40.0, deriva=0.05)
+    assert modelo.deriva == 0.0
+    assert modelo.desfase(INICIO_MS) == pytest.approx(-39.75)
+
+
+def test_modelo_reinicia_si_la_placa_vuelve_a_poner_la_hora():
+    modelo = ModeloReloj()
+    _latidos(modelo, 5, desfase_ms=100.0, deriva=0.0)
+    # Misma hora de la placa con ticks_ms desplazados 5 s: la placa reinició
+    _latidos(modelo, 1, desfase_ms=-20.0, deriva=0.0, base=5000)
+    assert len(modelo.puntos) == 1
+    assert modelo.latidos == 6
+    assert modelo.desfase(INICIO_MS) == pytest.approx(-20.0)
+
+
+def test_exportar_e_importar_conservan_el_modelo():
+    relojes = Relojes(ventana=10)
+    for i in range(15):
+        epoch = INICIO_MS + i * 10_000
+        relojes.latido("placa", ticks=i * 10_000, epoch_ms=epoch, recibido_ms=epoch + 30 + i)
+    copia = Relojes.importar(relojes.exportar(), ventana=10)
+    original, importado = relojes._modelos["placa"], copia._modelos["placa"]
+    assert list(importado.puntos) == list(original.puntos)
+    assert importado.deriva == pytest.approx(original.deriva)
+    assert importado.desfase(INICIO_MS) == pytest.approx(original.desfase(INICIO_MS))
+
+
+def test_eventos_de_placas_con_relojes_distintos_se_corrigen(cliente):
+    ahora_ms = int(time.time() * 1000)
+    cliente.post("/relojes/latido", json={"placa": "entrada", "ticks": 1000, "epoch": ahora_ms})
+    # La placa de salida va 300 ms adelantada
+    salida = cliente.post("/relojes/latido", json={"placa": "salida", "ticks": 1000, "epoch": ahora_ms + 300}).json()
+    assert salida["desfase_ms"] == pytest.approx(-300, abs=50)
+
+    inicio = datetime(2026, 10, 18, 11, 0, 0)
+    cliente.post("/mediciones/", json={"detector1": inicio.isoformat(), "placa": "entrada"})
+    medicion = cliente.post("/mediciones/", json={
+        "detector2": (inicio + timedelta(seconds=2.3)).isoformat(), "placa": "salida"
+    }).json()
+    assert medicion["tiempo_recorrido"] == pytest.approx(2.0, abs=0.05)
+    assert {r["placa"] for r in cliente.get("/relojes/").json()} >= {"entrada", "salida"}
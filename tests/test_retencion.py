@@ -0,0 +1,63 @@
+"""Retención de mediciones antiguas en SQLite: archivo mensual y estadísticas conservadas."""
+
+import glob
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, insert, select
+
+from database import SessionLocal
+import models
+import retencion
+from estadisticas import CLAVE_FRONTERA, reconciliar
+
+
+def _medicion(timestamp: datetime, kmh: float) -> dict:
+    return dict(
+        timestamp=timestamp, distancia=100.0, velocidad_ms=kmh / 3.6, velocidad_kmh=kmh,
+        tiempo_recorrido=360.0 / kmh, es_primera_medicion=False, medicion_completa=True,
+        carril="principal"
+    )
+
+
+@pytest.fixture
+def retencion_30_dias(tmp_path, monkeypatch):
+    monkeypatch.setattr(retencion, "RETENCION_DIAS", 30)
+    monkeypatch.setattr(retencion, "DIRECTORIO_ARCHIVO", str(tmp_path))
+    yield str(tmp_path)
+    with SessionLocal() as db:
+        db.query(models.Estado).filter(
+            models.Estado.clave.in_([CLAVE_FRONTERA, retencion.CLAVE_MANTENIMIENTO])
+        ).delete()
+        db.commit()
+
+
+def test_retencion_archiva_y_conserva_las_estadisticas(cliente, retencion_30_dias):
+    ahora = datetime.now()
+    with SessionLocal() as db:
+        db.execute(insert(models.Medicion), [
+            _medicion(ahora - timedelta(days=40), 50.0),
+            _medicion(ahora - timedelta(days=35), 90.0),
+            _medicion(ahora - timedelta(days=1), 70.0),
+        ])
+        db.commit()
+        reconciliar(db, forzar=True)
+    antes = cliente.get("/estadisticas/").json()
+
+    frontera = retencion.mantener(forzar=True)
+    assert frontera == retencion.fecha_corte()
+    with SessionLocal() as db:
+        assert db.scalar(select(func.count()).select_from(models.Medicion)) == 1
+        reconciliar(db, forzar=True)
+    archivadas = 0
+    for ruta in glob.glob(os.path.join(retencion_30_dias, "mediciones_*.db")):
+        with closing(sqlite3.connect(ruta)) as archivo:
+            archivadas += archivo.execute("SELECT count(*) FROM mediciones").fetchone()[0]
+    assert archivadas == 2
+    assert cliente.get("/estadisticas/").json() == antes
+
+    # Nada más que hacer hasta que caduquen otras mediciones
+    assert retencion.mantener(forzar=True) is None
@@ -0,0 +1,134 @@
+"""Acumulado en memoria de las series de velocidad y su volcado a la tabla."""
+
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from database import SessionLocal, engine
+import models
+import series
+from series import AcumuladorSeries, CLAVE_SERIES, inicio_intervalo, init_series
+
+
+def _fila(timestamp, velocidad_kmh=36.0):
+    return {"timestamp": timestamp, "velocidad_kmh": velocidad_kmh}
+
+
+def test_inicio_intervalo_con_zona_es_hora_local_naive():
+    timestamp = datetime(2026, 10, 18, 11, 30, 15, tzinfo=timezone.utc)
+    local = timestamp.astimezone().replace(tzinfo=None)
+    assert inicio_intervalo(timestamp, "minuto") == local.replace(second=0)
+    assert inicio_intervalo(timestamp, "hora") == local.replace(minute=0, second=0)
+    assert inicio_intervalo(timestamp, "dia").tzinfo is None
+
+
+def test_volcar_timestamps_con_zona_y_naive(cliente):
+    timestamp = datetime(2026, 10, 18, 11, 30, tzinfo=timezone.utc)
+    acumulador = AcumuladorSeries()
+    acumulador.registrar([_fila(timestamp), _fila(timestamp.astimezone().replace(tzinfo=None), 72.0)])
+    assert len(acumulador) == 3
+
+    with SessionLocal() as db:
+        assert acumulador.volcar(db) == 3
+        fila = db.execute(select(models.SerieVelocidad).where(
+            models.SerieVelocidad.granularidad == "minuto"
+        )).scalar_one()
+    assert len(acumulador) == 0
+    assert fila.total == 2
+    assert fila.suma_kmh == pytest.approx(108.0)
+
+
+def test_volcar_conserva_el_acumulado_tras_un_error_transitorio(cliente, monkeypatch):
+    acumulador = AcumuladorSeries()
+    acumulador.registrar([_fila(datetime(2026, 10, 18, 11, 30))])
+
+    def fallar(db, claves, pendientes):
+        raise OperationalError("UPSERT", {}, Exception("database is locked"))
+
+    monkeypatch.setattr(AcumuladorSeries, "_volcar_bloque", staticmethod(fallar))
+    with SessionLocal() as db, pytest.raises(OperationalError):
+        acumulador.volcar(db)
+    assert len(acumulador) == 3
+
+
+def test_volcar_descarta_el_bloque_tras_un_error_permanente(cliente, monkeypatch):
+    acumulador = AcumuladorSeries()
+    acumulador.registrar([_fila(datetime(2026, 10, 18, 11, 30))])
+
+    def fallar(db, claves, pendientes):
+        raise IntegrityError("UPSERT", {}, Exception("violación de restricción"))
+
+    monkeypatch.setattr(AcumuladorSeries, "_volcar_bloque", staticmethod(fallar))
+    with SessionLocal() as db:
+        assert acumulador.volcar(db) == 0
+    assert len(acumulador) == 0
+
+
+def _medicion(completa: bool, minuto: int = 0) -> int:
+    with engine.begin() as conn:
+        return conn.execute(insert(models.Medicion).values(
+            timestamp=datetime(2026, 10, 18, 11, minuto), distancia=100.0,
+            velocidad_kmh=36.0 if completa else None, carril="principal",
+            es_primera_medicion=not completa, medicion_completa=completa
+        )).inserted_primary_key[0]
+
+
+def _total_diario() -> int:
+    with SessionLocal() as db:
+        return sum(db.scalars(select(models.SerieVelocidad.total).where(
+            models.SerieVelocidad.granularidad == "dia"
+        )))
+
+
+@pytest.fixture
+def sin_relleno():
+    """Borra el marcador del relleno inicial y lo deja como terminado al acabar."""
+    with SessionLocal() as db:
+        marcador = db.get(models.Estado, CLAVE_SERIES)
+        anterior = marcador.valor if marcador is not None else datetime.now().isoformat()
+        db.query(models.Estado).filter(models.Estado.clave == CLAVE_SERIES).delete()
+        db.commit()
+    yield
+    with SessionLocal() as db:
+        db.merge(models.Estado(clave=CLAVE_SERIES, valor=anterior))
+        db.commit()
+
+
+def test_relleno_solo_suma_lo_completo_en_la_frontera(cliente, sin_relleno):
+    _medicion(True)
+    pendiente = _medicion(False, minuto=1)
+    with SessionLocal() as db:
+        series._reservar_relleno(db)
+    # Después de fijar la frontera, los workers ya acumulan en memoria estas mediciones
+    with engine.begin() as conn:
+        conn.execute(update(models.Medicion).where(models.Medicion.id == pendiente).values(
+            velocidad_kmh=36.0, es_primera_medicion=False, medicion_completa=True
+        ))
+    _medicion(True, minuto=2)
+
+    with SessionLocal() as db:
+        init_series(db)
+        assert series._frontera_relleno(db.get(models.Estado, CLAVE_SERIES).valor) is None
+    assert _total_diario() == 1
+
+
+def test_relleno_interrumpido_se_repite_al_arrancar(cliente, sin_relleno, monkeypatch):
+    _medicion(True)
+    _medicion(True, minuto=1)
+    volcar_bloque = AcumuladorSeries._volcar_bloque
+
+    def morir(db, claves, pendientes):
+        raise RuntimeError("proceso terminado")
+
+    monkeypatch.setattr(AcumuladorSeries, "_volcar_bloque", staticmethod(morir))
+    with SessionLocal() as db, pytest.raises(RuntimeError):
+        init_series(db)
+    assert _total_diario() == 0
+
+    monkeypatch.setattr(AcumuladorSeries, "_volcar_bloque", staticmethod(volcar_bloque))
+    with SessionLocal() as db:
+        init_series(db)
+        init_series(db)
+    assert _total_diario() == 2
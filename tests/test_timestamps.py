@@ -0,0 +1,69 @@
+"""Timestamps ISO con zona horaria, naive y unix (segundos y milisegundos)."""
+
+from datetime import datetime, timezone
+
+import pytest
+
+from ingesta import convertir_timestamp
+
+
+def _local(iso: str) -> datetime:
+    return datetime.fromisoformat(iso).astimezone().replace(tzinfo=None)
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    ("2026-10-18T11:00:00Z", _local("2026-10-18T11:00:00+00:00")),
+    ("2026-10-18T11:00:00+02:00", _local("2026-10-18T11:00:00+02:00")),
+    ("2026-10-18T11:00:00", datetime(2026, 10, 18, 11, 0, 0)),
+    (1792321200, datetime.fromtimestamp(1792321200)),
+    (1792321200500, datetime.fromtimestamp(1792321200.5)),
+    (datetime(2026, 10, 18, 11, tzinfo=timezone.utc), _local("2026-10-18T11:00:00+00:00")),
+])
+def test_convertir_timestamp_devuelve_hora_local_naive(valor, esperado):
+    convertido = convertir_timestamp(valor)
+    assert convertido.tzinfo is None
+    assert convertido == esperado
+
+
+@pytest.mark.parametrize("detector1, detector2", [
+    ("2026-10-18T11:00:00Z", "2026-10-18T11:00:02Z"),
+    ("2026-10-18T11:00:00+00:00", "2026-10-18T11:00:02+00:00"),
+    (1792321200, 1792321202),
+    (1792321200000, 1792321202000),
+])
+def test_lote_con_timestamps_con_zona_o_unix(cliente, detector1, detector2):
+    respuesta = cliente.post("/mediciones/batch", json=[
+        {"detector1": detector1}, {"detector2": detector2}
+    ])
+    assert respuesta.status_code == 200
+    estados = [r["estado"] for r in respuesta.json()["resultados"]]
+    assert estados == ["pendiente", "completada"]
+    medicion = respuesta.json()["resultados"][1]["medicion"]
+    assert medicion["tiempo_recorrido"] == pytest.approx(2.0)
+
+
+@pytest.mark.parametrize("detector1", ["2026-10-18T11:00:00Z", "2026-10-18T13:00:00+02:00"])
+def test_medicion_completa_con_timestamp_con_zona(cliente, detector1):
+    respuesta = cliente.post("/mediciones/", json={"detector1": detector1, "tiempo_recorrido": 4.0})
+    assert respuesta.status_code == 200
+    medicion = respuesta.json()
+    assert medicion["medicion_completa"] is True
+    assert datetime.fromisoformat(medicion["timestamp"]) == _local("2026-10-18T11:00:00+00:00")
+
+    guardada = cliente.get(f"/mediciones/{medicion['id']}").json()
+    assert guardada["tiempo_recorrido"] == pytest.approx(4.0)
+    assert guardada["velocidad_ms"] == pytest.approx(medicion["distancia"] / 4.0)
+
+
+def test_estado_con_paso_pendiente_con_zona(cliente):
+    from consultas import respuesta_estado
+
+    desde = datetime.now(timezone.utc)
+    estado = respuesta_estado([("principal", 1, desde)], 100.0, 50.0)
+    assert 0.0 <= estado.carriles[0].antiguedad_segundos < 60.0
+
+    cliente.post("/mediciones/", json={"detector1": desde.isoformat()})
+    respuesta = cliente.get("/estado/")
+    assert respuesta.status_code == 200
+    assert respuesta.json()["esperando_sensor2"] is True
+    assert 0.0 <= respuesta.json()["carriles"][0]["antiguedad_segundos"] < 60.0